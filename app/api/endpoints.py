@@ -1,22 +1,40 @@
+import asyncio
 import shutil
 import os
+import sys
+import traceback
+import requests
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from typing import Optional, List
 from app.core.config import settings
 from app.core.logger import logger
 from app.schemas.task import MeetingResponse, ArchiveRequest, ArchiveResponse, TranscriptItem
 from app.services.vector import vector_service
+from app.services.archive_queue import archive_queue
+from app.services.funasr_service import invalidate_result_cache_fingerprint
 from app.services.asr_factory import get_asr_service_by_name
 from app.services.llm_factory import get_llm_service, get_llm_service_by_name
 import markdown
 from app.services.document import document_service 
 # 延迟导入 voice_service，避免阻塞主服务启动
-# from app.services.voice_service import voice_service
+# from app.services.voice_service import get_voice_service
 import uuid
 
 # 创建路由器
 router = APIRouter()
 
+
+def _parse_speaker_id(raw_id) -> int:
+    """把 ASR 返回的 speaker_id 统一转成整数（如 "spk0" -> 0），无法解析时为 0"""
+    if isinstance(raw_id, str):
+        # 如果是字符串（如 "spk0"），提取数字部分
+        try:
+            return int(''.join(filter(str.isdigit, raw_id)) or "0")
+        except ValueError:
+            return 0
+    return int(raw_id)
+
+
 @router.post("/process", response_model=MeetingResponse)
 async def process_meeting_audio(
     # ========== 输入源参数（以下7种方式任选其一）==========
@@ -225,21 +243,18 @@ async def process_meeting_audio(
                 transcript = asr_result.get("transcript", [])
                 if transcript:
                     max_speaker_id = 0
+                    # 原始 speaker_id -> 新编号：每个不同的说话人只解析一次，其余句子直接查表
+                    id_map = {}
                     for item in transcript:
-                        if item.get("speaker_id") is not None:
-                            original_id = item["speaker_id"]
-                            # 统一转换为整数处理
-                            if isinstance(original_id, str):
-                                # 如果是字符串（如 "spk0"），提取数字部分
-                                try:
-                                    original_id = int(''.join(filter(str.isdigit, original_id)) or "0")
-                                except:
-                                    original_id = 0
-                            else:
-                                original_id = int(original_id)
-                            
-                            item["speaker_id"] = original_id + current_speaker_offset
-                            max_speaker_id = max(max_speaker_id, item["speaker_id"])
+                        original_id = item.get("speaker_id")
+                        if original_id is None:
+                            continue
+                        new_id = id_map.get(original_id)
+                        if new_id is None:
+                            new_id = _parse_speaker_id(original_id) + current_speaker_offset
+                            id_map[original_id] = new_id
+                            max_speaker_id = max(max_speaker_id, new_id)
+                        item["speaker_id"] = new_id
                     
                     if max_speaker_id > 0:
                         current_speaker_offset = max_speaker_id
@@ -265,7 +280,6 @@ async def process_meeting_audio(
             print(f"\n{'='*80}")
             print(f"📨 收到新的音频处理请求")
             print(f"{'='*80}")
-            import sys
             sys.stderr.flush()
             sys.stdout.flush()
             
@@ -535,7 +549,6 @@ async def process_meeting_audio(
             # ... (错误处理保持不变)
             transcript_items = []
             if transcript_data:
-                from app.schemas.task import TranscriptItem
                 transcript_items = [
                     TranscriptItem(**item) for item in transcript_data
                 ]
@@ -617,7 +630,6 @@ async def process_meeting_audio(
         # 构建返回
         transcript_items = []
         if transcript_data:
-            from app.schemas.task import TranscriptItem
             transcript_items = [
                 TranscriptItem(
                     text=item.get("text", ""),
@@ -642,7 +654,6 @@ async def process_meeting_audio(
 
     except Exception as e:
         logger.error(f"❌ 接口处理异常: {str(e)}")
-        import traceback
         logger.error(traceback.format_exc())
         return MeetingResponse(
             status="error", 
@@ -687,22 +698,23 @@ async def archive_meeting_knowledge(request: ArchiveRequest):
                 message="向量服务不可用，请检查Chroma配置"
             )
         
-        # 1. 调用向量服务保存数据
-        # 这里的 save_knowledge 会自动把长文本切成 500 字的小块
-        saved_chunks = vector_service.save_knowledge(
+        # 1. 切片后加入归档队列，向量化与写入由后台协程批量完成
+        # 这里会自动把长文本切成 500 字的小块
+        # 写入结果由队列记录（失败会记日志），可通过 /archive/{minutes_id}/status 查询
+        chunk_count, _ = await archive_queue.enqueue(
             text=request.markdown_content,
             source_id=request.minutes_id,
             extra_meta={"user_id": request.user_id}
         )
 
-        # 2. 使用实际保存的切片数量
-        estimated_chunks = saved_chunks if saved_chunks > 0 else len(request.markdown_content) // 500 + 1
+        # 2. 返回入队的切片数量
+        estimated_chunks = chunk_count if chunk_count > 0 else len(request.markdown_content) // 500 + 1
 
-        logger.info(f"✅ 归档成功! ID={request.minutes_id}")
+        logger.info(f"✅ 归档已受理! ID={request.minutes_id}")
         
         return ArchiveResponse(
-            status="success", 
-            message="已成功存入企业知识库",
+            status="accepted", 
+            message="归档已受理，正在后台写入企业知识库",
             chunks_count=estimated_chunks
         )
 
@@ -711,6 +723,33 @@ async def archive_meeting_knowledge(request: ArchiveRequest):
         # 即使报错也不要让 Java 那边崩溃，返回错误信息即可
         return ArchiveResponse(status="error", message=f"归档异常: {str(e)}")
     
+@router.get("/archive/{minutes_id}/status")
+async def get_archive_status(minutes_id: int):
+    """
+    查询归档结果（/archive 只表示已受理，实际写入在后台完成）
+    """
+    status = archive_queue.get_status(minutes_id)
+    if status is None:
+        return {"code": 404, "message": "未找到该纪要的归档记录", "data": None}
+    return {"code": 200, "message": "获取成功", "data": {"minutes_id": minutes_id, **status}}
+
+
+def _notify_voice_library_changed() -> None:
+    """声纹库变更后通知 FunASR 服务重新载入内存声纹库（未配置服务或请求失败时仅记录警告）"""
+    funasr_url = getattr(settings, "FUNASR_SERVICE_URL", "")
+    if not funasr_url:
+        return
+    try:
+        response = requests.post(f"{funasr_url.rstrip('/')}/voice/reload", timeout=10)
+        if response.status_code != 200 or response.json().get("code") != 0:
+            logger.warning(f"⚠️ FunASR 服务刷新声纹库失败: {response.text}")
+    except Exception as e:
+        logger.warning(f"⚠️ 通知 FunASR 服务刷新声纹库失败: {e}")
+    finally:
+        # 服务端声纹库已刷新，识别结果缓存的指纹需要重新读取（缓存的结果里带有匹配到的姓名）
+        invalidate_result_cache_fingerprint()
+
+
 @router.post("/api/voice/register")
 async def register_employee_voice(
     file: UploadFile = File(..., description="员工录音文件(wav/mp3)"),
@@ -742,7 +781,7 @@ async def register_employee_voice(
 
         # 2. 延迟导入 voice_service（避免启动时加载）
         try:
-            from app.services.voice_service import voice_service
+            from app.services.voice_service import get_voice_service
         except ImportError as e:
             logger.error(f"❌ 声纹服务未安装或依赖缺失: {e}")
             return {
@@ -751,18 +790,32 @@ async def register_employee_voice(
                 "data": None
             }
         
-        # 3. 调用服务提取向量
-        vector = voice_service.extract_vector(str(temp_file_path))
+        # 首次调用会加载 Cam++ 模型，放到线程池，不阻塞事件循环
+        try:
+            voice_service = await asyncio.to_thread(get_voice_service)
+        except RuntimeError as e:
+            logger.error(f"❌ 声纹服务不可用: {e}")
+            return {
+                "code": 500,
+                "message": "声纹服务初始化失败，请联系管理员",
+                "data": None
+            }
+        
+        # 3. 调用服务提取向量（模型推理放到线程池，不阻塞事件循环）
+        vector = await asyncio.to_thread(voice_service.extract_vector, str(temp_file_path))
         
-        if not vector:
+        if vector is None or len(vector) == 0:
             return {
                 "code": 400,
                 "message": "音频质量过差或过短，无法提取声纹特征，请重录",
                 "data": None
             }
 
-        # 4. 存入库
-        voice_service.save_identity(employee_id, name, vector)
+        # 4. 存入库（异步 Chroma 客户端）
+        await voice_service.asave_identity(employee_id, name, vector)
+        
+        # 5. 通知 FunASR 服务刷新内存声纹库，新员工立即可被匹配（失败不影响注册结果）
+        await asyncio.to_thread(_notify_voice_library_changed)
 
         return {
             "code": 200,
@@ -798,9 +851,6 @@ async def get_hotwords():
     转发到FunASR服务获取热词
     """
     try:
-        import requests
-        from app.core.config import settings
-        
         # 构建FunASR服务URL
         funasr_url = getattr(settings, "FUNASR_SERVICE_URL", "http://localhost:8002")
         response = requests.get(f"{funasr_url}/hotwords", timeout=5)
@@ -827,9 +877,6 @@ async def reload_hotwords():
     转发到FunASR服务重新加载热词（用于修改funasr_standalone/hotwords.json后刷新）
     """
     try:
-        import requests
-        from app.core.config import settings
-        
         # 构建FunASR服务URL
         funasr_url = getattr(settings, "FUNASR_SERVICE_URL", "http://localhost:8002")
         response = requests.post(f"{funasr_url}/hotwords/reload", timeout=5)
@@ -837,6 +884,7 @@ async def reload_hotwords():
         if response.status_code == 200:
             data = response.json()
             if data.get("code") == 0:
+                invalidate_result_cache_fingerprint()
                 return {
                     "code": 200,
                     "message": "热词重载成功",
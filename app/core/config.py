@@ -48,6 +48,8 @@ class Settings:
 
     # --- 向量数据库配置（Chroma）---
     VECTOR_STORE_TYPE: str = os.getenv("VECTOR_STORE_TYPE", "chroma")
+    CHROMA_MODE: str = os.getenv("CHROMA_MODE", "http")  # http（远程服务）/ local（进程内持久化，仅作用于知识库；声纹库始终走远程，与 funasr_standalone 共用）
+    CHROMA_PATH: str = os.getenv("CHROMA_PATH", "./chroma_data")  # CHROMA_MODE=local 时的数据目录
     CHROMA_HOST: str = os.getenv("CHROMA_HOST", "192.168.211.74")
     CHROMA_PORT: int = int(os.getenv("CHROMA_PORT", "8000"))
     CHROMA_COLLECTION_NAME: str = os.getenv("CHROMA_COLLECTION_NAME", "employee_voice_library")
@@ -68,6 +70,16 @@ class Settings:
     FUNASR_DEVICE: str = os.getenv("FUNASR_DEVICE", "cpu")  # cpu / cuda:0
     FUNASR_NCPU: int = int(os.getenv("FUNASR_NCPU", "4"))
     FUNASR_BATCH_SIZE: int = int(os.getenv("FUNASR_BATCH_SIZE", "300"))
+    # 识别结果磁盘缓存（默认关闭；键 = 音频SHA-256 + 模型/热词指纹，重复识别同一音频直接读盘）
+    FUNASR_RESULT_CACHE: bool = os.getenv("FUNASR_RESULT_CACHE", "False").lower() == "true"
+    FUNASR_RESULT_CACHE_DIR: str = os.getenv("FUNASR_RESULT_CACHE_DIR", "~/.cache/meeting_ai/funasr")
+    FUNASR_RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("FUNASR_RESULT_CACHE_MAX_ENTRIES", "200"))  # 超出后按最近使用时间淘汰
+    FUNASR_RESULT_CACHE_TTL_HOURS: float = float(os.getenv("FUNASR_RESULT_CACHE_TTL_HOURS", "168"))  # 超过该时长未使用即失效
+    FUNASR_RESULT_CACHE_FINGERPRINT_TTL: float = float(os.getenv("FUNASR_RESULT_CACHE_FINGERPRINT_TTL", "10"))  # FunASR服务热词/声纹库版本的复用时长（秒）
+    
+    # --- 声纹服务配置（Cam++）---
+    # CPU 推理时对 Linear 层做 int8 动态量化（权重 int8、激活 fp32），GPU 上不生效
+    VOICE_QUANTIZE: bool = os.getenv("VOICE_QUANTIZE", "False").lower() == "true"
     
     # --- Embedding服务配置 ---
     EMBEDDING_SERVICE: str = os.getenv("EMBEDDING_SERVICE", "bge-m3")  # bge-m3 / tencent / openai
@@ -82,7 +94,15 @@ class Settings:
     BGE_M3_USE_FP16: bool = os.getenv("BGE_M3_USE_FP16", "True").lower() == "true"
     BGE_M3_BATCH_SIZE: int = int(os.getenv("BGE_M3_BATCH_SIZE", "12"))
     BGE_M3_MAX_LENGTH: int = int(os.getenv("BGE_M3_MAX_LENGTH", "8192"))
-    
+
+    # Embedding 缓存（按文本哈希复用向量，避免重复向量化）
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))  # 内存缓存条数，0 表示关闭
+    EMBEDDING_CACHE_DIR: str = os.getenv("EMBEDDING_CACHE_DIR", "")  # 落盘目录，如：~/.cache/meeting_ai/embeddings，留空不落盘
+
+    # 归档队列（/archive 入队即返回，后台批量向量化并写入 Chroma）
+    ARCHIVE_QUEUE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_QUEUE_BATCH_SIZE", "64"))  # 单次写入的最大切片数
+    ARCHIVE_QUEUE_FLUSH_INTERVAL: float = float(os.getenv("ARCHIVE_QUEUE_FLUSH_INTERVAL", "0.5"))  # 攒批等待时间（秒）
+
     # --- LLM服务配置 ---
     LLM_SERVICE_TYPE: str = os.getenv("LLM_SERVICE_TYPE", "api")  # api / local
     
@@ -159,8 +179,14 @@ class Settings:
         
         # 验证Chroma配置（如果使用向量检索）
         if self.VECTOR_STORE_TYPE == "chroma":
-            if not self.CHROMA_HOST:
-                errors.append("CHROMA_HOST 未配置")
+            if self.CHROMA_MODE == "http":
+                if not self.CHROMA_HOST:
+                    errors.append("CHROMA_HOST 未配置（CHROMA_MODE=http 时需要）")
+            elif self.CHROMA_MODE == "local":
+                if not self.CHROMA_PATH:
+                    errors.append("CHROMA_PATH 未配置（CHROMA_MODE=local 时需要）")
+            else:
+                errors.append(f"不支持的CHROMA_MODE: {self.CHROMA_MODE}")
             if not self.CHROMA_COLLECTION_NAME:
                 errors.append("CHROMA_COLLECTION_NAME 未配置")
         
@@ -2,9 +2,11 @@
 日志模块 - 避免循环导入
 """
 import sys
+import queue
+import atexit
 import logging
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 def _get_log_dir():
     """获取日志目录，避免导入settings"""
@@ -37,7 +39,6 @@ def setup_logger(name: str = "meeting_ai", log_dir: Path = None):
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setLevel(logging.INFO)  # ✅ 明确设置级别
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
     
     # ✅ 禁用日志传播，避免重复输出
     logger.propagate = False
@@ -55,7 +56,14 @@ def setup_logger(name: str = "meeting_ai", log_dir: Path = None):
         log_file, maxBytes=10*1024*1024, backupCount=5, encoding="utf-8"
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    # 5. 业务代码里的日志调用只入队，格式化和写控制台/文件都在后台监听线程完成，
+    # 日志切割时不会卡住请求；进程退出前把队列里剩余的日志写完
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
 
     return logger
 
@@ -82,6 +82,25 @@ def validate_file_size(file_path: str, max_size_mb: int = 500) -> bool:
     return size_mb <= max_size_mb
 
 
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    流式计算文件的 SHA-256（按块读取，避免大音频一次性载入内存）
+    
+    Args:
+        file_path: 文件路径
+        chunk_size: 每次读取的字节数（默认1MiB）
+    
+    Returns:
+        十六进制摘要
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def validate_audio_format(filename: str) -> bool:
     """
     验证音频文件格式
@@ -0,0 +1,258 @@
+"""
+知识归档队列
+/archive 接口只负责切片入队并立即返回（"已受理"），后台协程批量向量化并写入 Chroma：
+- 请求延迟降到入队开销（切片是纯 CPU 的快操作）
+- 并发归档时多份纪要的切片合并成一次批量向量化 + 一次 collection.add
+- 每份纪要的最终结果（成功/失败）记录在 get_status 中，失败会写错误日志
+"""
+import asyncio
+import functools
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.exceptions import VectorServiceException
+from app.services.vector import vector_service
+
+
+@dataclass
+class _ArchiveJob:
+    """一份待归档的纪要（已切片）"""
+    source_id: int
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+
+
+class KnowledgeArchiveQueue:
+    """归档队列：asyncio.Queue 生产者/消费者"""
+
+    STATUS_MAX_ENTRIES = 1000  # 保留最近多少份纪要的归档结果
+
+    def __init__(
+        self,
+        batch_size: int = settings.ARCHIVE_QUEUE_BATCH_SIZE,
+        flush_interval: float = settings.ARCHIVE_QUEUE_FLUSH_INTERVAL
+    ):
+        """
+        Args:
+            batch_size: 单次写入的最大切片数
+            flush_interval: 攒批等待时间（秒），超时即写入已攒到的切片
+        """
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 最近归档结果 {source_id: {"status": pending/success/failed, ...}}，只在事件循环线程中读写
+        self._status: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def start(self):
+        """启动后台消费协程（在应用 startup 事件中调用）"""
+        if self._worker is not None and not self._worker.done():
+            return
+        self._get_queue()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"📥 归档队列已启动 (批大小: {self.batch_size}, 攒批等待: {self.flush_interval}s)")
+
+    async def stop(self):
+        """停止后台协程，并把队列中剩余的纪要写完（在应用 shutdown 事件中调用）"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await asyncio.to_thread(self.flush)
+
+    async def enqueue(
+        self,
+        text: str,
+        source_id: int,
+        extra_meta: Optional[Dict[str, Any]] = None
+    ) -> Tuple[int, asyncio.Future]:
+        """
+        切片后入队，立即返回
+
+        Returns:
+            (切片数量, future)，future 的结果为实际写入的切片数量
+        """
+        ids, documents, metadatas = vector_service.build_knowledge_chunks(
+            text, source_id, extra_meta
+        )
+        future = asyncio.get_running_loop().create_future()
+        # 归档结果不由接口等待：在回调里记录结果并记录失败日志（同时避免 "Future exception was never retrieved"）
+        future.add_done_callback(functools.partial(self._on_job_done, source_id))
+        self._record_status(source_id, "pending", chunks_count=len(documents))
+        if not documents:
+            future.set_result(0)
+            return 0, future
+
+        await self._get_queue().put(_ArchiveJob(source_id, ids, documents, metadatas, future))
+        logger.info(f"📥 纪要已加入归档队列: SourceID={source_id}, 切片数={len(documents)}")
+        return len(documents), future
+
+    def get_status(self, source_id: int) -> Optional[Dict[str, Any]]:
+        """
+        查询纪要的归档结果
+
+        结果只保存在当前进程内存中（最近 STATUS_MAX_ENTRIES 份），重启后丢失，多进程部署时各进程互不可见
+
+        Returns:
+            {"status": "pending"/"success"/"failed", "chunks_count": int, "error": str(失败时)}，
+            未归档或记录已被淘汰时为None
+        """
+        status = self._status.get(source_id)
+        return dict(status) if status is not None else None
+
+    def _record_status(self, source_id: int, status: str, **info: Any):
+        self._status.pop(source_id, None)
+        self._status[source_id] = {"status": status, **info}
+        while len(self._status) > self.STATUS_MAX_ENTRIES:
+            self._status.popitem(last=False)
+
+    def _on_job_done(self, source_id: int, future: asyncio.Future):
+        """future 完成回调（事件循环线程）：记录归档结果，失败时写错误日志"""
+        if future.cancelled():
+            logger.error(f"❌ 纪要归档被取消: SourceID={source_id}")
+            self._record_status(source_id, "failed", chunks_count=0, error="cancelled")
+            return
+
+        error = future.exception()
+        if error is not None:
+            logger.error(f"❌ 纪要归档失败: SourceID={source_id}, 错误: {error}")
+            self._record_status(source_id, "failed", chunks_count=0, error=str(error))
+        else:
+            self._record_status(source_id, "success", chunks_count=future.result())
+
+    async def _run(self):
+        """后台消费：攒批 -> 批量向量化 + 写入（放到线程池，不阻塞事件循环）"""
+        queue = self._get_queue()
+        while True:
+            jobs = [await queue.get()]
+            chunk_count = len(jobs[0].documents)
+
+            # 在 flush_interval 内继续攒批，直到达到批大小
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.flush_interval
+            try:
+                while chunk_count < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    jobs.append(job)
+                    chunk_count += len(job.documents)
+            except asyncio.CancelledError:
+                # 攒批期间被停止：已取出的纪要放回队列，交给 stop() 里的 flush 写完
+                for job in jobs:
+                    queue.put_nowait(job)
+                    queue.task_done()
+                raise
+
+            try:
+                await asyncio.to_thread(self._write_jobs, jobs)
+            finally:
+                for _ in jobs:
+                    queue.task_done()
+
+    def _write_jobs(self, jobs: List[_ArchiveJob]):
+        """把多份纪要的切片合并成一次向量化 + 一次写入，并回填各自的 future"""
+        ids: List[str] = []
+        documents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        for job in jobs:
+            ids.extend(job.ids)
+            documents.extend(job.documents)
+            metadatas.extend(job.metadatas)
+
+        try:
+            written = set(vector_service.add_knowledge_chunks(ids, documents, metadatas))
+            logger.info(f"💾 归档队列写入 {len(written)} 个知识切片 (纪要数: {len(jobs)})")
+            for job in jobs:
+                # 按实际写入的切片ID回填各自的数量，一个切片都没写入的纪要按失败处理
+                count = sum(1 for chunk_id in job.ids if chunk_id in written)
+                if count:
+                    self._resolve(job, result=count)
+                else:
+                    self._resolve(job, error=VectorServiceException("切片均未写入向量库（集合未初始化或向量化失败）"))
+        except Exception as e:
+            logger.error(f"❌ 归档队列写入失败: {e}")
+            for job in jobs:
+                self._resolve(job, error=e)
+
+    @staticmethod
+    def _resolve(job: _ArchiveJob, result: int = 0, error: Optional[Exception] = None):
+        """线程安全地设置 future 结果（future 属于事件循环线程）"""
+        future = job.future
+        if future is None:
+            return
+
+        def _set():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        loop = future.get_loop()
+        if loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            _set()
+        else:
+            loop.call_soon_threadsafe(_set)
+
+    def flush(self) -> int:
+        """
+        同步写入队列中所有待处理的纪要（用于关闭服务与测试）
+
+        Returns:
+            本次处理的纪要数量
+        """
+        if self._queue is None:
+            return 0
+
+        jobs: List[_ArchiveJob] = []
+        while True:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        # 按切片数分批，与后台协程的批大小一致
+        batch: List[_ArchiveJob] = []
+        chunk_count = 0
+        for i, job in enumerate(jobs):
+            batch.append(job)
+            chunk_count += len(job.documents)
+            if chunk_count >= self.batch_size or i == len(jobs) - 1:
+                try:
+                    self._write_jobs(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                batch = []
+                chunk_count = 0
+
+        return len(jobs)
+
+
+# 创建单例实例
+archive_queue = KnowledgeArchiveQueue()
@@ -60,15 +60,11 @@ class ASRServiceFactory:
     def _get_tencent_asr(cls):
         """获取腾讯云ASR服务"""
         try:
-            from app.services.tencent_asr import asr_service
-            
-            if asr_service is None:
-                # 如果单例初始化失败，尝试重新创建
-                from app.services.tencent_asr import TencentASRService
-                return TencentASRService()
+            from app.services.tencent_asr import get_tencent_asr_service
             
+            service = get_tencent_asr_service()
             logger.info("✅ 使用腾讯云ASR服务")
-            return asr_service
+            return service
             
         except Exception as e:
             logger.error(f"❌ 腾讯云ASR服务初始化失败: {e}")
@@ -0,0 +1,81 @@
+"""
+Chroma 客户端
+进程内所有服务（知识库检索、声纹库）共用同一个客户端，复用底层 HTTP 连接池，
+避免每个服务各自建连、各自握手
+"""
+import threading
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+
+from app.core.config import settings
+from app.core.logger import logger
+
+_chroma_client = None
+_voice_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+
+def get_chroma_client():
+    """
+    获取进程内共享的 Chroma 客户端（延迟创建，双重检查锁保证只创建一次）
+    
+    - http：连接远程 Chroma 服务器（多节点共享）
+    - local：进程内 PersistentClient，query/add 变为本地函数调用，省去HTTP往返
+    """
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                _chroma_client = _create_chroma_client()
+    return _chroma_client
+
+
+def get_voice_chroma_client():
+    """
+    获取声纹库使用的 Chroma 客户端（始终连接远程 Chroma 服务器）
+    
+    funasr_standalone 的声纹匹配只通过 HTTP 读取声纹库；CHROMA_MODE=local 时如果声纹也写进
+    进程内 PersistentClient，匹配服务永远看不到新注册的员工，声纹库会被悄悄拆成两份。
+    因此 local 模式只作用于知识库检索，声纹库单独保留一个 HTTP 客户端
+    """
+    global _voice_chroma_client
+    if settings.CHROMA_MODE.lower() != "local":
+        return get_chroma_client()
+    
+    if _voice_chroma_client is None:
+        with _chroma_client_lock:
+            if _voice_chroma_client is None:
+                _voice_chroma_client = _create_http_client()
+    return _voice_chroma_client
+
+
+def _chroma_settings() -> ChromaSettings:
+    return ChromaSettings(
+        anonymized_telemetry=False,
+        allow_reset=False
+    )
+
+
+def _create_chroma_client():
+    """按 CHROMA_MODE 创建客户端"""
+    if settings.CHROMA_MODE.lower() == "local":
+        client = chromadb.PersistentClient(
+            path=settings.CHROMA_PATH,
+            settings=_chroma_settings()
+        )
+        logger.info(f"🔌 Chroma本地模式已启用: {settings.CHROMA_PATH}")
+        return client
+    
+    return _create_http_client()
+
+
+def _create_http_client():
+    """创建连接远程 Chroma 服务器的客户端"""
+    client = chromadb.HttpClient(
+        host=settings.CHROMA_HOST,
+        port=settings.CHROMA_PORT,
+        settings=_chroma_settings()
+    )
+    logger.info(f"🔌 Chroma客户端已创建: {settings.CHROMA_HOST}:{settings.CHROMA_PORT}")
+    return client
@@ -17,6 +17,9 @@ class EmbeddingServiceProtocol(Protocol):
     def get_embedding(self, text: str) -> List[float]:
         """获取文本向量"""
         ...
+    
+    # 可选：get_embeddings_batch(texts) -> List[List[float]]
+    # 实现了该方法的服务会被 VectorService 用于批量向量化
 
 
 class EmbeddingServiceFactory:
@@ -83,9 +86,9 @@ class EmbeddingServiceFactory:
     def _get_openai(cls):
         """获取OpenAI兼容Embedding服务"""
         try:
-            from app.services.tencent_embedding import OpenAICompatibleEmbeddingService
+            from app.services.tencent_embedding import get_openai_embedding_service
             
-            service = OpenAICompatibleEmbeddingService()
+            service = get_openai_embedding_service()
             logger.info("✅ 使用OpenAI兼容Embedding服务")
             return service
             
@@ -4,14 +4,37 @@ FunASR语音识别服务
 1. HTTP 模式（推荐）：调用独立的 FunASR 服务
 2. 本地模式：直接加载模型（需要安装 funasr）
 """
+import os
+import json
 import time
+import hashlib
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from pathlib import Path
 
 from app.core.config import settings
 from app.core.logger import logger
 from app.core.exceptions import ASRServiceException
+from app.core.utils import file_sha256
+
+# orjson 可选：长会议的识别结果有数千条句子，orjson 解析/序列化比标准库快数倍
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 本地模式使用的模型（同时作为识别结果缓存指纹的一部分）
+LOCAL_MODEL_CONFIG = {
+    "model": "iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
+    "model_revision": "v2.0.4",
+    "vad_model": "iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
+    "punc_model": "iic/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
+    "spk_model": "iic/speech_campplus_sv_zh-cn_16k-common",
+}
+
+# 缓存格式版本：结果结构或识别参数调整时递增，旧缓存自动失效
+RESULT_CACHE_VERSION = 1
 
 class FunASRService:
     """FunASR语音识别服务类"""
@@ -21,10 +44,20 @@ class FunASRService:
         # 检查是否配置了 FunASR 服务 URL
         self.service_url = getattr(settings, "FUNASR_SERVICE_URL", None)
         
+        # 识别服务指纹的短时缓存 (获取时间, 指纹数据)，避免每次识别都多一次 HTTP 请求
+        self._remote_fingerprint: Optional[tuple] = None
+        
         if self.service_url:
             # HTTP 模式
             self.mode = "http"
             logger.info(f"🌐 FunASR 服务模式: HTTP ({self.service_url})")
+            # 预先拼好接口地址，复用 Session（连接池 keep-alive，免去每次握手）
+            base_url = self.service_url.rstrip("/")
+            self._health_url = f"{base_url}/health"
+            self._transcribe_url = f"{base_url}/transcribe"
+            self._fingerprint_url = f"{base_url}/cache/fingerprint"
+            self.session = requests.Session()
+            self.session.headers.update({"User-Agent": "meeting_ai/funasr-client"})
             self._check_service_health()
         else:
             # 本地模式（需要安装 funasr）
@@ -35,8 +68,7 @@ class FunASRService:
     def _check_service_health(self):
         """检查远程服务健康状态"""
         try:
-            health_url = f"{self.service_url}/health"
-            response = requests.get(health_url, timeout=5)
+            response = self.session.get(self._health_url, timeout=5)
             if response.status_code == 200:
                 data = response.json()
                 logger.info(f"✅ FunASR 服务连接成功: {data.get('device', 'unknown')}")
@@ -49,15 +81,15 @@ class FunASRService:
     def _init_local_model(self):
         """初始化本地模型（如果需要）"""
         try:
+            import torch
             from funasr import AutoModel
             logger.info("🚀 正在加载本地 FunASR 模型...")
             
+            # 推理时关闭 autograd 记录（torch 只在本地模式下需要，HTTP 模式不依赖它）
+            self._inference_mode = torch.inference_mode
+            
             self.model = AutoModel(
-                model="iic/speech_seaco_paraformer_large_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
-                model_revision="v2.0.4",
-                vad_model="iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-                punc_model="iic/punc_ct-transformer_zh-cn-common-vocab272727-pytorch",
-                spk_model="iic/speech_campplus_sv_zh-cn_16k-common",
+                **LOCAL_MODEL_CONFIG,
                 device=getattr(settings, "FUNASR_DEVICE", "cuda"),
                 ncpu=getattr(settings, "FUNASR_NCPU", 4),
                 disable_update=True,
@@ -93,10 +125,158 @@ class FunASRService:
                 ]
             }
         """
+        cache_path = self._result_cache_path(file_path)
+        if cache_path is not None:
+            cached = self._load_cached_result(cache_path)
+            if cached is not None:
+                logger.info(f"⚡ 命中识别结果缓存: {file_path}")
+                return cached
+        
+        if self.mode == "http":
+            result = self._transcribe_http(file_path)
+        else:
+            result = self._transcribe_local(file_path)
+        
+        if cache_path is not None:
+            self._save_cached_result(cache_path, result)
+        return result
+    
+    def _result_cache_path(self, file_path: str) -> Optional[Path]:
+        """
+        计算识别结果的缓存文件路径
+        
+        缓存键 = 音频内容SHA-256 + 识别配置指纹（后端、模型、热词），
+        未启用缓存、文件不存在或无法获取指纹时返回None
+        """
+        if not settings.FUNASR_RESULT_CACHE:
+            return None
+        
+        try:
+            if not Path(file_path).is_file():
+                return None
+            
+            key = hashlib.sha256(
+                f"{file_sha256(file_path)}|{self._cache_fingerprint()}".encode("utf-8")
+            ).hexdigest()
+            
+            cache_dir = Path(settings.FUNASR_RESULT_CACHE_DIR).expanduser()
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            return cache_dir / f"{key}.json"
+        except Exception as e:
+            logger.warning(f"⚠️ 识别结果缓存不可用，跳过缓存: {e}")
+            return None
+    
+    def _cache_fingerprint(self) -> str:
+        """
+        识别配置指纹：后端 + 模型 + 热词 + 声纹库 + 缓存版本
+        
+        HTTP模式下热词和声纹匹配都在FunASR服务中完成（结果里带有匹配到的姓名/工号），
+        从服务端读取热词与声纹库的当前版本，热词重载或声纹注册后旧结果不会再被命中；
+        读取失败时抛异常，由调用方跳过缓存
+        """
         if self.mode == "http":
-            return self._transcribe_http(file_path)
+            remote = self._get_remote_fingerprint()
+            backend = {
+                "url": self.service_url,
+                "model": settings.FUNASR_MODEL_NAME,
+                "revision": settings.FUNASR_MODEL_REVISION,
+            }
         else:
-            return self._transcribe_local(file_path)
+            # 本地模式不使用热词，也不做声纹匹配
+            remote = {}
+            backend = LOCAL_MODEL_CONFIG
+        
+        payload = json.dumps(
+            {"version": RESULT_CACHE_VERSION, "mode": self.mode, "backend": backend, "remote": remote},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _get_remote_fingerprint(self) -> Dict[str, Any]:
+        """读取FunASR服务的热词/声纹库版本，FUNASR_RESULT_CACHE_FINGERPRINT_TTL 秒内复用上次结果"""
+        cached = self._remote_fingerprint
+        if cached is not None and time.monotonic() - cached[0] < settings.FUNASR_RESULT_CACHE_FINGERPRINT_TTL:
+            return cached[1]
+        
+        response = self.session.get(self._fingerprint_url, timeout=5)
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("code") != 0:
+            raise ASRServiceException(f"获取识别结果指纹失败: {payload.get('msg')}")
+        
+        data = payload.get("data", {})
+        self._remote_fingerprint = (time.monotonic(), data)
+        return data
+    
+    def invalidate_fingerprint(self) -> None:
+        """热词重载/声纹注册后调用：下次识别重新读取服务端版本"""
+        self._remote_fingerprint = None
+    
+    def _load_cached_result(self, cache_path: Path) -> Optional[Dict[str, Any]]:
+        """读取缓存结果，缓存不存在、过期或损坏时返回None（损坏不影响主流程）"""
+        try:
+            mtime = cache_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        
+        try:
+            if time.time() - mtime > settings.FUNASR_RESULT_CACHE_TTL_HOURS * 3600:
+                cache_path.unlink(missing_ok=True)
+                return None
+            
+            if ORJSON_AVAILABLE:
+                result = orjson.loads(cache_path.read_bytes())
+            else:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            
+            # 更新修改时间作为"最近使用"时间，淘汰时按它排序（LRU）
+            os.utime(cache_path)
+            return result
+        except Exception as e:
+            logger.warning(f"⚠️ 识别结果缓存损坏，将重新识别: {cache_path.name} ({e})")
+            return None
+    
+    def _save_cached_result(self, cache_path: Path, result: Dict[str, Any]) -> None:
+        """写入缓存（先写临时文件再替换，避免并发读到半个文件），写入后按容量/时长淘汰旧条目"""
+        try:
+            tmp_path = cache_path.with_suffix(".tmp")
+            if ORJSON_AVAILABLE:
+                tmp_path.write_bytes(orjson.dumps(result))
+            else:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(result, f, ensure_ascii=False)
+            tmp_path.replace(cache_path)
+        except Exception as e:
+            logger.warning(f"⚠️ 写入识别结果缓存失败: {e}")
+            return
+        
+        self._prune_result_cache(cache_path.parent)
+    
+    def _prune_result_cache(self, cache_dir: Path) -> None:
+        """淘汰过期条目，并在条目数超过上限时按最近使用时间删除最旧的条目"""
+        try:
+            entries = []
+            for path in cache_dir.glob("*.json"):
+                try:
+                    entries.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    continue
+            
+            expire_before = time.time() - settings.FUNASR_RESULT_CACHE_TTL_HOURS * 3600
+            entries.sort(reverse=True)  # 最近使用的在前
+            
+            removed = 0
+            for i, (mtime, path) in enumerate(entries):
+                if i >= settings.FUNASR_RESULT_CACHE_MAX_ENTRIES or mtime < expire_before:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            
+            if removed:
+                logger.info(f"🧹 已淘汰 {removed} 条识别结果缓存")
+        except Exception as e:
+            logger.warning(f"⚠️ 清理识别结果缓存失败: {e}")
     
     def _transcribe_http(self, file_path: str) -> Dict[str, Any]:
         """通过 HTTP 调用独立服务"""
@@ -110,8 +290,6 @@ class FunASRService:
                 raise ASRServiceException(f"音频文件不存在: {file_path}")
             
             # 发送请求到独立服务
-            url = f"{self.service_url}/transcribe"
-            
             # 注意：热词现在由FunASR服务自动管理，无需在这里传递
             
             with open(file_path_obj, "rb") as f:
@@ -121,8 +299,8 @@ class FunASRService:
                     "enable_vad": True
                 }
                 
-                response = requests.post(
-                    url,
+                response = self.session.post(
+                    self._transcribe_url,
                     files=files,
                     data=data,
                     timeout=getattr(settings, "ASR_TIMEOUT", 600)
@@ -131,7 +309,7 @@ class FunASRService:
             if response.status_code != 200:
                 raise ASRServiceException(f"FunASR 服务返回错误: {response.status_code} - {response.text}")
             
-            response_data = response.json()
+            response_data = orjson.loads(response.content) if ORJSON_AVAILABLE else response.json()
             elapsed = time.time() - start_time
             
             # FunASR独立服务返回格式: {"code": 0, "msg": "success", "data": {"text": "...", "transcript": [...]}}
@@ -166,22 +344,23 @@ class FunASRService:
                 raise ASRServiceException(f"音频文件不存在: {file_path}")
             
             # 调用本地模型（如果需要热词，应该在funasr_standalone服务中配置）
-            res = self.model.generate(
-                input=str(file_path_obj),
-                batch_size_s=300,
-                sentence_timestamp=True,
-                vad_kwargs={
-                    "speech_noise_thres": 0.3,
-                    "max_single_segment_time": 60000,
-                    "vad_tol": 300
-                }
-            )
+            with self._inference_mode():
+                res = self.model.generate(
+                    input=str(file_path_obj),
+                    batch_size_s=300,
+                    sentence_timestamp=True,
+                    vad_kwargs={
+                        "speech_noise_thres": 0.3,
+                        "max_single_segment_time": 60000,
+                        "vad_tol": 300
+                    }
+                )
             
             elapsed = time.time() - start_time
             
             # 处理结果
             transcript_data = []
-            full_text = ""
+            text_parts = []  # 逐句收集，最后一次 join，避免长录音下字符串反复拼接
             
             if res:
                 raw_sentences = res[0].get("sentence_info", [])
@@ -191,7 +370,7 @@ class FunASRService:
                     if text in ["", "，", "。", "？"]:
                         continue
                     
-                    full_text += text
+                    text_parts.append(text)
                     
                     if 'timestamp' in s and len(s['timestamp']) > 0:
                         start_ms = s['timestamp'][0][0]
@@ -204,6 +383,7 @@ class FunASRService:
                             "speaker_id": str(s.get('spk', '1'))
                         })
             
+            full_text = "".join(text_parts)
             logger.info(f"✅ [本地模式] 识别完成 | 耗时:{elapsed:.2f}s | 字数:{len(full_text)}")
             
             return {
@@ -219,6 +399,12 @@ class FunASRService:
 # 单例获取方法
 _funasr_service_instance = None
 
+
+def invalidate_result_cache_fingerprint() -> None:
+    """热词或声纹库变更后调用；服务尚未初始化时无需处理"""
+    if _funasr_service_instance is not None:
+        _funasr_service_instance.invalidate_fingerprint()
+
 def get_funasr_service():
     """获取 FunASR 服务实例（单例）"""
     global _funasr_service_instance
@@ -1,12 +1,30 @@
 import json
 import re
 import time
+from functools import lru_cache
 from typing import Dict
 from openai import OpenAI, APITimeoutError, APIConnectionError
 from app.core.config import settings
 from app.core.logger import logger
 
 
+# 思考内容清理用的正则（模块加载时编译一次）
+_THINK_BLOCK_RE = re.compile(r'<think>[\s\S]*?</think>', re.IGNORECASE)
+_THINK_RESIDUE_P_RE = re.compile(r'<p>[\s\S]*?</think>[\s\S]*?</p>', re.IGNORECASE)
+_MD_HEADING_RE = re.compile(r'#{1,3}\s')
+_THINKING_P_RES = [
+    re.compile(r'<p>[\s\S]*?语种[\s\S]*?</p>', re.IGNORECASE),  # 语种标识
+    re.compile(r'<p>[\s\S]*?好的，我.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?首先.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?接下来.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?需要注意.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?最后，需要.*?</p>', re.IGNORECASE),
+]
+_EMPTY_P_RE = re.compile(r'<p>\s*</p>')
+_LEADING_JUNK_RE = re.compile(r'^[\s"<>/\n]*')
+_EXTRA_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+
+
 def remove_thinking_tags(text: str) -> str:
     """
     移除LLM输出中的思考过程标签
@@ -22,46 +40,37 @@ def remove_thinking_tags(text: str) -> str:
     original_length = len(text)
     
     # === 策略1: 移除标准 <think> 标签（包括跨行） ===
-    text = re.sub(r'<think>[\s\S]*?</think>', '', text, flags=re.IGNORECASE)
+    text = _THINK_BLOCK_RE.sub('', text)
     
     # === 策略2: 移除残留的 </think> 标签及其所在的段落 ===
     # 匹配包含 </think> 的整个 <p> 标签（包括跨行、包含 <br />）
-    text = re.sub(r'<p>[\s\S]*?</think>[\s\S]*?</p>', '', text, flags=re.IGNORECASE)
+    text = _THINK_RESIDUE_P_RE.sub('', text)
     
     # === 策略3: 移除开头的思考内容 - 从开头到第一个 Markdown 标题 ===
     # 检测是否以 <p> 或空白开头，且后面有 Markdown 标题（###、##、#）
-    if re.search(r'^[\s\S]*?#{1,3}\s', text):
-        # 查找第一个标题的位置
-        match = re.search(r'#{1,3}\s', text)
-        if match:
-            # 检查标题之前的内容是否包含思考关键词
-            before_title = text[:match.start()]
-            thinking_indicators = ['语种', '好的', '首先', '接下来', '需要', '思考', '<p>', '</think>']
-            if any(indicator in before_title for indicator in thinking_indicators):
-                text = text[match.start():]
-                logger.info("🧹 检测到开头的思考内容，已移除")
+    # 查找第一个标题的位置
+    match = _MD_HEADING_RE.search(text)
+    if match:
+        # 检查标题之前的内容是否包含思考关键词
+        before_title = text[:match.start()]
+        thinking_indicators = ['语种', '好的', '首先', '接下来', '需要', '思考', '<p>', '</think>']
+        if any(indicator in before_title for indicator in thinking_indicators):
+            text = text[match.start():]
+            logger.info("🧹 检测到开头的思考内容，已移除")
     
     # === 策略4: 移除包含思考关键词的 <p> 段落 ===
-    thinking_patterns = [
-        r'<p>[\s\S]*?语种[\s\S]*?</p>',  # 语种标识
-        r'<p>[\s\S]*?好的，我.*?</p>',
-        r'<p>[\s\S]*?首先.*?</p>',
-        r'<p>[\s\S]*?接下来.*?</p>',
-        r'<p>[\s\S]*?需要注意.*?</p>',
-        r'<p>[\s\S]*?最后，需要.*?</p>',
-    ]
-    for pattern in thinking_patterns:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    for pattern in _THINKING_P_RES:
+        text = pattern.sub('', text)
     
     # === 清理残留 ===
     # 移除空的 <p> 标签
-    text = re.sub(r'<p>\s*</p>', '', text)
+    text = _EMPTY_P_RE.sub('', text)
     
     # 移除开头的无用标签和空白
-    text = re.sub(r'^[\s"<>/\n]*', '', text)
+    text = _LEADING_JUNK_RE.sub('', text)
     
     # 移除多余的空白行
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    text = _EXTRA_BLANK_LINES_RE.sub('\n\n', text)
     
     # 去除开头和结尾的空白和引号
     text = text.strip().strip('"').strip()
@@ -73,69 +82,82 @@ def remove_thinking_tags(text: str) -> str:
     return text
 
 
-def add_highlighting(text: str) -> str:
-    """
-    增强版高亮函数
-    """
-    if not text:
-        return text
+# 高亮样式
+_HIGHLIGHT_STYLES = {
+    "person": 'style="background-color: #dbeafe; color: #1e40af; padding: 0 2px; border-radius: 3px;"',
+    "date": 'style="background-color: #dcfce7; color: #166534; padding: 0 2px; border-radius: 3px;"',
+    "uncertain": 'style="background-color: #fee2e2; color: #991b1b; text-decoration: underline dashed;"',
+    "project": 'style="background-color: #f3e8ff; color: #6b21a8; font-weight: 500;"'
+}
+
 
-    # 定义样式
-    STYLES = {
-        "person": 'style="background-color: #dbeafe; color: #1e40af; padding: 0 2px; border-radius: 3px;"',
-        "date": 'style="background-color: #dcfce7; color: #166534; padding: 0 2px; border-radius: 3px;"',
-        "uncertain": 'style="background-color: #fee2e2; color: #991b1b; text-decoration: underline dashed;"',
-        "project": 'style="background-color: #f3e8ff; color: #6b21a8; font-weight: 500;"'
-    }
+def _mark(kind: str, groups: str = '{0}') -> str:
+    """生成高亮模板，{0}/{1} 依次对应正则的捕获组"""
+    return f'<mark {_HIGHLIGHT_STYLES[kind]}>{groups}</mark>'
+
+
+# 高亮规则（模块加载时编译一次，按顺序依次应用）
+# 模板用 str.format 填充捕获组，避免 m.expand 每次匹配都重新解析 \1 形式的替换串
+_HIGHLIGHT_RULES = [
+    # === 0. 存疑 (最先处理：存疑标记跨越的文字整体包一层，内部不再拆分高亮) ===
+    (re.compile(r'(?:【|\[)存疑[：:]\s*([^】\]]+)(?:】|\])'), _mark("uncertain")),
 
     # === 1. 人名优化 ===
     # 1.1 匹配 Markdown 加粗/Strong/引号 (保留原逻辑)
-    text = re.sub(r'["“]([一-龥]{1,4})["”]', f'<mark {STYLES["person"]}>\\1</mark>', text) # 增加了中文引号支持
-    text = re.sub(r'<strong>([一-龥]{1,10})</strong>', f'<mark {STYLES["person"]}>\\1</mark>', text)
-    text = re.sub(r'\*\*([一-龥]{1,10})\*\*', f'<mark {STYLES["person"]}>\\1</mark>', text)
-    
+    (re.compile(r'["“]([一-龥]{1,4})["”]'), _mark("person")),  # 增加了中文引号支持
+    (re.compile(r'<strong>([一-龥]{1,10})</strong>'), _mark("person")),
+    (re.compile(r'\*\*([一-龥]{1,10})\*\*'), _mark("person")),
     # 1.2 [新增] 匹配 "姓+称谓" (简单版NER)
     # 避免匹配到 "总共" 里的 "总"，要求前面是人名常见的字
-    text = re.sub(
-        r'([张王李赵刘陈杨黄吴周徐孙马朱胡林郭何高罗][一-龥]{0,2})(经理|总|老师|工|董|总监|组长)',
-        f'<mark {STYLES["person"]}>\\1\\2</mark>',
-        text
-    )
+    (re.compile(r'([张王李赵刘陈杨黄吴周徐孙马朱胡林郭何高罗][一-龥]{0,2})(经理|总|老师|工|董|总监|组长)'),
+     _mark("person", '{0}{1}')),
 
     # === 2. 项目名优化 ===
-    project_patterns = [
-        # 2.1 英文大写 (排除常用非项目词)
-        (r'\b(?!(?:ID|OK|NO|Yes|HI|BYE|TODO|PPT|PDF|WORD|EXCEL|CEO|CTO|CFO|HR|KPI)\b)([A-Z]{2,10})\b', 
-         f'<mark {STYLES["project"]}>\\1</mark>'),
-        
-        # 2.2 中文项目名 (收紧匹配范围，排除 "的" "了" "是" 等开头)
-        # {2,12} 限制长度，[^...] 排除常用虚词开头
-        (r'(?<![一-龥])([a-zA-Z0-9\u4e00-\u9fa5]{2,12}(?:项目|产品|系统|平台|工具|服务|计划|方案|中台|大脑))', 
-         f'<mark {STYLES["project"]}>\\1</mark>'),
-    ]
-    for pattern, replacement in project_patterns:
-        text = re.sub(pattern, replacement, text)
+    # 2.1 英文大写 (排除常用非项目词)
+    (re.compile(r'\b(?!(?:ID|OK|NO|Yes|HI|BYE|TODO|PPT|PDF|WORD|EXCEL|CEO|CTO|CFO|HR|KPI)\b)([A-Z]{2,10})\b'),
+     _mark("project")),
+    # 2.2 中文项目名 (收紧匹配范围，排除 "的" "了" "是" 等开头)
+    # {2,12} 限制长度，[^...] 排除常用虚词开头
+    (re.compile(r'(?<![一-龥])([a-zA-Z0-9\u4e00-\u9fa5]{2,12}(?:项目|产品|系统|平台|工具|服务|计划|方案|中台|大脑))'),
+     _mark("project")),
 
     # === 3. 日期 (保留原逻辑，效果已经不错) ===
-    date_patterns = [
-        (r'(周[一二三四五六日天])', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(今天|明天|后天|昨天|前天)', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(本周|下周|上周|这周|上上周)', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(本月|下月|上月|这个月)', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(\d{1,2}月\d{1,2}日)', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', f'<mark {STYLES["date"]}>\\1</mark>'),
-        (r'(\d{1,2}:\d{2})', f'<mark {STYLES["date"]}>\\1</mark>'), # 新增：支持 14:00 这种时间
-    ]
-    for pattern, replacement in date_patterns:
-        text = re.sub(pattern, replacement, text)
-
-    # === 4. 存疑 (保留原逻辑) ===
-    uncertain_patterns = [
-        (r'(?:【|\[)存疑[：:]\s*([^】\]]+)(?:】|\])', f'<mark {STYLES["uncertain"]}>\\1</mark>'),
-    ]
-    for pattern, replacement in uncertain_patterns:
-        text = re.sub(pattern, replacement, text)
+    (re.compile(r'(周[一二三四五六日天])'), _mark("date")),
+    # 固定词表合并成一条规则，一次扫描（各词之间没有前后缀重叠，与逐条替换结果一致）
+    (re.compile(r'(今天|明天|后天|昨天|前天|本周|下周|上周|这周|上上周|本月|下月|上月|这个月)'), _mark("date")),
+    (re.compile(r'(\d{1,2}月\d{1,2}日)'), _mark("date")),
+    (re.compile(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})'), _mark("date")),
+    (re.compile(r'(\d{1,2}:\d{2})'), _mark("date")),  # 新增：支持 14:00 这种时间
+]
+
+# 每条规则前加一个分支：已生成的 <mark>...</mark> 整段作为第 1 组匹配并原样保留，
+# 后面的规则不会再包裹已高亮的内容，不会产生嵌套 <mark>
+_MARKED_SPAN = r'(<mark[^>]*>.*?</mark>)|'
+_HIGHLIGHT_RULES = [
+    (re.compile(_MARKED_SPAN + pattern.pattern, re.S), template)
+    for pattern, template in _HIGHLIGHT_RULES
+]
+
+
+def _highlight_match(m: re.Match, template: str) -> str:
+    """已高亮的片段原样返回，否则用规则模板包裹（规则自身的捕获组从第 2 组开始）"""
+    if m.group(1) is not None:
+        return m.group(1)
+    return template.format(*m.groups()[1:])
+
+
+@lru_cache(maxsize=256)
+def add_highlighting(text: str) -> str:
+    """
+    增强版高亮函数
+    纯函数，按输入文本缓存结果：重新生成/重复打开同一份纪要时直接命中
+    """
+    if not text:
+        return text
 
+    # 按顺序整串替换，已高亮的 <mark> 片段由 _highlight_match 原样跳过
+    for pattern, template in _HIGHLIGHT_RULES:
+        text = pattern.sub(lambda m, t=template: _highlight_match(m, t), text)
     return text
 
 class LLMService:
@@ -4,6 +4,7 @@
 """
 import json
 import re
+from functools import lru_cache
 from typing import Dict, Optional
 from openai import OpenAI
 
@@ -12,6 +13,27 @@ from app.core.logger import logger
 from app.core.exceptions import LLMServiceException
 
 
+# 思考内容清理用的正则（模块加载时编译一次）
+_THINK_BLOCK_RE = re.compile(r'<think>[\s\S]*?</think>', re.IGNORECASE)
+_THINK_RESIDUE_P_RE = re.compile(r'<p>[\s\S]*?</think>[\s\S]*?</p>', re.IGNORECASE)
+_MD_HEADING_RE = re.compile(r'#{1,3}\s')
+_THINKING_P_RES = [
+    re.compile(r'<p>[\s\S]*?语种[\s\S]*?</p>', re.IGNORECASE),  # 语种标识
+    re.compile(r'<p>[\s\S]*?好的，我.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?首先.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?接下来.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?需要注意.*?</p>', re.IGNORECASE),
+    re.compile(r'<p>[\s\S]*?最后，需要.*?</p>', re.IGNORECASE),
+]
+_EMPTY_P_RE = re.compile(r'<p>\s*</p>')
+_LEADING_JUNK_RE = re.compile(r'^[\s"<>/\n]*')
+_EXTRA_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+
+# 从模型输出中提取 JSON
+_JSON_CODE_BLOCK_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
 def remove_thinking_tags(text: str) -> str:
     """
     移除LLM输出中的思考过程标签
@@ -27,46 +49,37 @@ def remove_thinking_tags(text: str) -> str:
     original_length = len(text)
     
     # === 策略1: 移除标准 <think> 标签（包括跨行） ===
-    text = re.sub(r'<think>[\s\S]*?</think>', '', text, flags=re.IGNORECASE)
+    text = _THINK_BLOCK_RE.sub('', text)
     
     # === 策略2: 移除残留的 </think> 标签及其所在的段落 ===
     # 匹配包含 </think> 的整个 <p> 标签（包括跨行、包含 <br />）
-    text = re.sub(r'<p>[\s\S]*?</think>[\s\S]*?</p>', '', text, flags=re.IGNORECASE)
+    text = _THINK_RESIDUE_P_RE.sub('', text)
     
     # === 策略3: 移除开头的思考内容 - 从开头到第一个 Markdown 标题 ===
     # 检测是否以 <p> 或空白开头，且后面有 Markdown 标题（###、##、#）
-    if re.search(r'^[\s\S]*?#{1,3}\s', text):
-        # 查找第一个标题的位置
-        match = re.search(r'#{1,3}\s', text)
-        if match:
-            # 检查标题之前的内容是否包含思考关键词
-            before_title = text[:match.start()]
-            thinking_indicators = ['语种', '好的', '首先', '接下来', '需要', '思考', '<p>', '</think>']
-            if any(indicator in before_title for indicator in thinking_indicators):
-                text = text[match.start():]
-                logger.info("🧹 检测到开头的思考内容，已移除")
+    # 查找第一个标题的位置
+    match = _MD_HEADING_RE.search(text)
+    if match:
+        # 检查标题之前的内容是否包含思考关键词
+        before_title = text[:match.start()]
+        thinking_indicators = ['语种', '好的', '首先', '接下来', '需要', '思考', '<p>', '</think>']
+        if any(indicator in before_title for indicator in thinking_indicators):
+            text = text[match.start():]
+            logger.info("🧹 检测到开头的思考内容，已移除")
     
     # === 策略4: 移除包含思考关键词的 <p> 段落 ===
-    thinking_patterns = [
-        r'<p>[\s\S]*?语种[\s\S]*?</p>',  # 语种标识
-        r'<p>[\s\S]*?好的，我.*?</p>',
-        r'<p>[\s\S]*?首先.*?</p>',
-        r'<p>[\s\S]*?接下来.*?</p>',
-        r'<p>[\s\S]*?需要注意.*?</p>',
-        r'<p>[\s\S]*?最后，需要.*?</p>',
-    ]
-    for pattern in thinking_patterns:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    for pattern in _THINKING_P_RES:
+        text = pattern.sub('', text)
     
     # === 清理残留 ===
     # 移除空的 <p> 标签
-    text = re.sub(r'<p>\s*</p>', '', text)
+    text = _EMPTY_P_RE.sub('', text)
     
     # 移除开头的无用标签和空白
-    text = re.sub(r'^[\s"<>/\n]*', '', text)
+    text = _LEADING_JUNK_RE.sub('', text)
     
     # 移除多余的空白行
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    text = _EXTRA_BLANK_LINES_RE.sub('\n\n', text)
     
     # 去除开头和结尾的空白和引号
     text = text.strip().strip('"').strip()
@@ -80,7 +93,7 @@ def remove_thinking_tags(text: str) -> str:
 
 def add_highlighting(text: str) -> str:
     """
-    为会议纪要添加高亮标记
+    为会议纪要添加高亮标记（结果按输入文本缓存，见 _apply_highlighting）
     - 人名：用 <mark class="person">...</mark> 包裹
     - 日期/时间：用 <mark class="date">...</mark> 包裹
     - 存疑内容：用 <mark class="uncertain">...</mark> 包裹
@@ -95,74 +108,75 @@ def add_highlighting(text: str) -> str:
     if not text:
         return text
     
+    text = _apply_highlighting(text)
+    logger.info("✨ 已添加高亮标记（人名、项目名、日期、ASR存疑内容）")
+    return text
+
+
+# 高亮规则（模块加载时编译一次，按顺序依次应用）
+# 模板用 str.format 填充捕获组，避免 m.expand 每次匹配都重新解析 \1 形式的替换串
+_HIGHLIGHT_RULES = [
+    # === 0. 高亮存疑内容（基于ASR低置信度标记，最先处理）===
+    # 注意：这里高亮的是LLM已经标记为【存疑】的内容
+    # 如果ASR识别有低置信度，会用特殊标记包裹，如：【存疑：某个词】
+    # 先于其他规则执行：存疑标记内的人名/日期等不会被拆开，整段包一层
+    (re.compile(r'【存疑[：:]\s*([^】]+)】'), '<mark class="uncertain">{0}</mark>'),
+    (re.compile(r'\[存疑[：:]\s*([^\]]+)\]'), '<mark class="uncertain">{0}</mark>'),
+
     # === 1. 高亮人名 ===
     # 1.1 带引号的人名：匹配中文引号、英文引号包裹的1-4个字的中文人名
-    text = re.sub(
-        r'[""]([一-龥]{1,4})[""]',
-        r'<mark class="person">\1</mark>',
-        text
-    )
-    
+    (re.compile(r'[""]([一-龥]{1,4})[""]'), '<mark class="person">{0}</mark>'),
     # 1.2 <strong> 标签中的人名（LLM常用格式）
     # 匹配 <strong>唐玉</strong>、<strong>子波</strong>、<strong>李</strong> 等格式
     # 扩展到1-10个字，支持复姓和更长的名字
-    text = re.sub(
-        r'<strong>([一-龥]{1,10})</strong>',
-        r'<mark class="person">\1</mark>',
-        text
-    )
-    
+    (re.compile(r'<strong>([一-龥]{1,10})</strong>'), '<mark class="person">{0}</mark>'),
     # 1.3 **Markdown加粗**中的人名
     # 匹配 **唐玉**、**子波**、**李** 等格式
-    text = re.sub(
-        r'\*\*([一-龥]{1,10})\*\*',
-        r'<mark class="person">\1</mark>',
-        text
-    )
-    
+    (re.compile(r'\*\*([一-龥]{1,10})\*\*'), '<mark class="person">{0}</mark>'),
+
     # === 2. 高亮项目名/产品名 ===
     # 通用项目名模式（不依赖特定名称）
-    project_patterns = [
-        # 大写字母项目名：OMC、ONC、FSU、AI等（2-10个连续大写字母）
-        (r'\b([A-Z]{2,10})\b', r'<mark class="project">\1</mark>'),
-        # 带"项目"、"产品"、"系统"、"平台"、"工具"、"服务"后缀的名称
-        (r'([一-龥0-9A-Za-z]{2,15}(?:项目|产品|系统|平台|工具|服务|计划|方案|库))', r'<mark class="project">\1</mark>'),
-    ]
-    for pattern, replacement in project_patterns:
-        text = re.sub(pattern, replacement, text)
-    
+    # 大写字母项目名：OMC、ONC、FSU、AI等（2-10个连续大写字母）
+    (re.compile(r'\b([A-Z]{2,10})\b'), '<mark class="project">{0}</mark>'),
+    # 带"项目"、"产品"、"系统"、"平台"、"工具"、"服务"后缀的名称
+    (re.compile(r'([一-龥0-9A-Za-z]{2,15}(?:项目|产品|系统|平台|工具|服务|计划|方案|库))'), '<mark class="project">{0}</mark>'),
+
     # === 3. 高亮日期和时间 ===
-    date_patterns = [
-        # 周X
-        (r'(周[一二三四五六日天])', r'<mark class="date">\1</mark>'),
-        # 今天、明天、后天、昨天
-        (r'(今天|明天|后天|昨天|前天)', r'<mark class="date">\1</mark>'),
-        # 本周、下周、上周
-        (r'(本周|下周|上周|这周|上上周)', r'<mark class="date">\1</mark>'),
-        # 本月、下月、上月
-        (r'(本月|下月|上月|这个月)', r'<mark class="date">\1</mark>'),
-        # X月X日
-        (r'(\d{1,2}月\d{1,2}日)', r'<mark class="date">\1</mark>'),
-        # YYYY-MM-DD、YYYY/MM/DD
-        (r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', r'<mark class="date">\1</mark>'),
-        # 时间点：如"周五"、"周二至周三"
-        (r'(周[一二三四五六日天]至周[一二三四五六日天])', r'<mark class="date">\1</mark>'),
-    ]
-    for pattern, replacement in date_patterns:
-        text = re.sub(pattern, replacement, text)
-    
-    # === 4. 高亮存疑内容（基于ASR低置信度标记）===
-    # 注意：这里高亮的是LLM已经标记为【存疑】的内容
-    # 如果ASR识别有低置信度，会用特殊标记包裹，如：【存疑：某个词】
-    uncertain_patterns = [
-        # ASR低置信度标记（由LLM生成的存疑标记）
-        (r'【存疑[：:]\s*([^】]+)】', r'<mark class="uncertain">\1</mark>'),
-        (r'\[存疑[：:]\s*([^\]]+)\]', r'<mark class="uncertain">\1</mark>'),
-    ]
-    for pattern, replacement in uncertain_patterns:
-        text = re.sub(pattern, replacement, text)
-    
-    logger.info("✨ 已添加高亮标记（人名、项目名、日期、ASR存疑内容）")
+    # 周X
+    (re.compile(r'(周[一二三四五六日天])'), '<mark class="date">{0}</mark>'),
+    # 今天、明天、后天、昨天；本周、下周、上周；本月、下月、上月
+    # 固定词表合并成一条规则，一次扫描（各词之间没有前后缀重叠，与逐条替换结果一致）
+    (re.compile(r'(今天|明天|后天|昨天|前天|本周|下周|上周|这周|上上周|本月|下月|上月|这个月)'), '<mark class="date">{0}</mark>'),
+    # X月X日
+    (re.compile(r'(\d{1,2}月\d{1,2}日)'), '<mark class="date">{0}</mark>'),
+    # YYYY-MM-DD、YYYY/MM/DD
+    (re.compile(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})'), '<mark class="date">{0}</mark>'),
+    # 时间点：如"周五"、"周二至周三"
+    (re.compile(r'(周[一二三四五六日天]至周[一二三四五六日天])'), '<mark class="date">{0}</mark>'),
+]
+
+# 每条规则前加一个分支：已生成的 <mark>...</mark> 整段作为第 1 组匹配并原样保留，
+# 后面的规则不会再包裹已高亮的内容，不会产生嵌套 <mark>
+_MARKED_SPAN = r'(<mark[^>]*>.*?</mark>)|'
+_HIGHLIGHT_RULES = [
+    (re.compile(_MARKED_SPAN + pattern.pattern, re.S), template)
+    for pattern, template in _HIGHLIGHT_RULES
+]
+
+
+def _highlight_match(m: re.Match, template: str) -> str:
+    """已高亮的片段原样返回，否则用规则模板包裹（规则自身的捕获组从第 2 组开始）"""
+    if m.group(1) is not None:
+        return m.group(1)
+    return template.format(*m.groups()[1:])
+
+
+@lru_cache(maxsize=256)
+def _apply_highlighting(text: str) -> str:
+    """高亮的实际实现；纯函数，重新生成/重复打开同一份纪要时直接命中缓存"""
+    # 按顺序整串替换，已高亮的 <mark> 片段由 _highlight_match 原样跳过
+    for pattern, template in _HIGHLIGHT_RULES:
+        text = pattern.sub(lambda m, t=template: _highlight_match(m, t), text)
     return text
 
 
@@ -430,13 +444,12 @@ class LocalLLMService:
             return json.loads(text)
         except json.JSONDecodeError:
             # 尝试查找JSON代码块
-            import re
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
+            json_match = _JSON_CODE_BLOCK_RE.search(text)
             if json_match:
                 return json.loads(json_match.group(1))
             
             # 尝试查找裸JSON
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
+            json_match = _JSON_OBJECT_RE.search(text)
             if json_match:
                 return json.loads(json_match.group(0))
             
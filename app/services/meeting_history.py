@@ -346,7 +346,7 @@ class MeetingHistoryService:
             # 检索（这里假设你的 collection.query 支持过滤）
             # 如果不支持，需要检索更多结果再手动过滤
             results = vector_service.collection.query(
-                query_embeddings=[query_vec],
+                query_embeddings=vector_service.as_embedding_matrix([query_vec]),
                 n_results=top_k * 2,  # 多检索一些，因为要过滤
                 include=["documents", "metadatas", "distances"]
             )
@@ -366,7 +366,7 @@ class MeetingHistoryService:
                     # 只保留指定会议的结果
                     if meeting_id in meeting_ids or str(metadata.get("source_id", "")) in meeting_ids:
                         distance = distances[i] if i < len(distances) else float('inf')
-                        similarity = 1 / (1 + distance)
+                        similarity = vector_service.distance_to_similarity(distance)
                         
                         filtered_results.append({
                             "text": doc,
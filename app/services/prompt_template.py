@@ -2,7 +2,8 @@
 动态提示词模板渲染服务
 支持Jinja2模板语法和动态变量替换
 """
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
 from jinja2 import Template, TemplateError
 import json
 import os
@@ -11,14 +12,31 @@ from pathlib import Path
 from app.core.logger import logger
 from app.prompts.templates import get_default_template
 
+# orjson 可选：读取 hotwords.json 时比标准库解析更快
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+@lru_cache(maxsize=64)
+def _compile_template(source: str) -> Template:
+    """编译 Jinja2 模板并缓存：模板字符串基本固定，不必每次渲染都重新解析编译"""
+    return Template(source)
+
 
 class PromptTemplateService:
     """提示词模板渲染服务"""
     
+    # 映射表提示词缓存：(文件路径, mtime_ns) 未变化时直接复用，不再每次请求都读取解析 hotwords.json
+    _mappings_key: Optional[Tuple[str, int]] = None
+    _mappings_text: Optional[str] = None
+    
     @staticmethod
     def _load_mappings() -> Optional[str]:
         """
-        从 hotwords.json 加载映射表并格式化为提示词
+        从 hotwords.json 加载映射表并格式化为提示词（按文件修改时间缓存）
         
         Returns:
             格式化的映射指导文本，如果加载失败返回None
@@ -40,45 +58,58 @@ class PromptTemplateService:
                 logger.debug("⚠️ 未找到 hotwords.json，跳过映射加载")
                 return None
             
-            # 读取并解析
-            with open(hotwords_file, 'r', encoding='utf-8') as f:
-                hotwords_config = json.load(f)
-            
-            mappings = hotwords_config.get("mappings", {})
-            
-            if not mappings:
-                return None
-            
-            # 格式化映射表为提示词
-            mapping_parts = ["=" * 60]
-            mapping_parts.append("🚨🚨🚨 【名称标准化映射表 - 必须严格执行】 🚨🚨🚨")
-            mapping_parts.append("=" * 60)
-            mapping_parts.append("⚠️⚠️⚠️ 这是最高优先级要求！必须将以下所有口语化表达替换为标准名称！\n")
-            
-            for category, mapping_dict in mappings.items():
-                if mapping_dict:
-                    mapping_parts.append(f"【{category}映射规则 - 必须100%执行】")
-                    for oral, standard in mapping_dict.items():
-                        # 使用更醒目的格式
-                        mapping_parts.append(f"  ❌ \"{oral}\" (禁止使用) ➜ ✅ \"{standard}\" (必须使用)")
-                    mapping_parts.append("")
+            key = (str(hotwords_file), hotwords_file.stat().st_mtime_ns)
+            if key == PromptTemplateService._mappings_key:
+                return PromptTemplateService._mappings_text
             
-            mapping_parts.append("📋 执行规则（不可违反）：")
-            mapping_parts.append("✓ 规则1：转录文本中的左侧口语化表达 ➜ 必须100%替换为右侧标准名称")
-            mapping_parts.append("✓ 规则2：整篇纪要中不允许出现映射表左侧的任何口语化表达")
-            mapping_parts.append("✓ 规则3：所有人名必须使用标准全名，不允许使用昵称、简称")
-            mapping_parts.append("✓ 规则4：所有项目名必须使用标准全称，不允许使用口语化简称")
-            mapping_parts.append("✓ 规则5：遇到映射表中没有的新称呼，也应该尝试推断其标准名称\n")
-            mapping_parts.append("=" * 60)
-            mapping_parts.append("🔥 请在生成每一句话时都检查是否应用了映射规则！")
-            mapping_parts.append("=" * 60 + "\n")
+            # 读取并解析
+            if ORJSON_AVAILABLE:
+                hotwords_config = orjson.loads(hotwords_file.read_bytes())
+            else:
+                with open(hotwords_file, 'r', encoding='utf-8') as f:
+                    hotwords_config = json.load(f)
             
-            return "\n".join(mapping_parts)
+            mappings_text = PromptTemplateService._format_mappings(hotwords_config.get("mappings", {}))
+            PromptTemplateService._mappings_text = mappings_text
+            PromptTemplateService._mappings_key = key
+            return mappings_text
             
         except Exception as e:
             logger.warning(f"⚠️ 加载映射表失败: {e}")
             return None
     
+    @staticmethod
+    def _format_mappings(mappings: Dict[str, Dict[str, str]]) -> Optional[str]:
+        """把 {类别: {口语: 标准名}} 格式化为提示词，映射为空时返回None"""
+        if not mappings:
+            return None
+        
+        # 格式化映射表为提示词
+        mapping_parts = ["=" * 60]
+        mapping_parts.append("🚨🚨🚨 【名称标准化映射表 - 必须严格执行】 🚨🚨🚨")
+        mapping_parts.append("=" * 60)
+        mapping_parts.append("⚠️⚠️⚠️ 这是最高优先级要求！必须将以下所有口语化表达替换为标准名称！\n")
+        
+        for category, mapping_dict in mappings.items():
+            if mapping_dict:
+                mapping_parts.append(f"【{category}映射规则 - 必须100%执行】")
+                for oral, standard in mapping_dict.items():
+                    # 使用更醒目的格式
+                    mapping_parts.append(f"  ❌ \"{oral}\" (禁止使用) ➜ ✅ \"{standard}\" (必须使用)")
+                mapping_parts.append("")
+        
+        mapping_parts.append("📋 执行规则（不可违反）：")
+        mapping_parts.append("✓ 规则1：转录文本中的左侧口语化表达 ➜ 必须100%替换为右侧标准名称")
+        mapping_parts.append("✓ 规则2：整篇纪要中不允许出现映射表左侧的任何口语化表达")
+        mapping_parts.append("✓ 规则3：所有人名必须使用标准全名，不允许使用昵称、简称")
+        mapping_parts.append("✓ 规则4：所有项目名必须使用标准全称，不允许使用口语化简称")
+        mapping_parts.append("✓ 规则5：遇到映射表中没有的新称呼，也应该尝试推断其标准名称\n")
+        mapping_parts.append("=" * 60)
+        mapping_parts.append("🔥 请在生成每一句话时都检查是否应用了映射规则！")
+        mapping_parts.append("=" * 60 + "\n")
+        
+        return "\n".join(mapping_parts)
+    
     @staticmethod
     def render_prompt(
         template_config: Dict[str, Any],
@@ -121,7 +152,7 @@ class PromptTemplateService:
                     
                     if history_content:
                         try:
-                            history_template = Template(history_template_str)
+                            history_template = _compile_template(history_template_str)
                             history_section = history_template.render(
                                 history_content=history_content
                             )
@@ -137,7 +168,7 @@ class PromptTemplateService:
                 
                 if requirement_template_str:
                     try:
-                        requirement_template = Template(requirement_template_str)
+                        requirement_template = _compile_template(requirement_template_str)
                         requirement_section = requirement_template.render(
                             user_requirement=user_requirement
                         )
@@ -153,7 +184,7 @@ class PromptTemplateService:
             
             # === 渲染最终 Prompt ===
             try:
-                main_template = Template(prompt_template)
+                main_template = _compile_template(prompt_template)
                 
                 # 合并所有变量
                 render_vars = {
@@ -346,7 +377,6 @@ class PromptTemplateService:
                 logger.info(f"📂 检测到模板文档路径: {cleaned}")
                 
                 # 尝试读取文档内容
-                import os
                 if os.path.exists(cleaned):
                     try:
                         from app.services.document import document_service
@@ -461,7 +491,6 @@ class PromptTemplateService:
             if cleaned_tid.lower().endswith(('.docx', '.pdf', '.txt')):
                 logger.info(f"📂 检测到template_id是文档路径: {cleaned_tid}")
                 
-                import os
                 if os.path.exists(cleaned_tid):
                     try:
                         from app.services.document import document_service
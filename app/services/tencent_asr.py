@@ -6,6 +6,9 @@ import json
 import re
 import time
 import os
+import threading
+import traceback
+from operator import itemgetter
 from typing import Optional, Dict, Any, List
 from tencentcloud.common import credential
 from tencentcloud.common.profile.client_profile import ClientProfile
@@ -18,6 +21,17 @@ from app.core.logger import logger
 from app.core.exceptions import ASRServiceException
 from app.core.utils import retry_with_backoff, safe_json_parse, truncate_text
 
+# orjson 可选：识别结果是数千条句子的 JSON 字符串，orjson 解析比标准库快数倍
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 腾讯云文本流的一行，如: [0:0.040,0:4.220,0] 内容
+# 秒拆成整数与小数两段，便于按毫秒做整数运算
+_TEXT_STREAM_PATTERN = re.compile(r"\[(\d+):(\d+)\.(\d+),(\d+):(\d+)\.(\d+),(\d+)\]\s*(.*)")
+
 
 class TencentASRService:
     """腾讯云ASR服务类"""
@@ -200,7 +214,7 @@ class TencentASRService:
                     final_result = self._extract_transcript_from_result(result_data)
                     
                     return {
-                        "text": "".join([i['text'] for i in final_result]), 
+                        "text": "".join(map(itemgetter('text'), final_result)), 
                         "transcript": final_result
                     }
                 
@@ -215,7 +229,6 @@ class TencentASRService:
                 time.sleep(poll_interval)
             except Exception as e:
                 logger.error(f"轮询未知异常: {e}")
-                import traceback
                 logger.error(traceback.format_exc())
                 time.sleep(poll_interval)
     
@@ -226,48 +239,47 @@ class TencentASRService:
         [最终版] 提取逐字稿
         兼容：JSON List, JSON String, 以及腾讯云特殊的 [time] text 字符串格式
         """
-        transcript = []
-        
-        try:
-            if not result_data:
-                return []
+        if not result_data:
+            return []
 
-            # --- 情况 A: 已经是列表 ---
-            if isinstance(result_data, list):
-                source_list = result_data
-            
-            # --- 情况 B: 是字符串，尝试解析 ---
-            elif isinstance(result_data, str):
-                # 1. 尝试当做 JSON 解析
+        try:
+            # 常见路径：JSON 字符串 -> 列表，只解析一次
+            if isinstance(result_data, (str, bytes)):
                 try:
-                    parsed = json.loads(result_data)
-                    if isinstance(parsed, list):
-                        source_list = parsed
-                    elif isinstance(parsed, dict) and "Result" in parsed:
-                        # 递归处理
-                        return self._extract_transcript_from_result(parsed["Result"])
-                    else:
-                        raise ValueError("Not a standard JSON list")
-                except Exception:
-                    # 2. JSON 解析失败，说明是 "特殊文本格式"
+                    parsed = orjson.loads(result_data) if ORJSON_AVAILABLE else json.loads(result_data)
+                except ValueError:
+                    # JSON 解析失败，说明是 "特殊文本格式"
                     # 格式示例: [0:0.040,0:4.220,0]  那个还是按正常的流程...
                     logger.info("⚠️ 识别结果非JSON格式，尝试使用正则解析文本流...")
+                    if isinstance(result_data, bytes):
+                        result_data = result_data.decode("utf-8", errors="ignore")
                     return self._parse_text_stream(result_data)
             else:
-                logger.warning(f"未知结果类型: {type(result_data)}")
-                return []
+                parsed = result_data
 
-            # --- 处理标准的 JSON List ---
-            for item in source_list:
-                if isinstance(item, dict):
-                    transcript.append({
+            # --- 标准的 JSON List ---
+            if isinstance(parsed, list):
+                return [
+                    {
                         "text": item.get("Text", ""),
                         "start_time": float(item.get("StartTime", 0)) / 1000.0,
                         "end_time": float(item.get("EndTime", 0)) / 1000.0,
                         "speaker_id": item.get("SpeakerId")
-                    })
-            
-            return transcript
+                    }
+                    for item in parsed if isinstance(item, dict)
+                ]
+
+            # --- 外层包了一层 {"Result": ...}，递归处理 ---
+            if isinstance(parsed, dict) and "Result" in parsed:
+                return self._extract_transcript_from_result(parsed["Result"])
+
+            # 字符串解析出了非列表（如纯数字），按文本流处理
+            if isinstance(result_data, str):
+                logger.info("⚠️ 识别结果非JSON格式，尝试使用正则解析文本流...")
+                return self._parse_text_stream(result_data)
+
+            logger.warning(f"未知结果类型: {type(result_data)}")
+            return []
 
         except Exception as e:
             logger.error(f"解析结果失败: {e}")
@@ -280,9 +292,6 @@ class TencentASRService:
         示例: [0:0.040,0:4.220,0] 文本内容
         """
         results = []
-        # 正则表达式匹配一行
-        # 匹配: [0:0.040,0:4.220,0] 内容
-        pattern = re.compile(r"\[(\d+):(\d+\.\d+),(\d+):(\d+\.\d+),(\d+)\]\s*(.*)")
         
         lines = text_stream.strip().split('\n')
         for line in lines:
@@ -290,28 +299,38 @@ class TencentASRService:
             if not line:
                 continue
                 
-            match = pattern.match(line)
+            match = _TEXT_STREAM_PATTERN.match(line)
             if match:
-                s_min, s_sec, e_min, e_sec, channel, content = match.groups()
+                s_min, s_sec, s_frac, e_min, e_sec, e_frac, channel, content = match.groups()
                 
-                # 时间转换 (分:秒 -> 秒)
-                start_time = int(s_min) * 60 + float(s_sec)
-                end_time = int(e_min) * 60 + float(e_sec)
+                # 时间转换 (分:秒 -> 毫秒)，整数运算避免浮点误差，最后统一换算成秒
+                start_ms = int(s_min) * 60000 + int(s_sec) * 1000 + int(s_frac[:3].ljust(3, "0"))
+                end_ms = int(e_min) * 60000 + int(e_sec) * 1000 + int(e_frac[:3].ljust(3, "0"))
                 
                 results.append({
                     "text": content,
-                    "start_time": round(start_time, 2),
-                    "end_time": round(end_time, 2),
+                    "start_time": start_ms / 1000.0,
+                    "end_time": end_ms / 1000.0,
                     "speaker_id": channel
                 })
         
         logger.info(f"📝 正则解析完成，提取到 {len(results)} 条记录")
         return results
 
-# 创建单例实例
-try:
-    asr_service = TencentASRService()
-except ASRServiceException as e:
-    logger.warning(f"⚠️ ASR服务初始化失败，将在首次使用时重试: {e}")
-    asr_service = None
+# 单例获取方法（延迟初始化，双重检查锁保证并发首请求只创建一个客户端）
+_tencent_asr_service_instance = None
+_tencent_asr_service_lock = threading.Lock()
+
+def get_tencent_asr_service() -> TencentASRService:
+    """
+    获取腾讯云ASR服务实例（单例）
+    
+    初始化失败时抛出 ASRServiceException，下次调用会重新尝试
+    """
+    global _tencent_asr_service_instance
+    if _tencent_asr_service_instance is None:
+        with _tencent_asr_service_lock:
+            if _tencent_asr_service_instance is None:
+                _tencent_asr_service_instance = TencentASRService()
+    return _tencent_asr_service_instance
 
@@ -2,6 +2,7 @@
 腾讯云NLP/Embedding服务
 支持文本向量化，兼容多种服务
 """
+import threading
 from typing import List, Optional, Dict, Any
 from app.core.config import settings
 from app.core.logger import logger
@@ -19,6 +20,55 @@ except ImportError:
     TENCENT_SDK_AVAILABLE = False
     logger.warning("⚠️ 腾讯云SDK未安装，Embedding服务可能不可用")
 
+# tiktoken 可选：按 token 截断；未安装时退化为按 UTF-8 字节截断
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_MAX_TOKENS = 8000   # ada-002 上限 8191 tokens，留一点余量
+# 无 tiktoken 时按 UTF-8 字节截断，上限按最坏情况的中文估算：3 字节/字、最多 2 token/字，
+# 12000 字节 ≈ 4000 字 ≤ 8000 tokens；英文约 4 字节/token，同样远低于上限
+EMBEDDING_MAX_BYTES = 12000
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    """懒加载 tiktoken 编码器（首次会加载 BPE 词表），失败返回 None"""
+    global _encoder
+    if _encoder is None and TIKTOKEN_AVAILABLE:
+        with _encoder_lock:
+            if _encoder is None:
+                try:
+                    _encoder = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+                except Exception as e:
+                    logger.warning(f"⚠️ tiktoken 编码器加载失败，改为按字节截断: {e}")
+                    _encoder = False
+    return _encoder or None
+
+
+def truncate_for_embedding(text: str) -> str:
+    """
+    按 Embedding API 的 token 预算截断文本
+    
+    按字符数截断对中文不安全：8000 个汉字可能超过 8000 tokens，触发 400 错误和无意义的重试
+    """
+    encoder = _get_encoder()
+    if encoder is not None:
+        ids = encoder.encode(text)
+        if len(ids) <= EMBEDDING_MAX_TOKENS:
+            return text
+        return encoder.decode(ids[:EMBEDDING_MAX_TOKENS])
+    
+    data = text.encode("utf-8")
+    if len(data) <= EMBEDDING_MAX_BYTES:
+        return text
+    return data[:EMBEDDING_MAX_BYTES].decode("utf-8", errors="ignore")
+
 
 class TencentEmbeddingService:
     """腾讯云Embedding服务类"""
@@ -103,10 +153,18 @@ class OpenAICompatibleEmbeddingService:
     def __init__(self):
         """初始化OpenAI兼容的Embedding服务"""
         try:
+            import httpx
             from openai import OpenAI
+            
+            # 复用连接池：TLS握手只在首次请求时发生，后续请求走 keep-alive 连接
             self.client = OpenAI(
                 api_key=settings.LLM_API_KEY,
-                base_url=settings.LLM_BASE_URL
+                base_url=settings.LLM_BASE_URL,
+                timeout=settings.EMBEDDING_TIMEOUT,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                    timeout=settings.EMBEDDING_TIMEOUT
+                )
             )
             self.dim = 1536  # OpenAI text-embedding-ada-002 的维度
             logger.info("✅ OpenAI兼容Embedding服务初始化成功")
@@ -129,13 +187,11 @@ class OpenAICompatibleEmbeddingService:
             return []
         
         try:
-            # 截断文本到最大长度（通常Embedding API有长度限制）
-            max_length = 8000  # 大多数API的限制
-            if len(text) > max_length:
-                text = text[:max_length]
+            # 按 token 预算截断（Embedding API 按 token 计长度，不是字符数）
+            text = truncate_for_embedding(text)
             
             response = self.client.embeddings.create(
-                model="text-embedding-ada-002",  # 或使用兼容的模型
+                model=EMBEDDING_MODEL,  # 或使用兼容的模型
                 input=text
             )
             
@@ -144,6 +200,35 @@ class OpenAICompatibleEmbeddingService:
         except Exception as e:
             logger.error(f"❌ Embedding API调用失败: {e}")
             raise VectorServiceException(f"Embedding API调用失败: {str(e)}")
+    
+    @retry_with_backoff(max_attempts=3, initial_wait=1.0, max_wait=5.0)
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取文本向量（一次API调用）
+        
+        Args:
+            texts: 文本列表（调用方需保证非空）
+        
+        Returns:
+            与 texts 一一对应的向量列表
+        """
+        if not texts or not self.client:
+            return []
+        
+        try:
+            inputs = [truncate_for_embedding(t) for t in texts]
+            
+            response = self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=inputs
+            )
+            
+            # API 返回的 data 带 index，按 index 排序保证与输入顺序一致
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+            
+        except Exception as e:
+            logger.error(f"❌ 批量Embedding API调用失败: {e}")
+            raise VectorServiceException(f"批量Embedding API调用失败: {str(e)}")
 
 
 # 创建Embedding服务实例（根据配置选择）
@@ -156,8 +241,19 @@ def create_embedding_service():
             logger.warning(f"⚠️ 腾讯云Embedding服务创建失败，使用备用服务: {e}")
     
     # 使用OpenAI兼容的服务作为备用
-    return OpenAICompatibleEmbeddingService()
+    return get_openai_embedding_service()
+
 
+# OpenAI兼容服务单例（延迟初始化，进程内共享同一个客户端/连接池）
+_openai_embedding_service_instance = None
+_openai_embedding_service_lock = threading.Lock()
 
-embedding_service = create_embedding_service()
+def get_openai_embedding_service() -> OpenAICompatibleEmbeddingService:
+    """获取OpenAI兼容Embedding服务单例"""
+    global _openai_embedding_service_instance
+    if _openai_embedding_service_instance is None:
+        with _openai_embedding_service_lock:
+            if _openai_embedding_service_instance is None:
+                _openai_embedding_service_instance = OpenAICompatibleEmbeddingService()
+    return _openai_embedding_service_instance
 
@@ -3,14 +3,18 @@
 使用 Chroma 存储向量，支持多种 Embedding 服务
 """
 import json
-from typing import List, Dict, Any, Optional
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from app.core.config import settings
 from app.core.logger import logger
 from app.core.exceptions import VectorServiceException
 from app.core.utils import chunk_text
 from app.services.embedding_factory import get_embedding_service
+from app.services.chroma_client import get_chroma_client
 
 
 class VectorService:
@@ -32,6 +36,12 @@ class VectorService:
         
         self.collection = None
         self.client = None
+        self.distance_space = "cosine"
+        
+        # Embedding 缓存（key: 文本哈希 -> 向量）
+        self._embed_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._embed_cache_lock = threading.Lock()
+        self._embed_cache_dir = self._init_embedding_cache_dir()
         
         # 连接Chroma（允许降级运行）
         try:
@@ -42,22 +52,16 @@ class VectorService:
             # 不抛出异常，允许服务在其他功能正常时继续运行
     
     def _connect_chroma(self) -> None:
-        """连接 Chroma"""
+        """
+        连接 Chroma（使用进程内共享的客户端，见 app/services/chroma_client.py）
+        """
         try:
-            # 连接到远程 Chroma 服务器
-            self.client = chromadb.HttpClient(
-                host=settings.CHROMA_HOST,
-                port=settings.CHROMA_PORT,
-                settings=ChromaSettings(
-                    anonymized_telemetry=False,
-                    allow_reset=False
-                )
-            )
-            
-            # 测试连接
-            self.client.heartbeat()
+            self.client = get_chroma_client()
             
-            logger.info(f"🔌 Chroma连接成功: {settings.CHROMA_HOST}:{settings.CHROMA_PORT}")
+            if settings.CHROMA_MODE.lower() != "local":
+                # 测试连接
+                self.client.heartbeat()
+                logger.info(f"🔌 Chroma连接成功: {settings.CHROMA_HOST}:{settings.CHROMA_PORT}")
         except Exception as e:
             logger.error(f"❌ Chroma连接失败: {e}")
             raise VectorServiceException(f"Chroma连接失败: {str(e)}")
@@ -78,17 +82,113 @@ class VectorService:
                 self.collection = self.client.create_collection(
                     name=self.collection_name,
                     embedding_function=None,  # 我们自己管理 embedding
-                    metadata={"description": "员工心声知识库"}
+                    metadata={"description": "员工心声知识库", "hnsw:space": "cosine"}
                 )
                 logger.info(f"✅ 集合 {self.collection_name} 创建完成")
             
+            # 记录距离度量：新集合为 cosine，旧集合默认 l2（需重建集合才能切换）
+            collection_meta = getattr(self.collection, "metadata", None) or {}
+            self.distance_space = collection_meta.get("hnsw:space", "l2")
+            if self.distance_space != "cosine":
+                logger.warning(
+                    f"⚠️ 集合 {self.collection_name} 使用 {self.distance_space} 距离，"
+                    f"建议重建为 cosine 集合以获得更准确的相似度"
+                )
+            
+            self._warm_up_collection()
+            
         except Exception as e:
             logger.error(f"❌ 集合初始化失败: {e}")
             raise VectorServiceException(f"集合初始化失败: {str(e)}")
     
+    def _warm_up_collection(self) -> None:
+        """
+        预热查询：让 Chroma 提前加载 HNSW 索引、建立连接，避免首个用户请求的延迟尖峰
+        失败（如空集合、维度不一致）不影响服务
+        """
+        try:
+            # 用全 1 向量而非全 0 向量，避免 cosine 距离除零
+            self.collection.query(
+                query_embeddings=self.as_embedding_matrix([[1.0] * self.dim]),
+                n_results=1,
+                include=[]
+            )
+            logger.debug("🔥 集合 %s 预热完成", self.collection_name)
+        except Exception as e:
+            logger.debug("集合预热跳过: %s", e)
+    
+    def _init_embedding_cache_dir(self) -> Optional[Path]:
+        """初始化 Embedding 磁盘缓存目录（未配置时返回None）"""
+        if not settings.EMBEDDING_CACHE_DIR:
+            return None
+        
+        try:
+            cache_dir = Path(settings.EMBEDDING_CACHE_DIR).expanduser()
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            logger.info(f"💾 Embedding磁盘缓存已启用: {cache_dir}")
+            return cache_dir
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding磁盘缓存目录不可用，仅使用内存缓存: {e}")
+            return None
+    
+    @staticmethod
+    def _embedding_cache_key(text: str) -> str:
+        """
+        计算缓存键：Embedding服务类型 + 文本内容的 blake2b 摘要
+        
+        带上服务类型，避免切换模型后命中维度不同的旧向量
+        """
+        raw = f"{settings.EMBEDDING_SERVICE}\x00{text}".encode("utf-8")
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+    
+    def _get_cached_embedding(self, key: str) -> Optional[List[float]]:
+        """从内存/磁盘缓存中读取向量，未命中返回None"""
+        if settings.EMBEDDING_CACHE_SIZE <= 0:
+            return None
+        
+        with self._embed_cache_lock:
+            vec = self._embed_cache.get(key)
+            if vec is not None:
+                self._embed_cache.move_to_end(key)
+                return vec
+        
+        if self._embed_cache_dir is None:
+            return None
+        
+        cache_file = self._embed_cache_dir / f"{key}.json"
+        if not cache_file.exists():
+            return None
+        
+        try:
+            vec = json.loads(cache_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            # 缓存损坏不影响主流程，重新向量化即可
+            logger.warning(f"⚠️ Embedding缓存文件损坏，已忽略: {cache_file.name} ({e})")
+            return None
+        
+        self._put_cached_embedding(key, vec, persist=False)
+        return vec
+    
+    def _put_cached_embedding(self, key: str, vec: List[float], persist: bool = True) -> None:
+        """写入内存缓存（LRU淘汰），可选落盘"""
+        if settings.EMBEDDING_CACHE_SIZE <= 0:
+            return
+        
+        with self._embed_cache_lock:
+            self._embed_cache[key] = vec
+            self._embed_cache.move_to_end(key)
+            while len(self._embed_cache) > settings.EMBEDDING_CACHE_SIZE:
+                self._embed_cache.popitem(last=False)
+        
+        if persist and self._embed_cache_dir is not None:
+            try:
+                (self._embed_cache_dir / f"{key}.json").write_text(json.dumps(vec), encoding="utf-8")
+            except Exception as e:
+                logger.warning(f"⚠️ Embedding缓存落盘失败: {e}")
+    
     def get_embedding(self, text: str) -> List[float]:
         """
-        获取文本向量
+        获取文本向量（相同文本命中缓存时不再调用Embedding服务）
         
         Args:
             text: 文本内容
@@ -99,11 +199,124 @@ class VectorService:
         if not text:
             return []
         
+        cache_key = self._embedding_cache_key(text)
+        cached = self._get_cached_embedding(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            return self.embedding_service.get_embedding(text)
+            vec = self.embedding_service.get_embedding(text)
         except Exception as e:
             logger.error(f"❌ 向量化失败: {e}")
             return []
+        
+        if vec:
+            self._put_cached_embedding(cache_key, vec)
+        return vec
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量获取文本向量（缓存未命中的文本合并为一次批量调用）
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            与 texts 一一对应的向量列表（失败或空文本对应空列表）
+        """
+        vectors: List[List[float]] = [[] for _ in texts]
+        missing: Dict[str, List[int]] = {}  # 缓存键 -> 在 texts 中的位置
+        missing_texts: List[str] = []
+        
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            
+            cache_key = self._embedding_cache_key(text)
+            cached = self._get_cached_embedding(cache_key)
+            if cached is not None:
+                vectors[i] = cached
+            elif cache_key in missing:
+                missing[cache_key].append(i)
+            else:
+                missing[cache_key] = [i]
+                missing_texts.append(text)
+        
+        if not missing_texts:
+            return vectors
+        
+        batch_fn = getattr(self.embedding_service, "get_embeddings_batch", None)
+        try:
+            if batch_fn is not None:
+                new_vecs = batch_fn(missing_texts)
+            else:
+                new_vecs = [self.embedding_service.get_embedding(t) for t in missing_texts]
+        except Exception as e:
+            logger.error(f"❌ 批量向量化失败: {e}")
+            return vectors
+        
+        if len(new_vecs) != len(missing_texts):
+            logger.error(f"❌ 批量向量化结果数量不匹配: 期望{len(missing_texts)}，实际{len(new_vecs)}")
+            return vectors
+        
+        for (cache_key, positions), vec in zip(missing.items(), new_vecs):
+            if not vec:
+                continue
+            self._put_cached_embedding(cache_key, vec)
+            for i in positions:
+                vectors[i] = vec
+        
+        return vectors
+    
+    def distance_to_similarity(self, distance: float) -> float:
+        """
+        将 Chroma 返回的距离转换为相似度（0-1之间，值越大越相似）
+        
+        - cosine 集合：distance = 1 - cos，直接 similarity = 1 - distance
+        - l2 旧集合：没有线性对应关系，沿用 1 / (1 + distance) 近似
+        """
+        if self.distance_space == "cosine":
+            return max(0.0, 1.0 - distance)
+        return 1 / (1 + distance)
+    
+    @staticmethod
+    def as_embedding_matrix(vectors: List[List[float]]) -> np.ndarray:
+        """
+        把向量列表一次性转成 float32 矩阵交给 Chroma
+        比嵌套的 Python float 列表序列化更快、体积更小（向量本身就是 fp32 精度）
+        """
+        return np.asarray(vectors, dtype=np.float32)
+    
+    def _similarities(self, distances: List[float]) -> np.ndarray:
+        """distance_to_similarity 的向量化版本（一次 numpy 运算处理整组距离）"""
+        d = np.asarray(distances, dtype=np.float32)
+        if self.distance_space == "cosine":
+            return np.maximum(0.0, 1.0 - d)
+        return 1.0 / (1.0 + d)
+    
+    def _filter_results(
+        self,
+        documents: List[str],
+        distances: List[float],
+        min_score: float
+    ) -> List[str]:
+        """
+        按相似度阈值过滤单个查询的检索结果，并格式化为上下文行
+        
+        缺少距离的文档视为不相关（与原先 distance=inf 的处理一致）
+        """
+        n = min(len(documents), len(distances))
+        if n == 0:
+            return []
+        
+        sims = self._similarities(distances[:n])
+        keep = np.nonzero(sims >= min_score)[0]
+        
+        return [
+            f"- 相关记录（相似度: {sims[i]:.2f}）: {documents[i]}"
+            for i in keep
+            if documents[i]
+        ]
     
     def search_similar(self, query_text: str, top_k: int = 3, min_score: float = 0.7) -> str:
         """
@@ -133,7 +346,7 @@ class VectorService:
             
             # 2. 在Chroma中搜索
             results = self.collection.query(
-                query_embeddings=[query_vec],
+                query_embeddings=self.as_embedding_matrix([query_vec]),
                 n_results=top_k,
                 include=["documents", "metadatas", "distances"]
             )
@@ -143,26 +356,8 @@ class VectorService:
             
             if results and results.get("documents"):
                 documents = results["documents"][0]  # 第一个查询的结果
-                metadatas = results.get("metadatas", [[]])[0]
                 distances = results.get("distances", [[]])[0]
-                
-                for i, doc in enumerate(documents):
-                    # Chroma 使用 L2 距离（越小越相似）
-                    # 转换为相似度分数（0-1之间）
-                    distance = distances[i] if i < len(distances) else float('inf')
-                    
-                    # 简单的距离到相似度转换：similarity = 1 / (1 + distance)
-                    # 对于余弦距离，可以直接用 1 - distance（如果Chroma配置了余弦）
-                    similarity = 1 / (1 + distance)
-                    
-                    # 过滤相似度太低的结果
-                    if similarity < min_score:
-                        continue
-                    
-                    metadata = metadatas[i] if i < len(metadatas) else {}
-                    
-                    if doc:
-                        context_list.append(f"- 相关记录（相似度: {similarity:.2f}）: {doc}")
+                context_list = self._filter_results(documents, distances, min_score)
             
             logger.info(f"🔍 检索到 {len(context_list)} 条相关历史")
             return "\n".join(context_list)
@@ -171,6 +366,154 @@ class VectorService:
             logger.error(f"❌ 搜索异常: {e}")
             return ""
     
+    def search_similar_batch(
+        self,
+        queries: List[str],
+        top_k: int = 3,
+        min_score: float = 0.7
+    ) -> List[str]:
+        """
+        批量搜索相似的历史片段（一次批量向量化 + 一次 Chroma 查询）
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回最相似的前k个结果
+            min_score: 最小相似度阈值（0-1之间，值越大越相似）
+        
+        Returns:
+            与 queries 一一对应的拼接文本（无结果为空字符串）
+        """
+        contexts = ["" for _ in queries]
+        
+        if not queries:
+            return contexts
+        
+        if not self.collection:
+            logger.warning("⚠️ Chroma集合未初始化，无法进行向量检索")
+            return contexts
+        
+        try:
+            # 1. 批量向量化，跳过失败的查询
+            query_vecs = self.get_embeddings(queries)
+            valid_indices = [i for i, vec in enumerate(query_vecs) if vec]
+            if not valid_indices:
+                logger.warning("⚠️ 查询文本向量化失败")
+                return contexts
+            
+            # 2. 一次查询所有向量，结果按查询顺序返回
+            results = self.collection.query(
+                query_embeddings=self.as_embedding_matrix([query_vecs[i] for i in valid_indices]),
+                n_results=top_k,
+                include=["documents", "distances"]
+            )
+            
+            # 3. 按查询拆分结果
+            all_documents = results.get("documents") or []
+            all_distances = results.get("distances") or []
+            
+            for row, i in enumerate(valid_indices):
+                if row >= len(all_documents):
+                    break
+                distances = all_distances[row] if row < len(all_distances) else []
+                context_list = self._filter_results(all_documents[row], distances, min_score)
+                contexts[i] = "\n".join(context_list)
+            
+            hit_count = sum(1 for c in contexts if c)
+            logger.info(f"🔍 批量检索完成: {len(queries)} 个查询，{hit_count} 个有相关历史")
+            return contexts
+            
+        except Exception as e:
+            logger.error(f"❌ 批量搜索异常: {e}")
+            return contexts
+    
+    def build_knowledge_chunks(
+        self,
+        text: str,
+        source_id: int,
+        extra_meta: Optional[Dict[str, Any]] = None,
+        chunk_size: int = 500,
+        overlap: int = 50
+    ) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        """
+        切片并构造入库所需的 ids / documents / metadatas（不做向量化）
+        
+        Returns:
+            (ids, documents, metadatas)
+        """
+        ids_batch = []
+        documents_batch = []
+        metadatas_batch = []
+        
+        if not text or not text.strip():
+            return ids_batch, documents_batch, metadatas_batch
+        
+        chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+        
+        for i, chunk in enumerate(chunks):
+            if not chunk.strip():
+                continue
+            
+            # 构造元数据
+            meta_dict = {
+                "source_id": source_id,
+                "chunk_index": i
+            }
+            if extra_meta:
+                meta_dict.update(extra_meta)
+            
+            # 生成唯一ID：source_id + chunk_index
+            ids_batch.append(f"{source_id}_{i}")
+            documents_batch.append(chunk)
+            metadatas_batch.append(meta_dict)
+        
+        return ids_batch, documents_batch, metadatas_batch
+    
+    def add_knowledge_chunks(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ) -> List[str]:
+        """
+        批量向量化切片并一次性写入 Chroma
+        
+        Returns:
+            实际写入的切片ID（向量化失败的切片不在其中；集合未初始化时为空）
+        """
+        if not self.collection:
+            logger.warning("⚠️ Chroma集合未初始化，无法保存知识")
+            return []
+        
+        if not documents:
+            return []
+        
+        vectors = self.get_embeddings(documents)
+        
+        ids_batch = []
+        embeddings_batch = []
+        documents_batch = []
+        metadatas_batch = []
+        
+        for chunk_id, doc, meta, vec in zip(ids, documents, metadatas, vectors):
+            if not vec:
+                logger.warning(f"⚠️ 切片 {chunk_id} 向量化失败，跳过")
+                continue
+            ids_batch.append(chunk_id)
+            embeddings_batch.append(vec)
+            documents_batch.append(doc)
+            metadatas_batch.append(meta)
+        
+        if not embeddings_batch:
+            return []
+        
+        self.collection.add(
+            ids=ids_batch,
+            embeddings=self.as_embedding_matrix(embeddings_batch),
+            documents=documents_batch,
+            metadatas=metadatas_batch
+        )
+        return ids_batch
+    
     def save_knowledge(
         self, 
         text: str, 
@@ -180,7 +523,9 @@ class VectorService:
         overlap: int = 50
     ) -> int:
         """
-        归档功能：将最终的会议纪要切片存入 Chroma
+        归档功能：将最终的会议纪要切片存入 Chroma（同步，阻塞到写入完成）
+        
+        接口层请优先使用 archive_queue 异步归档，见 app/services/archive_queue.py
         
         Args:
             text: 文本内容
@@ -201,57 +546,16 @@ class VectorService:
             return 0
         
         try:
-            # 切片
-            chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+            ids, documents, metadatas = self.build_knowledge_chunks(
+                text, source_id, extra_meta, chunk_size=chunk_size, overlap=overlap
+            )
             
-            if not chunks:
+            if not documents:
                 logger.warning("⚠️ 切片后为空，跳过保存")
                 return 0
             
-            saved_count = 0
-            
-            # 批量处理切片
-            ids_batch = []
-            embeddings_batch = []
-            documents_batch = []
-            metadatas_batch = []
-            
-            for i, chunk in enumerate(chunks):
-                if not chunk.strip():
-                    continue
-                
-                # 获取向量
-                vec = self.get_embedding(chunk)
-                if not vec:
-                    logger.warning(f"⚠️ 切片 {i+1} 向量化失败，跳过")
-                    continue
-                
-                # 构造元数据
-                meta_dict = {
-                    "source_id": source_id,
-                    "chunk_index": i
-                }
-                if extra_meta:
-                    meta_dict.update(extra_meta)
-                
-                # 生成唯一ID：source_id + chunk_index
-                chunk_id = f"{source_id}_{i}"
-                
-                ids_batch.append(chunk_id)
-                embeddings_batch.append(vec)
-                documents_batch.append(chunk)
-                metadatas_batch.append(meta_dict)
-            
-            # 批量插入到 Chroma
-            if embeddings_batch:
-                self.collection.add(
-                    ids=ids_batch,
-                    embeddings=embeddings_batch,
-                    documents=documents_batch,
-                    metadatas=metadatas_batch
-                )
-                
-                saved_count = len(embeddings_batch)
+            saved_count = len(self.add_knowledge_chunks(ids, documents, metadatas))
+            if saved_count:
                 logger.info(f"💾 已存储 {saved_count} 个知识切片 (SourceID: {source_id})")
             
             return saved_count
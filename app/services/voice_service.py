@@ -1,9 +1,16 @@
+import asyncio
+import hashlib
 import logging
+import threading
+from typing import Optional, Union
 import chromadb
+import numpy as np
 import torch
+from chromadb.config import Settings as ChromaSettings
 from modelscope.pipelines import pipeline
 from modelscope.utils.constant import Tasks
 from app.core.config import settings
+from app.services.chroma_client import get_voice_chroma_client
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -33,6 +40,9 @@ class VoiceService:
                 device=self.device  # ✅ 这里动态使用检测到的设备
             )
             logger.info("✅ 声纹模型加载成功！")
+            
+            if settings.VOICE_QUANTIZE and self.device == "cpu":
+                self._quantize_model()
         except Exception as e:
             logger.critical(f"❌ 声纹模型加载失败，服务将不可用: {e}")
             raise e
@@ -42,10 +52,9 @@ class VoiceService:
         # ====================================================
         logger.info(f"🔌 正在连接远程 Chroma: {settings.CHROMA_HOST}:{settings.CHROMA_PORT}")
         try:
-            self.client = chromadb.HttpClient(
-                host=settings.CHROMA_HOST, 
-                port=settings.CHROMA_PORT
-            )
+            # 声纹库始终走远程 Chroma（与 funasr_standalone 的声纹匹配读同一份库），
+            # CHROMA_MODE=http 时与向量检索服务共用同一个客户端（复用连接池）
+            self.client = get_voice_chroma_client()
             
             # 获取或创建集合
             # Cam++ 输出的是 192 维向量，这里不用手动指定维度，Chroma 会自动处理，
@@ -61,21 +70,43 @@ class VoiceService:
             # 如果你希望程序能继续运行（只是不能存声纹），可以把 raise e 去掉
             raise e
 
-    def extract_vector(self, audio_path: str):
+        # 本进程已写入的声纹指纹 {employee_id: 指纹}，重复注册时连 Chroma 查询也省掉
+        self._saved_fingerprints = {}
+        
+        # 异步客户端在首次异步调用时创建（见 _get_async_collection）
+        self.aclient = None
+        self._acollection = None
+        self._acollection_lock = None
+
+    def _quantize_model(self):
+        """
+        CPU 上对 Cam++ 的 Linear 层做 int8 动态量化
+        quantize_dynamic 只支持 Linear/RNN 类层，卷积层保持 fp32
+        """
+        try:
+            torch.quantization.quantize_dynamic(
+                self.embedding_model.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8,
+                inplace=True
+            )
+            logger.info("✅ 声纹模型已启用 int8 动态量化")
+        except Exception as e:
+            logger.warning(f"⚠️ 声纹模型量化失败，继续使用 fp32 模型: {e}")
+    
+    def extract_vector(self, audio_path: str) -> Optional[np.ndarray]:
         """
         提取声纹向量
         """
         try:
-            # 执行推理
-            res = self.embedding_model(audio_path)
+            # 执行推理（inference_mode：不记录 autograd，省显存和开销）
+            with torch.inference_mode():
+                res = self.embedding_model(audio_path)
             
             # ✅ 增加结果校验，防止模型返回空
             if res and 'spk_embedding' in res:
-                vector = res['spk_embedding']
-                
-                # ✅ 格式转换：确保转成 Python list
-                if hasattr(vector, 'tolist'):
-                    vector = vector.tolist()
+                # ✅ 保持 float32 数组，入库时再转 list
+                vector = np.asarray(res['spk_embedding'], dtype=np.float32).reshape(-1)
                 
                 # 打印一下维度（调试用，正式上线可以注释掉）
                 # logger.debug(f"📐 提取向量成功，维度: {len(vector)}")
@@ -88,36 +119,168 @@ class VoiceService:
             logger.error(f"❌ 提取声纹向量异常: {e}")
             return None
     
-    def save_identity(self, employee_id: str, name: str, vector: list):
+    def save_identity(self, employee_id: str, name: str, vector: Union[np.ndarray, list]):
         """
-        保存员工声纹到 Chroma
+        保存员工声纹到 Chroma（归一化为单位向量后入库）
+        
+        同一工号重复注册同一段声纹（余弦相似度 > 0.999 且姓名不变）时跳过写入，避免 HNSW 索引重建；
+        声纹或姓名有变化时覆盖该工号的旧声纹
         """
+        employee_id = str(employee_id)
+        vector = self._normalize(vector)
+        fingerprint = self._identity_fingerprint(name, vector)
+        if self._saved_fingerprints.get(employee_id) == fingerprint:
+            logger.info(f"⏭️ 声纹未变化，跳过入库: {name} (工号: {employee_id})")
+            return True
+        
         try:
-            self.collection.add(
-                ids=[str(employee_id)],  # 覆盖式更新（同一个工号只存一个声纹）
-                embeddings=[vector],
-                metadatas=[{
-                    "name": name, 
-                    "employee_id": str(employee_id),
-                    "create_time": "2026-01-XX" # 这里可以加个时间戳
-                }]
+            existing = self.collection.get(ids=[employee_id], include=["embeddings", "metadatas"])
+            if self._is_same_identity(existing, name, vector):
+                self._saved_fingerprints[employee_id] = fingerprint
+                logger.info(f"⏭️ 声纹未变化，跳过入库: {name} (工号: {employee_id})")
+                return True
+            
+            # 同一个工号只存一个声纹：重新注册时用 upsert 显式覆盖旧声纹（add 遇到已有ID会被忽略）
+            self.collection.upsert(
+                ids=[employee_id],
+                embeddings=[vector.tolist()],
+                metadatas=[self._identity_metadata(employee_id, name)]
             )
+            # 写入成功后才记录指纹
+            self._saved_fingerprints[employee_id] = fingerprint
+            self._log_saved(existing, employee_id, name)
+            return True
+        except Exception as e:
+            logger.error(f"❌ 声纹入库失败: {e}")
+            raise e
+    
+    @staticmethod
+    def _log_saved(existing: dict, employee_id: str, name: str) -> None:
+        """入库日志：工号已有声纹时明确记录为覆盖"""
+        if existing and existing.get("ids"):
+            logger.warning(f"🔁 工号已有声纹，已覆盖为新声纹: {name} (工号: {employee_id})")
+        else:
             logger.info(f"💾 声纹已入库: {name} (工号: {employee_id})")
+    
+    @staticmethod
+    def _normalize(vector: Union[np.ndarray, list]) -> np.ndarray:
+        """
+        L2 归一化为 float32 单位向量
+        
+        声纹库约定：入库向量均为单位向量，余弦相似度 = 点积 = 1 - Chroma cosine 距离
+        """
+        v = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return v / (np.linalg.norm(v) + 1e-9)
+    
+    @staticmethod
+    def _identity_metadata(employee_id: str, name: str) -> dict:
+        """声纹元数据"""
+        return {
+            "name": name, 
+            "employee_id": employee_id,
+            "create_time": "2026-01-XX" # 这里可以加个时间戳
+        }
+    
+    @staticmethod
+    def _identity_fingerprint(name: str, vector: Union[np.ndarray, list]) -> str:
+        """姓名 + 声纹向量的哈希，用于进程内判断是否重复注册"""
+        digest = hashlib.sha256(name.encode("utf-8"))
+        digest.update(np.asarray(vector, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _is_same_identity(existing: dict, name: str, vector: Union[np.ndarray, list]) -> bool:
+        """库中已有的声纹与本次注册是否相同（姓名一致且余弦相似度 > 0.999）"""
+        embeddings = existing.get("embeddings") if existing else None
+        if embeddings is None or len(embeddings) == 0:
+            return False
+        
+        metadatas = existing.get("metadatas") or [{}]
+        if (metadatas[0] or {}).get("name") != name:
+            return False
+        
+        old_vec = np.asarray(embeddings[0], dtype=np.float32)
+        new_vec = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(old_vec) * np.linalg.norm(new_vec))
+        if norm == 0.0:
+            return False
+        return float(np.dot(old_vec, new_vec)) / norm > 0.999
+    
+    async def _get_async_collection(self):
+        """
+        延迟创建异步 Chroma 集合（AsyncHttpClient 需要 await，不能在 __init__ 里创建）
+        声纹库始终在远程 Chroma 上（见 get_voice_chroma_client），CHROMA_MODE=local 时同样可用
+        """
+        if self._acollection is None:
+            if self._acollection_lock is None:
+                self._acollection_lock = asyncio.Lock()
+            async with self._acollection_lock:
+                if self._acollection is None:
+                    self.aclient = await chromadb.AsyncHttpClient(
+                        host=settings.CHROMA_HOST,
+                        port=settings.CHROMA_PORT,
+                        settings=ChromaSettings(anonymized_telemetry=False)
+                    )
+                    self._acollection = await self.aclient.get_or_create_collection(
+                        name=settings.CHROMA_COLLECTION_NAME,
+                        metadata={"hnsw:space": "cosine"}
+                    )
+        return self._acollection
+    
+    async def asave_identity(self, employee_id: str, name: str, vector: Union[np.ndarray, list]):
+        """
+        保存员工声纹到 Chroma（异步版本，供 FastAPI 接口使用，不阻塞事件循环）
+        """
+        acollection = await self._get_async_collection()
+        
+        employee_id = str(employee_id)
+        vector = self._normalize(vector)
+        fingerprint = self._identity_fingerprint(name, vector)
+        if self._saved_fingerprints.get(employee_id) == fingerprint:
+            logger.info(f"⏭️ 声纹未变化，跳过入库: {name} (工号: {employee_id})")
+            return True
+        
+        try:
+            existing = await acollection.get(ids=[employee_id], include=["embeddings", "metadatas"])
+            if self._is_same_identity(existing, name, vector):
+                self._saved_fingerprints[employee_id] = fingerprint
+                logger.info(f"⏭️ 声纹未变化，跳过入库: {name} (工号: {employee_id})")
+                return True
+            
+            # 同一个工号只存一个声纹：重新注册时用 upsert 显式覆盖旧声纹（add 遇到已有ID会被忽略）
+            await acollection.upsert(
+                ids=[employee_id],
+                embeddings=[vector.tolist()],
+                metadatas=[self._identity_metadata(employee_id, name)]
+            )
+            # 写入成功后才记录指纹
+            self._saved_fingerprints[employee_id] = fingerprint
+            self._log_saved(existing, employee_id, name)
             return True
         except Exception as e:
             logger.error(f"❌ 声纹入库失败: {e}")
             raise e
 
 
-try:
-    # 注意：这意味着这行代码一运行（比如 import 这个文件时），就会开始加载模型
-    voice_service = VoiceService()
-except Exception as e:
-    logger.error(f"⚠️ VoiceService 初始化失败: {e}")
-    voice_service = None
+# 单例获取方法（延迟初始化：import 本模块不会加载模型、不会连接 Chroma）
+# 双重检查锁保证并发首请求只加载一次模型
+_voice_service_instance = None
+_voice_service_lock = threading.Lock()
 
-# 如果你需要 FastAPI 的依赖注入，可以用这个函数
-def get_voice_service():
-    if voice_service is None:
-        raise RuntimeError("VoiceService 未成功初始化，请检查日志")
-    return voice_service
\ No newline at end of file
+
+def get_voice_service() -> VoiceService:
+    """
+    获取声纹服务实例（单例，首次调用时加载 Cam++ 模型并连接 Chroma）
+    
+    初始化失败时抛出 RuntimeError，下次调用会重新尝试
+    """
+    global _voice_service_instance
+    if _voice_service_instance is None:
+        with _voice_service_lock:
+            if _voice_service_instance is None:
+                try:
+                    _voice_service_instance = VoiceService()
+                except Exception as e:
+                    logger.error(f"⚠️ VoiceService 初始化失败: {e}")
+                    raise RuntimeError("VoiceService 未成功初始化，请检查日志") from e
+    return _voice_service_instance
@@ -15,6 +15,43 @@ if sys.platform == 'win32':
     except:
         pass
 
+def decode_bytes(raw):
+    """
+    在内存中识别编码并解码（文件只读一次），换行统一为 \n
+    
+    Returns:
+        (content, encoding)，无法解码时返回 (None, None)
+    """
+    content, encoding = _decode(raw)
+    if content is not None:
+        # 与文本模式读取一致：CRLF/CR 统一为 \n，否则 Windows 上 write_text 会写出 \r\r\n
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content, encoding
+
+def _decode(raw):
+    """按 UTF-8 -> charset_normalizer -> 常见中文编码的顺序解码"""
+    # 绝大多数情况下已经是 UTF-8，直接解码最快也最准确
+    try:
+        return raw.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    
+    # 优先用 charset_normalizer 检测（requests 的依赖，通常已安装）
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(raw).best()
+        if best is not None:
+            return str(best), best.encoding
+    except ImportError:
+        pass
+    
+    for encoding in ['gbk', 'gb2312', 'latin-1']:
+        try:
+            return raw.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    return None, None
+
 def fix_env_encoding():
     """修复 .env 文件编码"""
     env_path = Path(".env")
@@ -28,21 +65,14 @@ def fix_env_encoding():
         print("[错误] .env 文件不存在")
         if env_example_path.exists():
             print("[成功] 发现 env.example，正在创建 .env...")
-            # 读取 env.example（尝试多种编码）
-            content = None
-            for encoding in ['utf-8', 'gbk', 'latin-1']:
-                try:
-                    with open(env_example_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                    print(f"   成功读取 env.example (编码: {encoding})")
-                    break
-                except Exception as e:
-                    continue
+            # 读取 env.example（自动识别编码）
+            content, encoding = decode_bytes(env_example_path.read_bytes())
+            if content:
+                print(f"   成功读取 env.example (编码: {encoding})")
             
             if content:
                 # 写入 .env（强制UTF-8）
-                with open(env_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                env_path.write_text(content, encoding='utf-8')
                 print("[成功] 已创建 .env 文件（UTF-8编码）")
                 print("[警告] 请编辑 .env 文件，填写你的实际配置（API Key等）")
             else:
@@ -54,18 +84,11 @@ def fix_env_encoding():
     # 2. 尝试读取现有 .env
     print(f"[信息] 找到 .env 文件: {env_path.absolute()}")
     
-    content = None
-    original_encoding = None
-    
-    for encoding in ['utf-8', 'gbk', 'gb2312', 'latin-1']:
-        try:
-            with open(env_path, 'r', encoding=encoding) as f:
-                content = f.read()
-            original_encoding = encoding
-            print(f"[成功] 成功读取 .env (当前编码: {encoding})")
-            break
-        except Exception as e:
-            continue
+    # 只读一次原始字节，编码识别与备份都复用这份数据
+    raw = env_path.read_bytes()
+    content, original_encoding = decode_bytes(raw)
+    if content:
+        print(f"[成功] 成功读取 .env (当前编码: {original_encoding})")
     
     if not content:
         print("[错误] 无法读取 .env 文件（所有编码都失败）")
@@ -78,14 +101,11 @@ def fix_env_encoding():
         
         # 备份原文件
         backup_path = env_path.with_suffix('.env.backup')
-        with open(backup_path, 'wb') as f:
-            with open(env_path, 'rb') as orig:
-                f.write(orig.read())
+        backup_path.write_bytes(raw)
         print(f"[备份] 已备份原文件: {backup_path}")
         
         # 重新写入UTF-8
-        with open(env_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        env_path.write_text(content, encoding='utf-8')
         print("[成功] .env 文件已转换为 UTF-8 编码")
     else:
         print("[成功] .env 文件已经是 UTF-8 编码")
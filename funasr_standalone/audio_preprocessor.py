@@ -3,12 +3,91 @@
 用于提升ASR识别准确率
 """
 import os
+import asyncio
 import subprocess
 import logging
+import threading
 from pathlib import Path
+from typing import AsyncIterable, Optional, Tuple
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# ffmpeg 管道缓冲区大小：1MB，减少读取 PCM/stderr 时的 read() 系统调用次数
+# 注意不要设为 0（无缓冲），否则每次读取都是一次系统调用
+FFMPEG_PIPE_BUFSIZE = 1 << 20
+
+# 预处理滤镜链：高通 + 低通 + 降噪
+AUDIO_FILTER = "highpass=f=200,lowpass=f=3000,afftdn=nf=-25"
+
+
+def run_ffmpeg(cmd: list, timeout: float = 60) -> bytes:
+    """
+    运行 ffmpeg 并返回 stdout
+    
+    Raises:
+        subprocess.CalledProcessError: ffmpeg 返回非 0
+        subprocess.TimeoutExpired: 超时（子进程会被结束）
+    """
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=FFMPEG_PIPE_BUFSIZE
+    ) as proc:
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout
+
+
+async def run_ffmpeg_async(cmd: list, timeout: float = 60) -> bytes:
+    """
+    run_ffmpeg 的异步版本：ffmpeg 作为 asyncio 子进程运行，等待期间不占用线程也不阻塞事件循环
+    
+    Raises:
+        subprocess.CalledProcessError: ffmpeg 返回非 0
+        subprocess.TimeoutExpired: 超时（子进程会被结束）
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        limit=FFMPEG_PIPE_BUFSIZE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout
+
+
+def pcm16_to_float32(pcm: bytes) -> np.ndarray:
+    """
+    s16le 原始 PCM -> float32 波形（-1~1）
+    
+    ffmpeg 管道里始终保持 int16（2 字节/采样），只在交给模型前转换一次；
+    转换后原地乘倒数，避免再分配一块同样大小的 float32 临时数组
+    """
+    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    audio *= 1.0 / 32768.0
+    return audio
+
 
 class AudioPreprocessor:
     """音频预处理器"""
@@ -34,6 +113,58 @@ class AudioPreprocessor:
         except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
             return False
     
+    def _file_cmd(self, input_path: str, output_path: str) -> list:
+        """预处理到 WAV 文件的 ffmpeg 命令"""
+        # 1. 转换为16kHz单声道
+        # 2. 降噪
+        # 3. 音量归一化
+        return [
+            "ffmpeg",
+            "-i", input_path,
+            "-ac", "1",              # 单声道
+            "-ar", "16000",          # 16kHz采样率
+            "-af", AUDIO_FILTER,     # 降噪
+            "-y",                    # 覆盖输出
+            "-loglevel", "error",    # 只输出错误信息
+            output_path
+        ]
+    
+    def _pcm_cmd(self, input_path: str) -> list:
+        """与 _file_cmd 相同的滤镜链，输出为 s16le 原始 PCM 写到 stdout"""
+        return [
+            "ffmpeg",
+            "-i", input_path,
+            "-ac", "1",
+            "-ar", "16000",
+            "-af", AUDIO_FILTER,
+            "-f", "s16le",
+            "-loglevel", "error",
+            "pipe:1"
+        ]
+    
+    @staticmethod
+    def _default_output_path(input_path: str) -> str:
+        input_file = Path(input_path)
+        return str(input_file.parent / f"{input_file.stem}_processed.wav")
+    
+    @staticmethod
+    def _pcm_to_array(pcm: bytes) -> Optional[np.ndarray]:
+        if not pcm:
+            logger.error("❌ 音频预处理失败: ffmpeg 未输出任何数据")
+            return None
+        audio = pcm16_to_float32(pcm)
+        logger.info(f"✅ 音频预处理完成: {len(audio) / 16000:.1f}s (内存)")
+        return audio
+    
+    @staticmethod
+    def _log_failure(e: Exception):
+        if isinstance(e, subprocess.CalledProcessError):
+            logger.error(f"❌ 音频预处理失败: {e.stderr.decode() if e.stderr else str(e)}")
+        elif isinstance(e, subprocess.TimeoutExpired):
+            logger.error(f"❌ 音频预处理超时")
+        else:
+            logger.error(f"❌ 音频预处理异常: {e}")
+    
     def preprocess(self, input_path: str, output_path: str = None) -> str:
         """
         对音频进行预处理
@@ -50,39 +181,223 @@ class AudioPreprocessor:
             return input_path
         
         if output_path is None:
-            input_file = Path(input_path)
-            output_path = str(input_file.parent / f"{input_file.stem}_processed.wav")
+            output_path = self._default_output_path(input_path)
         
         try:
-            # 使用ffmpeg进行预处理
-            # 1. 转换为16kHz单声道
-            # 2. 降噪
-            # 3. 音量归一化
-            cmd = [
-                "ffmpeg",
-                "-i", input_path,
-                "-ac", "1",              # 单声道
-                "-ar", "16000",          # 16kHz采样率
-                "-af", "highpass=f=200,lowpass=f=3000,afftdn=nf=-25",  # 降噪
-                "-y",                    # 覆盖输出
-                "-loglevel", "error",    # 只输出错误信息
-                output_path
-            ]
-            
-            subprocess.run(cmd, check=True, capture_output=True, timeout=60)
+            run_ffmpeg(self._file_cmd(input_path, output_path), timeout=60)
             logger.info(f"✅ 音频预处理完成: {output_path}")
             return output_path
-            
-        except subprocess.CalledProcessError as e:
-            logger.error(f"❌ 音频预处理失败: {e.stderr.decode() if e.stderr else str(e)}")
+        except Exception as e:
+            self._log_failure(e)
             return input_path  # 降级：返回原始文件
+    
+    async def preprocess_async(self, input_path: str, output_path: str = None) -> str:
+        """preprocess 的异步版本，参数与返回值相同"""
+        if not self.ffmpeg_available:
+            logger.debug("ffmpeg不可用，跳过音频预处理")
+            return input_path
+        
+        if output_path is None:
+            output_path = self._default_output_path(input_path)
+        
+        try:
+            await run_ffmpeg_async(self._file_cmd(input_path, output_path), timeout=60)
+            logger.info(f"✅ 音频预处理完成: {output_path}")
+            return output_path
+        except Exception as e:
+            self._log_failure(e)
+            return input_path
+    
+    def preprocess_to_array(self, input_path: str) -> Optional[np.ndarray]:
+        """
+        对音频进行预处理，结果直接通过管道读入内存（不落盘中间 WAV）
+        
+        Args:
+            input_path: 输入音频路径
+        
+        Returns:
+            16kHz 单声道 float32 波形（-1~1）；ffmpeg不可用或处理失败时返回 None，
+            调用方应直接使用原始文件
+        """
+        if not self.ffmpeg_available:
+            logger.debug("ffmpeg不可用，跳过音频预处理")
+            return None
+        
+        try:
+            return self._pcm_to_array(run_ffmpeg(self._pcm_cmd(input_path), timeout=60))
+        except Exception as e:
+            self._log_failure(e)
+            return None
+    
+    async def preprocess_to_array_async(self, input_path: str) -> Optional[np.ndarray]:
+        """preprocess_to_array 的异步版本，供请求处理协程直接 await"""
+        if not self.ffmpeg_available:
+            logger.debug("ffmpeg不可用，跳过音频预处理")
+            return None
+        
+        try:
+            return self._pcm_to_array(await run_ffmpeg_async(self._pcm_cmd(input_path), timeout=60))
+        except Exception as e:
+            self._log_failure(e)
+            return None
+
+    def preprocess_with_raw(self, input_path: str, timeout: float = 60) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        一次解码同时得到预处理后的波形（给 ASR）和未滤波的原始波形（给声纹匹配）
+        
+        asplit 把解码结果分成两路：一路走滤镜链写到 stdout，另一路直接重采样写到额外的管道 fd，
+        声纹匹配不必再把原文件解码一遍；原始波形不经过降噪，与声纹库入库时的口径一致
+        
+        Args:
+            input_path: 输入音频路径
+            timeout: 超时时间（秒）
+        
+        Returns:
+            (预处理后波形, 原始波形)，均为 16kHz 单声道 float32；失败时均为 None，
+            调用方应回到 preprocess_to_array + 单独解码
+        """
+        if not self.ffmpeg_available or os.name != "posix":
+            # pass_fds 仅 POSIX 支持
+            return None, None
+        
+        read_fd, write_fd = os.pipe()
+        cmd = [
+            "ffmpeg", "-loglevel", "error",
+            "-i", input_path,
+            "-filter_complex", f"[0:a]asplit=2[p][r];[p]{AUDIO_FILTER}[f]",
+            "-map", "[f]", "-ac", "1", "-ar", "16000", "-f", "s16le", "pipe:1",
+            "-map", "[r]", "-ac", "1", "-ar", "16000", "-f", "s16le", f"pipe:{write_fd}"
+        ]
+        
+        raw_pcm = [b""]
+        
+        def _drain():
+            with os.fdopen(read_fd, "rb", buffering=FFMPEG_PIPE_BUFSIZE) as f:
+                raw_pcm[0] = f.read()
+        
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=FFMPEG_PIPE_BUFSIZE,
+                pass_fds=[write_fd]
+            )
+        except Exception as e:
+            os.close(read_fd)
+            os.close(write_fd)
+            logger.error(f"❌ 音频预处理异常: {e}")
+            return None, None
+        
+        # 父进程关闭写端，ffmpeg 退出后读端才能读到 EOF
+        os.close(write_fd)
+        reader = threading.Thread(target=_drain, daemon=True)
+        reader.start()
+        try:
+            pcm, stderr = proc.communicate(timeout=timeout)
         except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
             logger.error(f"❌ 音频预处理超时")
-            return input_path
+            return None, None
+        finally:
+            reader.join()
+        
+        if proc.returncode != 0 or not pcm or not raw_pcm[0]:
+            logger.error(f"❌ 音频预处理失败: {stderr.decode(errors='ignore').strip() or '无输出'}")
+            return None, None
+        
+        audio = pcm16_to_float32(pcm)
+        logger.info(f"✅ 音频预处理完成: {len(audio) / 16000:.1f}s (内存，含原始波形)")
+        return audio, pcm16_to_float32(raw_pcm[0])
+    
+    async def preprocess_stream(self, chunks: AsyncIterable[bytes], timeout: float = 60) -> Optional[np.ndarray]:
+        """
+        把音频字节流（如上传文件）直接写入 ffmpeg stdin 预处理，不落盘临时文件
+        
+        注意：mp4/m4a 等 moov 信息在文件末尾的格式无法从管道解码，此时返回 None，
+        调用方应回到落盘路径（流已被读取，需先 seek(0)）
+        
+        Args:
+            chunks: 音频字节块的异步迭代器
+            timeout: 超时时间（秒）
+        
+        Returns:
+            16kHz 单声道 float32 波形；ffmpeg不可用或处理失败时返回 None
+        """
+        if not self.ffmpeg_available:
+            return None
+        
+        cmd = [
+            "ffmpeg",
+            "-i", "pipe:0",
+            "-ac", "1",
+            "-ar", "16000",
+            "-af", AUDIO_FILTER,
+            "-f", "s16le",
+            "-loglevel", "error",
+            "pipe:1"
+        ]
+        
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                limit=FFMPEG_PIPE_BUFSIZE
+            )
         except Exception as e:
             logger.error(f"❌ 音频预处理异常: {e}")
-            return input_path
+            return None
+        
+        async def _feed():
+            try:
+                async for chunk in chunks:
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg 提前退出（格式无法解码等），错误信息以 stderr 为准
+                pass
+            finally:
+                proc.stdin.close()
+        
+        feed_task = asyncio.create_task(_feed())
+        try:
+            pcm, stderr = await asyncio.wait_for(
+                asyncio.gather(proc.stdout.read(), proc.stderr.read()),
+                timeout
+            )
+            await proc.wait()
+            await feed_task
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            feed_task.cancel()
+            logger.error(f"❌ 音频预处理超时")
+            return None
+        except Exception as e:
+            proc.kill()
+            await proc.wait()
+            feed_task.cancel()
+            logger.error(f"❌ 音频预处理异常: {e}")
+            return None
+        
+        if proc.returncode != 0 or not pcm:
+            logger.warning(f"⚠️ 流式音频预处理失败: {stderr.decode(errors='ignore').strip() or '无输出'}")
+            return None
+        
+        audio = pcm16_to_float32(pcm)
+        logger.info(f"✅ 音频预处理完成: {len(audio) / 16000:.1f}s (流式)")
+        return audio
 
+# 全局单例（首次使用时初始化，避免 import 时就去探测 ffmpeg）
+audio_preprocessor = None
 
-# 全局实例
-audio_preprocessor = AudioPreprocessor()
+def get_audio_preprocessor() -> AudioPreprocessor:
+    """获取音频预处理器单例"""
+    global audio_preprocessor
+    if audio_preprocessor is None:
+        audio_preprocessor = AudioPreprocessor()
+    return audio_preprocessor
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导出 Cam++ 声纹模型为 ONNX
+导出一次即可，之后声纹匹配器检测到 campplus.onnx 且安装了 onnxruntime 时自动使用
+
+用法:
+    python export_campplus_onnx.py                 # 输出到 ./models/campplus.onnx
+    python export_campplus_onnx.py -o /path/to/campplus.onnx
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import torch
+from modelscope.pipelines import pipeline
+from modelscope.utils.constant import Tasks
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = Path(__file__).parent / "models" / "campplus.onnx"
+FEATURE_DIM = 80  # Cam++ 输入为 80 维 fbank
+
+
+def export(output_path: Path, opset: int = 17):
+    """加载 Cam++（与 VoiceMatcher 相同的 pipeline 路径）并导出其 fbank -> embedding 主干"""
+    logger.info("📦 加载 Cam++ 声纹模型...")
+    sv_pipeline = pipeline(
+        task=Tasks.speaker_verification,
+        model='iic/speech_campplus_sv_zh-cn_16k-common',
+        model_revision='v1.0.0',
+        device="cpu"
+    )
+    # pipeline.model 负责 波形 -> fbank，真正的网络在 embedding_model
+    model = sv_pipeline.model.embedding_model
+    model.eval()
+
+    # 3 秒音频约 300 帧 fbank
+    dummy_fbank = torch.randn(1, 300, FEATURE_DIM)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"🔧 导出 ONNX: {output_path} (opset={opset})")
+    torch.onnx.export(
+        model,
+        dummy_fbank,
+        str(output_path),
+        input_names=["input"],
+        output_names=["embedding"],
+        dynamic_axes={"input": {0: "B", 1: "T"}, "embedding": {0: "B"}},
+        opset_version=opset
+    )
+    logger.info("✅ 导出完成")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 Cam++ 声纹模型为 ONNX")
+    parser.add_argument("-o", "--output", type=Path, default=DEFAULT_OUTPUT, help="输出路径")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset 版本")
+    args = parser.parse_args()
+
+    try:
+        export(args.output, args.opset)
+    except Exception as e:
+        logger.error(f"❌ 导出失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,47 @@ FunASR热词管理服务
 """
 import json
 import logging
+import threading
+import time
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict, Tuple
 
 logger = logging.getLogger(__name__)
 
+# orjson 可选：直接解析字节，比标准库 json 快数倍（未安装时回退标准库，兼容 Windows 环境）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _read_json(path: Path):
+    """读取 JSON 文件"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding='utf-8'))
+
+
+def _write_json(path: Path, data) -> None:
+    """
+    写入 JSON 文件（UTF-8，缩进 2）
+    先写临时文件再替换，自动重载时不会读到写了一半的文件
+    """
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    if ORJSON_AVAILABLE:
+        tmp_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    tmp_path.replace(path)
+
 
 class HotwordService:
     """热词管理服务"""
     
+    RELOAD_CHECK_INTERVAL = 2.0  # 自动重载时检查文件修改时间的最小间隔（秒）
+    
     def __init__(self, config_path: str = None, auto_reload: bool = True):
         """
         初始化热词服务
@@ -29,8 +61,23 @@ class HotwordService:
         self.hotwords_cache: Dict[str, List[str]] = {}
         self.auto_reload = auto_reload  # 自动重载开关
         self.last_mtime = 0  # 文件最后修改时间
+        self._last_stat_at = float('-inf')  # 上次检查文件的时间（monotonic）
+        # 合并后的热词（去重、保持顺序）及其空格拼接串，在热词变化时预先算好
+        self._all_words: Tuple[str, ...] = ()
+        self._joined = ""
+        self._hotwords_str_cache: Dict[str, str] = {}  # 其他分隔符的拼接结果
+        self._lock = threading.RLock()
         self._load_hotwords()
     
+    def _rebuild_cache(self) -> None:
+        """热词有变化时重新合并（每次加载/修改只做一次，请求路径直接取结果）"""
+        # dict.fromkeys 去重并保持首次出现的顺序，跨进程重启顺序稳定
+        self._all_words = tuple(dict.fromkeys(
+            w for words in self.hotwords_cache.values() for w in words
+        ))
+        self._joined = " ".join(self._all_words)
+        self._hotwords_str_cache = {}
+    
     def _load_hotwords(self, force: bool = False) -> None:
         """
         从配置文件加载热词
@@ -38,47 +85,56 @@ class HotwordService:
         Args:
             force: 是否强制重新加载（不检查文件时间）
         """
-        try:
-            if not self.config_path.exists():
-                logger.warning(f"⚠️ 热词配置文件不存在: {self.config_path}，将创建默认配置")
-                self._create_default_config()
-                return
-            
-            # 检查文件修改时间
-            current_mtime = self.config_path.stat().st_mtime
-            if not force and current_mtime == self.last_mtime:
-                # 文件未修改，跳过加载
+        with self._lock:
+            # 自动重载走请求热路径：间隔内不重复 stat 热词文件
+            now = time.monotonic()
+            if not force and now - self._last_stat_at < self.RELOAD_CHECK_INTERVAL:
                 return
+            self._last_stat_at = now
             
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 过滤掉"说明"等非热词字段
-            self.hotwords_cache = {
-                k: v for k, v in data.items() 
-                if isinstance(v, list) and k not in ["说明", "description", "备注"]
-            }
-            
-            # 更新文件修改时间
-            self.last_mtime = current_mtime
-            
-            total_count = sum(len(v) for v in self.hotwords_cache.values())
-            
-            # 只在文件真正变化时打印详细日志
-            if force or self.last_mtime != 0:
-                logger.info(f"🔄 热词已更新: {len(self.hotwords_cache)} 个类别, 共 {total_count} 个词")
-                # 打印各类别数量
-                for category, words in self.hotwords_cache.items():
-                    logger.info(f"  - {category}: {len(words)} 个")
-            else:
-                logger.info(f"✅ 成功加载热词配置: {len(self.hotwords_cache)} 个类别, 共 {total_count} 个词")
+            try:
+                if not self.config_path.exists():
+                    logger.warning(f"⚠️ 热词配置文件不存在: {self.config_path}，将创建默认配置")
+                    self._create_default_config()
+                    return
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"❌ 热词配置文件格式错误: {e}")
-            self.hotwords_cache = {}
-        except Exception as e:
-            logger.error(f"❌ 加载热词配置失败: {e}")
-            self.hotwords_cache = {}
+                # 检查文件修改时间
+                current_mtime = self.config_path.stat().st_mtime
+                if not force and current_mtime == self.last_mtime:
+                    # 文件未修改，跳过加载
+                    return
+                
+                data = _read_json(self.config_path)
+                
+                # 过滤掉"说明"等非热词字段
+                self.hotwords_cache = {
+                    k: v for k, v in data.items() 
+                    if isinstance(v, list) and k not in ["说明", "description", "备注"]
+                }
+                self._rebuild_cache()
+                
+                # 更新文件修改时间
+                self.last_mtime = current_mtime
+                
+                total_count = sum(len(v) for v in self.hotwords_cache.values())
+                
+                # 只在文件真正变化时打印详细日志
+                if force or self.last_mtime != 0:
+                    logger.info(f"🔄 热词已更新: {len(self.hotwords_cache)} 个类别, 共 {total_count} 个词")
+                    # 打印各类别数量
+                    for category, words in self.hotwords_cache.items():
+                        logger.info(f"  - {category}: {len(words)} 个")
+                else:
+                    logger.info(f"✅ 成功加载热词配置: {len(self.hotwords_cache)} 个类别, 共 {total_count} 个词")
+                
+            except json.JSONDecodeError as e:  # orjson.JSONDecodeError 是其子类
+                logger.error(f"❌ 热词配置文件格式错误: {e}")
+                self.hotwords_cache = {}
+                self._rebuild_cache()
+            except Exception as e:
+                logger.error(f"❌ 加载热词配置失败: {e}")
+                self.hotwords_cache = {}
+                self._rebuild_cache()
     
     def _create_default_config(self) -> None:
         """创建默认配置文件"""
@@ -90,13 +146,13 @@ class HotwordService:
         }
         
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, ensure_ascii=False, indent=2)
+            _write_json(self.config_path, default_config)
             logger.info(f"✅ 已创建默认热词配置: {self.config_path}")
             self.hotwords_cache = {
                 k: v for k, v in default_config.items() 
                 if isinstance(v, list)
             }
+            self._rebuild_cache()
         except Exception as e:
             logger.error(f"❌ 创建默认配置失败: {e}")
     
@@ -107,10 +163,15 @@ class HotwordService:
         Returns:
             热词列表（去重）
         """
-        all_words: Set[str] = set()
-        for words in self.hotwords_cache.values():
-            all_words.update(words)
-        return list(all_words)
+        return list(self._all_words)
+    
+    def get_hotword_count(self) -> int:
+        """
+        获取热词总数（去重后）
+        
+        直接读缓存元组长度，不像 len(get_all_hotwords()) 那样先复制一份列表
+        """
+        return len(self._all_words)
     
     def get_hotwords_by_category(self, category: str) -> List[str]:
         """
@@ -134,11 +195,19 @@ class HotwordService:
         Returns:
             热词字符串，如："张三 李四 智能办公 数据中台"
         """
-        # 自动检测文件变化并重新加载
-        if self.auto_reload:
-            self._load_hotwords()
-        
-        return separator.join(self.get_all_hotwords())
+        with self._lock:
+            # 自动检测文件变化并重新加载
+            if self.auto_reload:
+                self._load_hotwords()
+            
+            if separator == " ":
+                return self._joined
+            
+            cached = self._hotwords_str_cache.get(separator)
+            if cached is None:
+                cached = separator.join(self._all_words)
+                self._hotwords_str_cache[separator] = cached
+            return cached
     
     def reload(self) -> bool:
         """
@@ -150,7 +219,7 @@ class HotwordService:
         try:
             logger.info("🔄 重新加载热词配置...")
             old_count = sum(len(v) for v in self.hotwords_cache.values())
-            self._load_hotwords()
+            self._load_hotwords(force=True)
             new_count = sum(len(v) for v in self.hotwords_cache.values())
             logger.info(f"✅ 热词重载完成: {old_count} → {new_count} 个词")
             return True
@@ -179,6 +248,7 @@ class HotwordService:
             
             if new_words:
                 self.hotwords_cache[category].extend(new_words)
+                self._rebuild_cache()
                 self._save_to_file()
                 logger.info(f"✅ 已添加 {len(new_words)} 个热词到 [{category}]")
                 return True
@@ -190,6 +260,43 @@ class HotwordService:
             logger.error(f"❌ 添加热词失败: {e}")
             return False
     
+    def bulk_add(self, mapping: Dict[str, List[str]]) -> bool:
+        """
+        批量添加多个类别的热词（如从 CSV 导入），全部合并后只写一次文件
+        
+        Args:
+            mapping: {类别名称: 热词列表}
+        
+        Returns:
+            是否成功添加
+        """
+        try:
+            with self._lock:
+                # 先在局部算出各类别真正新增的词，没有新增时不改动缓存、不写文件
+                additions = {}
+                for category, words in mapping.items():
+                    existing = set(self.hotwords_cache.get(category, []))
+                    # dict.fromkeys 去掉本次输入中的重复并保持顺序
+                    new_words = [w for w in dict.fromkeys(words) if w not in existing]
+                    if new_words:
+                        additions[category] = new_words
+                
+                added = sum(len(new_words) for new_words in additions.values())
+                if added == 0:
+                    logger.info("ℹ️ 所有词均已存在")
+                    return True
+                
+                for category, new_words in additions.items():
+                    self.hotwords_cache.setdefault(category, []).extend(new_words)
+                self._rebuild_cache()
+                self._save_to_file()
+            logger.info(f"✅ 已批量添加 {added} 个热词 ({len(mapping)} 个类别)")
+            return True
+        
+        except Exception as e:
+            logger.error(f"❌ 批量添加热词失败: {e}")
+            return False
+    
     def remove_hotwords(self, category: str, words: List[str]) -> bool:
         """
         从指定类别删除热词
@@ -213,6 +320,7 @@ class HotwordService:
                 if w not in words
             ]
             removed_count = original_count - len(self.hotwords_cache[category])
+            self._rebuild_cache()
             
             if removed_count > 0:
                 self._save_to_file()
@@ -233,8 +341,7 @@ class HotwordService:
             data = dict(self.hotwords_cache)
             data["说明"] = "这是FunASR服务的热词配置文件，可以随时修改。修改后可通过API重新加载。"
             
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            _write_json(self.config_path, data)
             
             logger.info(f"💾 热词配置已保存到: {self.config_path}")
         except Exception as e:
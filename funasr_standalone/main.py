@@ -6,20 +6,41 @@ FunASR 独立服务 - 生产级配置
 功能: CPU量化加速 + 自动日志记录
 """
 import os
+
+# 推理线程数：OMP/MKL/OpenBLAS 线程池必须在 import numpy/torch 之前配置（BLAS 在首次导入时就按当时的
+# 环境变量创建线程池），否则默认按逻辑核数开线程，与 AutoModel(ncpu=NCPU) 叠加造成线程超订
+NCPU = int(os.getenv("FUNASR_NCPU", "8"))
+os.environ.setdefault("OMP_NUM_THREADS", str(NCPU))
+os.environ.setdefault("MKL_NUM_THREADS", str(NCPU))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", str(NCPU))  # pip 安装的 numpy 使用 OpenBLAS
+
 import sys
+import json
+import hashlib
+import asyncio
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+import queue
+import atexit
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from collections import OrderedDict
 from pathlib import Path
+from typing import Optional
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, APIRouter
 import uvicorn
 import tempfile
-import shutil
 import gc
+import time
+import numpy as np
 import torch
 from hotword_service import get_hotword_service  # ✅ 导入热词服务
-from audio_preprocessor import audio_preprocessor  # ✅ 导入音频预处理
-# 声纹匹配延迟加载，避免启动时的依赖错误
-# from voice_matcher import get_voice_matcher
+from audio_preprocessor import get_audio_preprocessor  # ✅ 导入音频预处理
+# 声纹匹配为可选功能：依赖缺失时服务照常启动，只跳过声纹匹配（模型仍在首次使用时加载）
+try:
+    from voice_matcher import get_voice_matcher
+    VOICE_MATCHER_AVAILABLE = True
+except ImportError:
+    VOICE_MATCHER_AVAILABLE = False
 
 # =============================================
 # 1. 日志配置 (存入 ./logs 目录)
@@ -45,37 +66,190 @@ console_handler.setFormatter(formatter)
 file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=10, encoding='utf-8')
 file_handler.setFormatter(formatter)
 
+# 请求路径上的日志调用只把记录放进队列，格式化、写文件和切割都在后台监听线程里完成，
+# 日志切割时也不会卡住请求
 # 避免重复添加
 if not logger.handlers:
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, console_handler, file_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)  # 退出前把队列里剩余的日志写完
+    logger.addHandler(QueueHandler(log_queue))
 
 # =============================================
 # 2. 模型加载 (CPU 优化)
 # =============================================
+# 模型在服务 startup 事件中加载（而不是 import 时），多 worker 时每个进程只在真正启动服务时加载一次
+if torch.cuda.is_available():
+    DEVICE = "cuda"
+else:
+    DEVICE = "cpu"
+
+# CPU 模式下是否对 ASR 主模型做 int8 动态量化（默认关闭，开启前请先评估识别准确率）
+ASR_QUANTIZE = os.getenv("ASR_QUANTIZE", "false").lower() == "true"
+
+# 请求结束后的内存回收：大对象靠引用计数即时释放，默认不再每个请求做一次全量 GC
+CLEAR_GC_PER_REQUEST = os.getenv("CLEAR_GC_PER_REQUEST", "false").lower() == "true"
+# CUDA 缓存分配器中空闲（已预留未使用）显存超过该值才 empty_cache，避免每个请求都清空缓存再重新申请
+CUDA_CACHE_HIGH_WATER = int(os.getenv("CUDA_CACHE_HIGH_WATER_MB", "1024")) << 20
+
+# 增加线程数以利用服务器的 16核 CPU（NCPU 在文件开头、import torch 之前定义）
+torch.set_num_threads(NCPU)
 try:
+    torch.set_num_interop_threads(2)
+except RuntimeError:
+    # 已有并行任务运行后不允许再修改
+    pass
+
+model = None
+_model_lock = threading.Lock()
+
+# 首次加载成功后记录各模型解析出的本地目录；之后启动直接传本地路径，
+# 跳过 modelscope 按模型名查询/校验仓库的过程（funasr 版本变化或目录缺失时自动失效）
+MODEL_READY_FILE = Path(__file__).parent / "models" / ".ready.json"
+
+# AutoModel 的模型参数名 -> 加载后对应的 kwargs 属性
+_MODEL_KWARGS_ATTRS = {
+    "model": "kwargs",
+    "vad_model": "vad_kwargs",
+    "punc_model": "punc_kwargs",
+    "spk_model": "spk_kwargs",
+}
+
+
+def get_model():
+    """获取 FunASR 模型单例（首次调用时加载）"""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = _load_model()
+    return model
+
+
+# 推理放到工作线程执行后仍保持一次只跑一个 generate（与原先在事件循环里直接推理时一致）
+_generate_lock = threading.Lock()
+
+def _generate(**kwargs):
+    """在工作线程中串行调用模型推理（inference_mode 比 no_grad 更省：不做版本计数和视图追踪）"""
+    with _generate_lock, torch.inference_mode():
+        return get_model().generate(**kwargs)
+
+
+def _read_ready_paths(funasr_version: str) -> dict:
+    """读取已缓存的模型本地路径，不可用时返回空字典"""
+    try:
+        ready = json.loads(MODEL_READY_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    paths = ready.get("paths") or {}
+    if ready.get("funasr_version") != funasr_version:
+        return {}
+    if not paths or not all(Path(p).is_dir() for p in paths.values()):
+        return {}
+    return paths
+
+
+def _write_ready_paths(asr_model, funasr_version: str) -> None:
+    """记录各模型的本地目录，供下次启动使用"""
+    paths = {}
+    for arg, attr in _MODEL_KWARGS_ATTRS.items():
+        model_path = (getattr(asr_model, attr, None) or {}).get("model_path")
+        if model_path and Path(model_path).is_dir():
+            paths[arg] = str(model_path)
+    if not paths:
+        return
+    try:
+        MODEL_READY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        MODEL_READY_FILE.write_text(
+            json.dumps({"funasr_version": funasr_version, "paths": paths}, ensure_ascii=False, indent=2),
+            encoding="utf-8"
+        )
+    except OSError as e:
+        logger.warning(f"⚠️ 写入模型缓存标记失败: {e}")
+
+
+def _quantize_asr_model(asr_model) -> None:
+    """
+    CPU 上对 ASR 主模型的 Linear 层做 int8 动态量化（编码器/解码器的矩阵乘占主要算力）
+    quantize_dynamic 只支持 Linear/RNN 类层，其余层保持 fp32；VAD/标点/说话人模型不处理
+    """
+    try:
+        torch.quantization.quantize_dynamic(
+            asr_model.model,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+            inplace=True
+        )
+        logger.info("✅ ASR 模型已启用 int8 动态量化")
+    except Exception as e:
+        logger.warning(f"⚠️ ASR 模型量化失败，继续使用 fp32 模型: {e}")
+
+
+def _warm_up_model(asr_model) -> None:
+    """
+    启动时预热（算子初始化、MKLDNN 权重重排、CUDA 内核加载），避免第一个真实请求承担这部分延迟；
+    预热失败不影响服务启动
+
+    全零输入过不了 VAD，generate() 只会跑到 VAD 为止，所以 ASR/标点/说话人子模型直接单独跑一次：
+    ASR 和 cam++ 用 1 秒低幅噪声，标点模型用一小段文字
+    """
+    start = time.perf_counter()
+    noise = (np.random.default_rng(0).standard_normal(16000) * 0.01).astype(np.float32)
+    steps = [
+        ("vad", lambda: asr_model.generate(input=noise, batch_size_s=300)),
+        ("asr", lambda: asr_model.inference(noise, model=asr_model.model, kwargs=asr_model.kwargs)),
+    ]
+    if getattr(asr_model, "punc_model", None) is not None:
+        steps.append(("punc", lambda: asr_model.inference(
+            "今天的会议开始了", model=asr_model.punc_model, kwargs=asr_model.punc_kwargs
+        )))
+    if getattr(asr_model, "spk_model", None) is not None:
+        steps.append(("spk", lambda: asr_model.inference(
+            [noise], model=asr_model.spk_model, kwargs=asr_model.spk_kwargs
+        )))
+
+    warmed = []
+    with torch.inference_mode():
+        for name, step in steps:
+            try:
+                step()
+                warmed.append(name)
+            except Exception as e:
+                logger.warning(f"⚠️ {name} 模型预热失败（不影响服务）: {e}")
+    logger.info(f"🔥 模型预热完成: {', '.join(warmed) or '无'} ({time.perf_counter() - start:.2f}s)")
+
+
+def _load_model():
+    import funasr
     from funasr import AutoModel
+    funasr_version = getattr(funasr, "__version__", "")
     logger.info("📦 正在初始化服务...")
     
-    if torch.cuda.is_available():
-        DEVICE = "cuda"
+    if DEVICE == "cuda":
         logger.info("✅ 检测到可用 GPU，使用 CUDA 加速")
     else:
-        DEVICE = "cpu"
         logger.info("⚠️ 未检测到 GPU，使用 CPU 模式")
-        
-    # 增加线程数以利用服务器的 16核 CPU
-    NCPU = 8 
     
     logger.info(f"⚙️ 加载模型中... (Device: {DEVICE}, Threads: {NCPU})")
     
     # =================== 配置1：小模型（推荐，显存占用小）===================
     # ✅ 使用标准Paraformer模型（显存占用约4-6GB）
-    model = AutoModel(
-        model="paraformer-zh",                          # 标准中文模型
-        vad_model="fsmn-vad",                          # VAD模型
-        punc_model="ct-punc",                          # 标点模型
-        spk_model="cam++",                             # 说话人识别
+    model_names = {
+        "model": "paraformer-zh",                      # 标准中文模型
+        "vad_model": "fsmn-vad",                       # VAD模型
+        "punc_model": "ct-punc",                       # 标点模型
+        "spk_model": "cam++",                          # 说话人识别
+    }
+    ready_paths = _read_ready_paths(funasr_version)
+    if ready_paths.keys() == model_names.keys():
+        logger.info("⚡ 使用已缓存的模型本地目录，跳过模型仓库校验")
+        model_names = ready_paths
+    else:
+        ready_paths = {}
+    
+    asr_model = AutoModel(
+        **model_names,
         device=DEVICE,
         ncpu=NCPU,
         disable_update=True,
@@ -85,7 +259,7 @@ try:
     # =================== 配置2：大模型（注释，需要12GB+显存）===================
     # # ⭐ Paraformer-Large大模型（带VAD和标点，支持完整时间戳和说话人分离）
     # # 显存需求：12-16GB，准确率最高，功能最完整
-    # model = AutoModel(
+    # asr_model = AutoModel(
     #     model="iic/speech_paraformer-large-vad-punc_asr_nat-zh-cn-16k-common-vocab8404-pytorch",
     #     model_revision="v2.0.4",
     #     spk_model="iic/speech_campplus_sv_zh-cn_16k-common",
@@ -95,17 +269,368 @@ try:
     #     quantize=False
     # )
     
+    if not ready_paths:
+        _write_ready_paths(asr_model, funasr_version)
+    
+    if ASR_QUANTIZE and DEVICE == "cpu":
+        _quantize_asr_model(asr_model)
+    
     logger.info("✅ FunASR 模型加载成功！服务就绪。")
+    return asr_model
+
+# =============================================
+# 识别结果缓存（按上传内容哈希，进程内 LRU）
+# =============================================
+ASR_CACHE_SIZE = int(os.getenv("ASR_CACHE_SIZE", "128"))  # 0 表示关闭
+UPLOAD_COPY_BUFSIZE = 1 << 20
+# 不超过该大小的上传写入匿名内存文件（memfd）而不是磁盘临时文件，0 表示关闭
+UPLOAD_MEMFD_MAX = int(os.getenv("UPLOAD_MEMFD_MAX_MB", "64")) << 20
+
+_asr_result_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_asr_cache_lock = threading.Lock()
+
+
+def _copy_and_hash(src, dst=None) -> str:
+    """把上传内容写入临时文件，同时计算 blake2b 摘要（一次读取完成两件事）；dst 为 None 时只计算摘要"""
+    hasher = hashlib.blake2b(digest_size=16)
+    while True:
+        chunk = src.read(UPLOAD_COPY_BUFSIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        if dst is not None:
+            dst.write(chunk)
+    return hasher.hexdigest()
+
+
+def _upload_fd_path(upload: UploadFile) -> Optional[Path]:
+    """
+    上传内容已经在磁盘临时文件里时（Starlette 的 SpooledTemporaryFile 超过 1MB 即落盘），
+    返回可供 ffmpeg / torchaudio 按路径读取的 /proc/<pid>/fd/<n>，不必再复制一份；否则返回 None
+    
+    文件由 FastAPI 在响应结束后关闭，请求处理期间一直有效
+    """
+    src = upload.file
+    if getattr(src, "_rolled", True) is False or not os.path.isdir("/proc/self/fd"):
+        # 仍在内存里（取 fileno 会强制落盘），或非 Linux
+        return None
+    try:
+        fd = src.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    return Path(f"/proc/{os.getpid()}/fd/{fd}")
+
+
+def _open_upload_memfd(size: Optional[int]) -> Optional[int]:
+    """
+    上传不大时用 memfd 代替磁盘临时文件，返回 fd；不适用（非 Linux、大小未知或过大）时返回 None
     
-except Exception as e:
-    logger.critical(f"❌ 模型加载失败: {e}", exc_info=True)
-    sys.exit(1)
+    memfd 只在内存里，ffmpeg / torchaudio 通过 /proc/<pid>/fd/<n> 仍可按路径读取
+    """
+    if not hasattr(os, "memfd_create") or not size or size > UPLOAD_MEMFD_MAX:
+        return None
+    try:
+        return os.memfd_create("funasr_upload")
+    except OSError:
+        return None
+
+
+async def _iter_upload(file: UploadFile, hasher):
+    """按块读取上传内容，同时更新哈希"""
+    while True:
+        chunk = await file.read(UPLOAD_COPY_BUFSIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        yield chunk
+
+
+def _release_cuda_cache() -> None:
+    """空闲显存超过高水位时才归还给驱动；empty_cache 会同步设备，且之后的请求要重新申请显存"""
+    idle = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+    if idle > CUDA_CACHE_HIGH_WATER:
+        torch.cuda.empty_cache()
+        logger.info(f"🧹 已释放空闲显存缓存: {idle / (1 << 20):.0f}MB")
+
+
+def _voice_matching_enabled() -> bool:
+    """声纹库是否可用（决定是否需要保留原始音频文件）"""
+    if not VOICE_MATCHER_AVAILABLE:
+        return False
+    voice_matcher = get_voice_matcher()
+    return bool(voice_matcher and voice_matcher.enabled)
+
+
+def _asr_cache_key(upload_digest: str, hotwords: str) -> str:
+    """缓存键：音频内容 + 热词 + 模型配置，热词重载或切换量化后自然失效"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in (upload_digest, hotwords or "", f"quantize={ASR_QUANTIZE}"):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _asr_cache_get(key: Optional[str]):
+    """返回 (full_text, transcript) 的副本，未命中返回 None"""
+    if not key or ASR_CACHE_SIZE <= 0:
+        return None
+    with _asr_cache_lock:
+        cached = _asr_result_cache.get(key)
+        if cached is None:
+            return None
+        _asr_result_cache.move_to_end(key)
+    full_text, transcript = cached
+    # 后续声纹匹配会原地修改句子字典，返回副本保证缓存不被污染
+    return full_text, [dict(item) for item in transcript]
+
+
+def _asr_cache_put(key: Optional[str], full_text: str, transcript: list) -> None:
+    if not key or ASR_CACHE_SIZE <= 0:
+        return
+    entry = (full_text, tuple(dict(item) for item in transcript))
+    with _asr_cache_lock:
+        _asr_result_cache[key] = entry
+        _asr_result_cache.move_to_end(key)
+        while len(_asr_result_cache) > ASR_CACHE_SIZE:
+            _asr_result_cache.popitem(last=False)
+
+
+def clear_asr_cache() -> int:
+    """清空识别结果缓存，返回清除的条目数"""
+    with _asr_cache_lock:
+        count = len(_asr_result_cache)
+        _asr_result_cache.clear()
+    return count
+
 
 # =============================================
 # 3. FastAPI 服务
 # =============================================
 app = FastAPI(title="FunASR Service", version="1.0.0")
 
+
+@app.on_event("startup")
+async def load_models_on_startup():
+    """启动时加载模型，加载失败则终止启动"""
+    try:
+        asr_model = await asyncio.to_thread(get_model)
+    except Exception as e:
+        logger.critical(f"❌ 模型加载失败: {e}", exc_info=True)
+        raise
+    
+    await asyncio.to_thread(_warm_up_model, asr_model)
+    
+    # 声纹匹配器（Cam++ 模型 + 已注册声纹矩阵）也在启动时初始化，首个请求不再承担加载和拉取声纹库的开销；
+    # 初始化失败只会禁用声纹匹配，不影响识别服务启动
+    if VOICE_MATCHER_AVAILABLE:
+        await asyncio.to_thread(get_voice_matcher)
+    
+    # 模型权重等启动期对象移入永久代，之后的分代 GC 不再反复遍历它们
+    gc.collect()
+    gc.freeze()
+
+# 词级别合并时的分句标点
+_SENTENCE_END_PUNCT = frozenset(["。", "？", "！", ".", "?", "!"])
+
+
+def _parse_asr_result(res):
+    """
+    解析 FunASR 返回结果（包含时间戳和说话人ID）
+    
+    Returns:
+        (full_text, transcript)
+    """
+    full_text = ""
+    transcript = []
+    if res and len(res) > 0:
+        result = res[0]
+        full_text = result.get("text", "")
+    
+        # 调试：打印返回的数据结构键
+        logger.info(f"🔍 FunASR返回的数据字段: {list(result.keys())}")
+    
+        # ===== 方案1: 句子级别（带说话人） =====
+        sentence_info = result.get("sentence_info", None)
+    
+        if sentence_info and len(sentence_info) > 0:
+            logger.info(f"✅ 使用句子级别解析（含说话人识别）")
+            for sent in sentence_info:
+                text = sent.get("text", "").strip()
+                if not text:
+                    continue
+    
+                # 时间戳（毫秒）
+                timestamps = sent.get("timestamp", [])
+                if timestamps and len(timestamps) > 0:
+                    start_ms = timestamps[0][0] if isinstance(timestamps[0], list) else 0
+                    end_ms = timestamps[-1][1] if isinstance(timestamps[-1], list) else 0
+                else:
+                    start_ms = 0
+                    end_ms = 0
+    
+                # 说话人ID
+                speaker_id = str(sent.get("spk", "unknown"))
+    
+                # ✅ 提取置信度（如果有）
+                confidence = sent.get("confidence", None)
+    
+                item = {
+                    "text": text,
+                    "start_time": round(start_ms / 1000.0, 2),
+                    "end_time": round(end_ms / 1000.0, 2),
+                    "speaker_id": speaker_id
+                }
+    
+                # 如果有置信度信息，添加到结果中
+                if confidence is not None:
+                    item["confidence"] = round(confidence, 3)
+    
+                transcript.append(item)
+    
+        # ===== 方案2: 词级别（需要合并成句子） =====
+        else:
+            logger.warning("⚠️ 未检测到句子级信息，使用词级别合并")
+            raw_stamp = result.get("timestamp", [])
+    
+            if raw_stamp and len(raw_stamp) > 0:
+                # 合并策略：遇到标点或停顿超过1秒则分句
+                current_sentence = []
+                current_start = None
+                current_end = None
+                sentence_count = 0
+    
+                for item in raw_stamp:
+                    if not isinstance(item, list) or len(item) < 2:
+                        continue
+    
+                    t_range = item[0]
+                    word = str(item[-1]).strip()
+    
+                    if not isinstance(t_range, list) or len(t_range) < 2:
+                        continue
+    
+                    start_ms = t_range[0]
+                    end_ms = t_range[1]
+    
+                    # 第一个词
+                    if current_start is None:
+                        current_start = start_ms
+    
+                    current_sentence.append(word)
+                    current_end = end_ms
+    
+                    # 分句条件：遇到标点符号
+                    if word in _SENTENCE_END_PUNCT:
+                        sentence_text = "".join(current_sentence)
+                        if sentence_text and sentence_text not in ["。", "？", "！"]:
+                            sentence_count += 1
+                            transcript.append({
+                                "text": sentence_text,
+                                "start_time": round(current_start / 1000.0, 2),
+                                "end_time": round(current_end / 1000.0, 2),
+                                "speaker_id": str((sentence_count - 1) % 5 + 1)  # 假设最多5个人，循环分配
+                            })
+                        # 重置
+                        current_sentence = []
+                        current_start = None
+    
+                # 处理最后一句（没有标点结尾的）
+                if current_sentence:
+                    sentence_text = "".join(current_sentence)
+                    if sentence_text:
+                        sentence_count += 1
+                        transcript.append({
+                            "text": sentence_text,
+                            "start_time": round(current_start / 1000.0, 2),
+                            "end_time": round(current_end / 1000.0, 2),
+                            "speaker_id": str((sentence_count - 1) % 5 + 1)
+                        })
+    
+                logger.info(f"📝 合并完成: {len(raw_stamp)}个词 -> {len(transcript)}个句子")
+            else:
+                # 完全没有时间戳信息
+                logger.warning("⚠️ 无时间戳信息，返回纯文本")
+                transcript.append({
+                    "text": full_text,
+                    "start_time": 0.0,
+                    "end_time": 0.0,
+                    "speaker_id": "1"
+                })
+    
+    return full_text, transcript
+
+
+def _recognize(audio, hotwords: str):
+    """
+    推理并解析结果（在工作线程中执行）
+    
+    模型原始输出只存在于本函数内，返回后随引用计数立即释放
+    """
+    res = _generate(
+        input=audio, 
+        batch_size_s=300, 
+        hotword=hotwords,           # ✅ 使用合并后的热词
+        batch_size_token=5000,      # token批处理大小
+        batch_size_token_threshold_s=60  # 时间阈值
+    )
+    return _parse_asr_result(res)
+
+
+async def _run_asr(input_data, hotwords: str, voice_audio_path: Optional[str] = None):
+    """
+    音频预处理 + 推理 + 解析
+    
+    预处理后的整段波形只在本函数内引用，返回后即释放，请求处理函数不再持有它
+    
+    Args:
+        input_data: 音频路径/URL，或流式预处理得到的波形
+        hotwords: 合并后的热词
+        voice_audio_path: 需要声纹匹配时为原始音频路径
+    
+    Returns:
+        (full_text, transcript, voice_wav, waveform_task)：声纹匹配用的原始波形，
+        随预处理一起解码成功时为 voice_wav，否则为推理期间并行解码的 waveform_task（调用方负责 await）
+    """
+    voice_wav = None
+    waveform_task = None
+    
+    # === 音频预处理（可选，提升准确率3-5%）===
+    # ffmpeg 输出直接经管道读成 16kHz 波形交给模型，不再落盘中间 WAV；失败时沿用原始文件
+    if isinstance(input_data, str) and Path(input_data).exists():
+        preprocessor = get_audio_preprocessor()
+        processed_audio = None
+        if voice_audio_path:
+            # 声纹匹配也要整段原始波形：一次 ffmpeg 解码同时输出两路，不再单独解码原文件
+            processed_audio, raw_audio = await asyncio.to_thread(
+                preprocessor.preprocess_with_raw, input_data
+            )
+            if raw_audio is not None:
+                voice_wav = torch.from_numpy(raw_audio)
+        if processed_audio is None:
+            processed_audio = await preprocessor.preprocess_to_array_async(input_data)
+        if processed_audio is not None:
+            logger.info("✅ 使用预处理后的音频")
+            input_data = processed_audio
+    
+    # 没能随预处理拿到原始波形时，推理期间在另一个线程里解码（不依赖识别结果）
+    if voice_wav is None and voice_audio_path:
+        waveform_task = asyncio.create_task(
+            asyncio.to_thread(get_voice_matcher().load_audio, voice_audio_path)
+        )
+    
+    # === 开始推理 ===
+    logger.info(f"Processing... Hotword:{len(hotwords)} chars")
+    try:
+        full_text, transcript = await asyncio.to_thread(_recognize, input_data, hotwords)
+    except BaseException:
+        # 推理失败时也要等解码线程读完临时文件，调用方随后会删除它
+        if waveform_task is not None:
+            await asyncio.gather(waveform_task, return_exceptions=True)
+        raise
+    
+    return full_text, transcript, voice_wav, waveform_task
+
+
 router = APIRouter(prefix="/api/v1")
 
 # 健康检查接口 (解决 404 Health 错误)
@@ -123,18 +648,50 @@ async def transcribe(
     hotword: str = Form("")  # 外部传入的热词（可选）
 ):
     temp_file_path = None
+    work_dir = None  # 本次请求的临时目录，结束时整体删除
+    upload_fd = None  # 上传内容所在的 memfd（小文件不落盘时）
+    upload_digest = None  # 上传内容的哈希，用作识别结果缓存键
     input_data = None 
+    waveform_task = None  # 声纹匹配用的整段波形，与 ASR 推理并行解码
+    voice_wav = None  # 随预处理一起解码出的原始波形（声纹匹配用）
 
     try:
         # === 逻辑判断 ===
         if file:
             logger.info(f"📥 接收到文件上传: {file.filename}")
             suffix = Path(file.filename).suffix
-            # 存临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                shutil.copyfileobj(file.file, tmp)
-                temp_file_path = Path(tmp.name)
-            input_data = str(temp_file_path)
+            
+            # 声纹匹配需要原始音频文件；不需要时上传内容直接流式送入 ffmpeg，省掉临时文件的写入和读回
+            if not _voice_matching_enabled():
+                hasher = hashlib.blake2b(digest_size=16)
+                input_data = await get_audio_preprocessor().preprocess_stream(
+                    _iter_upload(file, hasher)
+                )
+                if input_data is not None:
+                    upload_digest = hasher.hexdigest()
+                else:
+                    # 无 ffmpeg 或格式不支持管道解码：回到落盘路径
+                    await file.seek(0)
+            
+            if input_data is None:
+                # 存临时文件：上传已落盘时直接用它；否则小文件放内存文件，大文件或不支持 memfd 时落盘
+                upload_path = _upload_fd_path(file)
+                if upload_path is None:
+                    upload_fd = _open_upload_memfd(getattr(file, "size", None))
+                if upload_path is not None:
+                    temp_file_path = upload_path
+                    file.file.seek(0)
+                    upload_digest = _copy_and_hash(file.file)
+                elif upload_fd is not None:
+                    temp_file_path = Path(f"/proc/{os.getpid()}/fd/{upload_fd}")
+                    with open(upload_fd, "wb", closefd=False) as dst:
+                        upload_digest = _copy_and_hash(file.file, dst)
+                else:
+                    work_dir = tempfile.TemporaryDirectory(prefix="funasr_")
+                    temp_file_path = Path(work_dir.name) / f"upload{suffix}"
+                    with open(temp_file_path, "wb") as dst:
+                        upload_digest = _copy_and_hash(file.file, dst)
+                input_data = str(temp_file_path)
 
         elif audio_url:
             logger.info(f"🔗 接收到音频 URL: {audio_url}")
@@ -143,13 +700,6 @@ async def transcribe(
         else:
             raise HTTPException(status_code=400, detail="必须提供 file 或 audio_url")
 
-        # === 音频预处理（可选，提升准确率3-5%）===
-        if isinstance(input_data, str) and Path(input_data).exists():
-            processed_input = audio_preprocessor.preprocess(input_data)
-            if processed_input != input_data:
-                logger.info("✅ 使用预处理后的音频")
-                input_data = processed_input
-        
         # === 自动加载热词 ===
         try:
             hotword_svc = get_hotword_service()
@@ -163,171 +713,63 @@ async def transcribe(
             else:
                 combined_hotwords = hotword
                 
-            hotword_count = len(hotword_svc.get_all_hotwords())
+            hotword_count = hotword_svc.get_hotword_count()
             logger.info(f"🔥 热词已加载: {hotword_count} 个")
         except Exception as e:
             logger.warning(f"⚠️ 热词加载失败: {e}，将不使用热词")
             combined_hotwords = hotword
         
-        # === 开始推理 ===
-        logger.info(f"Processing... Hotword:{len(combined_hotwords)} chars")
-
-        res = model.generate(
-            input=input_data, 
-            batch_size_s=300, 
-            hotword=combined_hotwords,  # ✅ 使用合并后的热词
-            batch_size_token=5000,      # token批处理大小
-            batch_size_token_threshold_s=60  # 时间阈值
-        )
+        # === 识别结果缓存（同一文件 + 同一热词直接返回，重试/重复提交不再跑模型）===
+        cache_key = _asr_cache_key(upload_digest, combined_hotwords) if upload_digest else None
+        cached = _asr_cache_get(cache_key)
         
-        # 3. 结果解析（包含时间戳和说话人ID）
-        full_text = ""
-        html_text = ""
-        transcript = []
-        if res and len(res) > 0:
-            result = res[0]
-            full_text = result.get("text", "")
-
-            # 高亮功能已移除：主服务不使用 html 字段
-            html_text = full_text  # 暂时保持字段兼容性
-            
-            # 调试：打印返回的数据结构键
-            logger.info(f"🔍 FunASR返回的数据字段: {list(result.keys())}")
-            
-            # ===== 方案1: 句子级别（带说话人） =====
-            sentence_info = result.get("sentence_info", None)
-            
-            if sentence_info and len(sentence_info) > 0:
-                logger.info(f"✅ 使用句子级别解析（含说话人识别）")
-                for sent in sentence_info:
-                    text = sent.get("text", "").strip()
-                    if not text:
-                        continue
-                    
-                    # 时间戳（毫秒）
-                    timestamps = sent.get("timestamp", [])
-                    if timestamps and len(timestamps) > 0:
-                        start_ms = timestamps[0][0] if isinstance(timestamps[0], list) else 0
-                        end_ms = timestamps[-1][1] if isinstance(timestamps[-1], list) else 0
-                    else:
-                        start_ms = 0
-                        end_ms = 0
-                    
-                    # 说话人ID
-                    speaker_id = str(sent.get("spk", "unknown"))
-                    
-                    # ✅ 提取置信度（如果有）
-                    confidence = sent.get("confidence", None)
-                    
-                    item = {
-                        "text": text,
-                        "start_time": round(start_ms / 1000.0, 2),
-                        "end_time": round(end_ms / 1000.0, 2),
-                        "speaker_id": speaker_id
-                    }
-                    
-                    # 如果有置信度信息，添加到结果中
-                    if confidence is not None:
-                        item["confidence"] = round(confidence, 3)
-                    
-                    transcript.append(item)
-            
-            # ===== 方案2: 词级别（需要合并成句子） =====
-            else:
-                logger.warning("⚠️ 未检测到句子级信息，使用词级别合并")
-                raw_stamp = result.get("timestamp", [])
-                
-                if raw_stamp and len(raw_stamp) > 0:
-                    # 合并策略：遇到标点或停顿超过1秒则分句
-                    current_sentence = []
-                    current_start = None
-                    current_end = None
-                    sentence_count = 0
-                    
-                    for item in raw_stamp:
-                        if not isinstance(item, list) or len(item) < 2:
-                            continue
-                        
-                        t_range = item[0]
-                        word = str(item[-1]).strip()
-                        
-                        if not isinstance(t_range, list) or len(t_range) < 2:
-                            continue
-                        
-                        start_ms = t_range[0]
-                        end_ms = t_range[1]
-                        
-                        # 第一个词
-                        if current_start is None:
-                            current_start = start_ms
-                        
-                        current_sentence.append(word)
-                        current_end = end_ms
-                        
-                        # 分句条件：遇到标点符号
-                        if word in ["。", "？", "！", ".", "?", "!"]:
-                            sentence_text = "".join(current_sentence)
-                            if sentence_text and sentence_text not in ["。", "？", "！"]:
-                                sentence_count += 1
-                                transcript.append({
-                                    "text": sentence_text,
-                                    "start_time": round(current_start / 1000.0, 2),
-                                    "end_time": round(current_end / 1000.0, 2),
-                                    "speaker_id": str((sentence_count - 1) % 5 + 1)  # 假设最多5个人，循环分配
-                                })
-                            # 重置
-                            current_sentence = []
-                            current_start = None
-                    
-                    # 处理最后一句（没有标点结尾的）
-                    if current_sentence:
-                        sentence_text = "".join(current_sentence)
-                        if sentence_text:
-                            sentence_count += 1
-                            transcript.append({
-                                "text": sentence_text,
-                                "start_time": round(current_start / 1000.0, 2),
-                                "end_time": round(current_end / 1000.0, 2),
-                                "speaker_id": str((sentence_count - 1) % 5 + 1)
-                            })
-                    
-                    logger.info(f"📝 合并完成: {len(raw_stamp)}个词 -> {len(transcript)}个句子")
-                else:
-                    # 完全没有时间戳信息
-                    logger.warning("⚠️ 无时间戳信息，返回纯文本")
-                    transcript.append({
-                        "text": full_text,
-                        "start_time": 0.0,
-                        "end_time": 0.0,
-                        "speaker_id": "1"
-                    })
+        if cached is not None:
+            full_text, transcript = cached
+            logger.info("⚡ 命中识别结果缓存，跳过推理")
+        else:
+            voice_audio_path = str(temp_file_path) if temp_file_path and _voice_matching_enabled() else None
+            full_text, transcript, voice_wav, waveform_task = await _run_asr(
+                input_data, combined_hotwords, voice_audio_path
+            )
+            _asr_cache_put(cache_key, full_text, transcript)
+        
+        # 流式上传时 input_data 是整段波形，识别完即可释放
+        input_data = None
+        
+        html_text = full_text  # 高亮功能已移除：主服务不使用 html 字段，暂时保持字段兼容性
 
         logger.info(f"✅ 识别成功: {file.filename} (长度: {len(full_text)}字)")
         
         # ===== 声纹识别（可选，如果声纹库为空则跳过）=====
         matched_info = {}
         try:
-            # 延迟导入，避免启动时的依赖错误
-            from voice_matcher import get_voice_matcher
-            
-            voice_matcher = get_voice_matcher()
+            voice_matcher = get_voice_matcher() if VOICE_MATCHER_AVAILABLE else None
             if voice_matcher and voice_matcher.enabled and transcript and temp_file_path:
                 logger.info("🎙️ 开始声纹匹配...")
                 
                 # 1. 为每个说话人提取音频片段
-                speaker_segments = voice_matcher.extract_speaker_segments(
+                wav = voice_wav
+                if wav is None and waveform_task is not None:
+                    wav = await waveform_task
+                voice_wav = None
+                # 解码/切片、声纹前向和声纹库检索都放到工作线程，不阻塞事件循环上的其他请求
+                speaker_segments = await asyncio.to_thread(
+                    voice_matcher.extract_speaker_segments,
                     audio_path=str(temp_file_path),
                     transcript=transcript,
-                    duration=10  # 提取10秒
+                    duration=10,  # 提取10秒
+                    wav=wav
                 )
+                del wav
                 
                 if speaker_segments:
                     logger.info(f"✅ 提取到 {len(speaker_segments)} 个说话人的音频片段")
                     
                     # 2. 匹配说话人身份
-                    matched = voice_matcher.match_speakers(
+                    matched = await asyncio.to_thread(
+                        voice_matcher.match_speakers,
                         speaker_segments=speaker_segments,
-                        threshold=0.75  # 相似度阈值75%
+                        threshold=0.5  # 余弦相似度阈值（等同于原先 (1+cos)/2 口径下的 75%）
                     )
                     
                     if matched:
@@ -353,15 +795,14 @@ async def transcribe(
                     matched_info = {}
             else:
                 matched_info = {}
-                if not voice_matcher:
+                if not VOICE_MATCHER_AVAILABLE:
+                    logger.warning(f"⚠️ 声纹匹配模块导入失败（依赖缺失），跳过声纹匹配")
+                    logger.warning(f"   如需使用声纹识别，请运行: pip install 'datasets>=2.14.0'")
+                elif not voice_matcher:
                     logger.warning("⚠️ 声纹匹配器未初始化")
                 elif not voice_matcher.enabled:
                     logger.info("ℹ️ 声纹库为空，跳过声纹匹配")
                     
-        except ImportError as e:
-            logger.warning(f"⚠️ 声纹匹配模块导入失败（依赖缺失），跳过声纹匹配")
-            logger.warning(f"   如需使用声纹识别，请运行: pip install 'datasets>=2.14.0'")
-            matched_info = {}
         except Exception as e:
             logger.error(f"❌ 声纹匹配失败: {e}", exc_info=True)
             matched_info = {}
@@ -384,21 +825,19 @@ async def transcribe(
         raise HTTPException(status_code=500, detail="Internal Server Error")
         
     finally:
-        # 清理临时文件和变量
-        if temp_file_path and temp_file_path.exists():
-            try:
-                temp_file_path.unlink()
-            except Exception:
-                pass
+        # 清理临时目录（先等提前解码的线程读完临时文件）
+        if waveform_task is not None:
+            await asyncio.gather(waveform_task, return_exceptions=True)
+            waveform_task = None
+        if work_dir is not None:
+            work_dir.cleanup()
+        if upload_fd is not None:
+            os.close(upload_fd)
 
-        if 'input_data' in locals(): del input_data
-        if 'res' in locals(): del res
-        
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            
-        logger.info("🧹 内存清理完成，准备迎接下一个任务")
+        if CLEAR_GC_PER_REQUEST:
+            gc.collect()
+        if DEVICE == "cuda":
+            _release_cuda_cache()
 
 
 # =============================================
@@ -417,7 +856,7 @@ async def get_hotwords():
                 "categories": hotword_svc.get_categories(),
                 "hotwords": hotword_svc.hotwords_cache,
                 "stats": hotword_svc.get_stats(),
-                "total": len(hotword_svc.get_all_hotwords())
+                "total": hotword_svc.get_hotword_count()
             }
         }
     except Exception as e:
@@ -437,7 +876,7 @@ async def reload_hotwords():
                 "code": 0,
                 "msg": "热词重载成功",
                 "data": {
-                    "total": len(hotword_svc.get_all_hotwords()),
+                    "total": hotword_svc.get_hotword_count(),
                     "stats": hotword_svc.get_stats()
                 }
             }
@@ -448,6 +887,56 @@ async def reload_hotwords():
         return {"code": 500, "msg": str(e)}
 
 
+@router.post("/voice/reload")
+async def reload_voice_library():
+    """声纹库有注册/删除后调用：立即刷新内存中的声纹库"""
+    if not VOICE_MATCHER_AVAILABLE:
+        return {"code": 500, "msg": "声纹识别模块未安装"}
+    try:
+        voice_matcher = await asyncio.to_thread(get_voice_matcher)
+        if not voice_matcher:
+            return {"code": 500, "msg": "声纹匹配器初始化失败"}
+        count = await asyncio.to_thread(voice_matcher.reload_enrolled)
+        logger.info(f"🔄 声纹库已重新载入: {count} 个声纹")
+        return {"code": 0, "msg": "success", "data": {"total": count}}
+    except Exception as e:
+        logger.error(f"❌ 重载声纹库失败: {e}")
+        return {"code": 500, "msg": str(e)}
+
+
+def _result_fingerprint() -> dict:
+    """热词与声纹库的当前版本（识别结果受两者影响，上游按此判断缓存是否仍然有效）"""
+    hotwords = get_hotword_service().get_hotwords_string()
+    voice_library = "unavailable"
+    if VOICE_MATCHER_AVAILABLE:
+        voice_matcher = get_voice_matcher()
+        if voice_matcher:
+            voice_library = voice_matcher.library_version()
+    return {
+        "hotwords": hashlib.sha256(hotwords.encode("utf-8")).hexdigest(),
+        "voice_library": voice_library,
+    }
+
+
+@router.get("/cache/fingerprint")
+async def get_result_fingerprint():
+    """获取识别结果指纹（热词版本 + 声纹库版本），供主服务的识别结果缓存使用"""
+    try:
+        data = await asyncio.to_thread(_result_fingerprint)
+        return {"code": 0, "msg": "success", "data": data}
+    except Exception as e:
+        logger.error(f"❌ 获取识别结果指纹失败: {e}")
+        return {"code": 500, "msg": str(e)}
+
+
+@router.post("/cache/clear")
+async def clear_cache():
+    """清空识别结果缓存"""
+    count = clear_asr_cache()
+    logger.info(f"🧹 已清空识别结果缓存: {count} 条")
+    return {"code": 0, "msg": "success", "data": {"cleared": count}}
+
+
 app.include_router(router)
 
 if __name__ == "__main__":
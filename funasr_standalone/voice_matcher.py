@@ -2,28 +2,95 @@
 声纹匹配服务
 用于将ASR识别的speaker_id映射到真实员工姓名
 """
+import hashlib
 import logging
+import threading
+import time
 import chromadb
+from chromadb.config import Settings
 import torch
+import torchaudio
+import torchaudio.compliance.kaldi as kaldi
 from modelscope.pipelines import pipeline
 from modelscope.utils.constant import Tasks
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
 import subprocess
-import tempfile
 import os
 
 logger = logging.getLogger(__name__)
 
+# onnxruntime 可选：export_campplus_onnx.py 导出模型后自动启用
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+DEFAULT_ONNX_PATH = Path(__file__).parent / "models" / "campplus.onnx"
+
+# Chroma 客户端按地址复用：同一进程只建一次连接池
+_chroma_clients: Dict[Tuple[str, int], "chromadb.HttpClient"] = {}
+_chroma_clients_lock = threading.Lock()
+
+
+def _get_chroma_client(host: str, port: int):
+    """获取（或创建）指定地址的 Chroma 客户端"""
+    key = (host, port)
+    with _chroma_clients_lock:
+        client = _chroma_clients.get(key)
+        if client is None:
+            client = chromadb.HttpClient(
+                host=host,
+                port=port,
+                settings=Settings(anonymized_telemetry=False)
+            )
+            _chroma_clients[key] = client
+        return client
+
+
+# 逐条提取声纹用的线程池：跨请求复用，首次使用时创建，不再每次匹配都创建/销毁线程
+EXTRACT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+_extract_executor: Optional[ThreadPoolExecutor] = None
+_extract_executor_lock = threading.Lock()
+
+
+def _get_extract_executor() -> ThreadPoolExecutor:
+    """获取声纹提取线程池"""
+    global _extract_executor
+    if _extract_executor is None:
+        with _extract_executor_lock:
+            if _extract_executor is None:
+                _extract_executor = ThreadPoolExecutor(
+                    max_workers=EXTRACT_MAX_WORKERS,
+                    thread_name_prefix="voice_extract"
+                )
+    return _extract_executor
+
+
 
 class VoiceMatcher:
     """声纹匹配器"""
     
+    SAMPLE_RATE = 16000  # Cam++ 模型要求的采样率
+    FBANK_NUM_MELS = 80       # Cam++ 输入为 80 维 fbank
+    FBANK_FRAME_LENGTH = 400  # 25ms @ 16kHz
+    FBANK_FRAME_SHIFT = 160   # 10ms @ 16kHz
+    FBANK_NFFT = 512          # 帧长向上取 2 的幂
+    EMBEDDING_CACHE_SIZE = 2048  # 声纹向量 LRU 缓存条数（每条 192 个 float，约 2MB）
+    MATRIX_MAX_ROWS = int(os.getenv("VOICE_MATRIX_MAX_ROWS", "50000"))  # 声纹库载入内存的上限（5 万 x 192 维约 37MB）
+    MATRIX_TTL_SECONDS = int(os.getenv("VOICE_MATRIX_TTL", "300"))  # 内存声纹库兜底刷新间隔（秒），注册后由 reload_enrolled 立即刷新
+    
     def __init__(self, 
                  chroma_host: str = "192.168.211.74",
                  chroma_port: int = 8000,
                  collection_name: str = "employee_voice_library",
-                 device: str = None):
+                 device: str = None,
+                 quantize: bool = False,
+                 onnx_path: Optional[str] = None):
         """
         初始化声纹匹配器
         
@@ -32,8 +99,22 @@ class VoiceMatcher:
             chroma_port: ChromaDB端口
             collection_name: 声纹库集合名称
             device: 设备（cuda/cpu）
+            quantize: CPU 推理时是否对 Linear 层做 int8 动态量化
+            onnx_path: Cam++ ONNX 模型路径（由 export_campplus_onnx.py 导出），存在时用 onnxruntime 推理
         """
         self.enabled = False
+        self.ort_session = None
+        
+        # 内存中的声纹库快照：(L2 归一化后的矩阵, 工号列表, 姓名列表, 载入时间, 内容版本)
+        # 整体作为一个元组发布，并发匹配读到的矩阵与工号/姓名始终属于同一次载入
+        self._enrolled: Optional[Tuple[np.ndarray, List[str], List[str], float, str]] = None
+        self._enrolled_lock = threading.Lock()
+        
+        # 声纹向量 LRU 缓存：PCM 内容哈希 -> 向量（同一段音频重复匹配时免去一次前向）
+        self._emb_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._emb_cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
         
         try:
             # 自动检测设备
@@ -54,12 +135,17 @@ class VoiceMatcher:
             )
             logger.info("✅ 声纹模型加载成功")
             
+            self._init_fbank()
+            
+            if quantize and self.device == "cpu":
+                self._quantize_model()
+            
+            if onnx_path:
+                self._init_onnx_session(onnx_path)
+            
             # 连接ChromaDB
             logger.info(f"🔌 连接 ChromaDB: {chroma_host}:{chroma_port}")
-            self.client = chromadb.HttpClient(
-                host=chroma_host,
-                port=chroma_port
-            )
+            self.client = _get_chroma_client(chroma_host, chroma_port)
             
             # 获取声纹库集合
             self.collection = self.client.get_or_create_collection(
@@ -76,221 +162,590 @@ class VoiceMatcher:
             else:
                 logger.info(f"✅ 声纹库已就绪，共 {count} 个员工声纹")
                 self.enabled = True
+                with self._enrolled_lock:
+                    self._load_enrolled_matrix()
             
         except Exception as e:
             logger.error(f"❌ 声纹匹配器初始化失败: {e}")
             logger.warning("⚠️ 声纹识别功能将被禁用，将使用默认speaker_id")
             self.enabled = False
     
+    def _quantize_model(self):
+        """
+        CPU 上对 Cam++ 的 Linear 层做 int8 动态量化
+        quantize_dynamic 只支持 Linear/RNN 类层，卷积层保持 fp32
+        """
+        try:
+            torch.quantization.quantize_dynamic(
+                self.embedding_model.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8,
+                inplace=True
+            )
+            logger.info("✅ 声纹模型已启用 int8 动态量化")
+        except Exception as e:
+            logger.warning(f"⚠️ 声纹模型量化失败，继续使用 fp32 模型: {e}")
+    
+    def _init_onnx_session(self, onnx_path: str):
+        """
+        创建 Cam++ 的 onnxruntime 会话（图优化全开，算子融合后 CPU 吞吐通常优于 PyTorch eager）
+        未安装 onnxruntime 或模型文件不存在时保持使用 PyTorch 模型
+        """
+        if not ONNXRUNTIME_AVAILABLE:
+            logger.info("ℹ️ 未安装 onnxruntime，声纹模型使用 PyTorch 推理")
+            return
+        if not Path(onnx_path).exists():
+            logger.info(f"ℹ️ 未找到 Cam++ ONNX 模型 ({onnx_path})，声纹模型使用 PyTorch 推理")
+            return
+        
+        try:
+            opts = ort.SessionOptions()
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            opts.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+            
+            if self.device.startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+                providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+            else:
+                providers = ["CPUExecutionProvider"]
+            
+            self.ort_session = ort.InferenceSession(onnx_path, sess_options=opts, providers=providers)
+            self._ort_input_name = self.ort_session.get_inputs()[0].name
+            logger.info(f"✅ Cam++ ONNX 推理已启用: {onnx_path} ({providers[0]})")
+        except Exception as e:
+            logger.warning(f"⚠️ 加载 Cam++ ONNX 模型失败，使用 PyTorch 推理: {e}")
+            self.ort_session = None
+    
+    def _init_fbank(self):
+        """
+        预先构建 Kaldi fbank 的 mel 滤波器组与 povey 窗并放到设备上，之后整批一次计算
+        参数与 Cam++ 训练时一致（torchaudio.compliance.kaldi.fbank 默认值）：
+        25ms 帧长 / 10ms 帧移、预加重 0.97、povey 窗、512 点 FFT、80 个 mel、20Hz~奈奎斯特
+        """
+        banks, _ = kaldi.get_mel_banks(
+            self.FBANK_NUM_MELS, self.FBANK_NFFT, float(self.SAMPLE_RATE),
+            20.0, 0.0, 100.0, -500.0, 1.0
+        )
+        # kaldi 的滤波器组不含奈奎斯特频点，补一列 0 对齐 rfft 输出
+        banks = torch.nn.functional.pad(banks, (0, 1), value=0)
+        self._mel_banks = banks.to(device=self.device, dtype=torch.float32)
+        self._fbank_window = torch.hann_window(
+            self.FBANK_FRAME_LENGTH, periodic=False, dtype=torch.float32, device=self.device
+        ).pow(0.85)
+    
+    def _compute_fbank(self, batch: torch.Tensor) -> torch.Tensor:
+        """
+        计算 Cam++ 输入特征，与模型内部一致：80 维 Kaldi fbank，按帧减均值
+        整批在设备上一次完成（分帧 + 一次 rfft + 一次矩阵乘），结果与逐条调用 kaldi.fbank 一致；
+        始终用 fp32 计算（fp16 的 fbank 会改变声纹）
+        
+        Args:
+            batch: (B, T) 16kHz 波形
+        
+        Returns:
+            (B, frames, 80) 特征（位于 self.device）
+        """
+        x = batch.to(device=self.device, dtype=torch.float32)
+        frames = x.unfold(1, self.FBANK_FRAME_LENGTH, self.FBANK_FRAME_SHIFT)  # (B, F, 400)
+        frames = frames - frames.mean(dim=2, keepdim=True)  # 去直流
+        prev = torch.cat([frames[..., :1], frames[..., :-1]], dim=2)
+        frames = (frames - 0.97 * prev) * self._fbank_window  # 预加重 + 加窗
+        frames = torch.nn.functional.pad(frames, (0, self.FBANK_NFFT - self.FBANK_FRAME_LENGTH))
+        power = torch.fft.rfft(frames).abs().pow(2)  # (B, F, 257)
+        mel = torch.matmul(power, self._mel_banks.T)  # (B, F, 80)
+        mel = torch.clamp(mel, min=torch.finfo(mel.dtype).eps).log()
+        return mel - mel.mean(dim=1, keepdim=True)
+    
+    def _embed_batch(self, model, batch: torch.Tensor) -> np.ndarray:
+        """
+        提取一批等长波形的声纹
+        
+        - ONNX：fbank 后交给 onnxruntime
+        - PyTorch：inference_mode 关闭 autograd 记录；GPU 上网络主干在 fp16 autocast 下运行（走 Tensor Core），
+          fbank 仍是 fp32，输出转回 fp32
+        
+        Args:
+            model: pipeline 底层的 Cam++ 模型
+            batch: (B, T) 16kHz 波形
+        
+        Returns:
+            (B, 192) float32 声纹向量
+        """
+        if self.ort_session is not None:
+            fbank = self._compute_fbank(batch).cpu().numpy()
+            return self.ort_session.run(None, {self._ort_input_name: fbank})[0]
+        
+        backbone = getattr(model, "embedding_model", None)
+        use_cuda = self.device.startswith("cuda")
+        with torch.inference_mode():
+            if backbone is None:
+                # 模型内部完成 fbank 和设备搬运
+                return model(batch).float().cpu().numpy()
+            
+            feats = self._compute_fbank(batch)
+            with torch.autocast(device_type="cuda", dtype=torch.float16, enabled=use_cuda):
+                embeddings = backbone(feats)
+            return embeddings.float().cpu().numpy()
+    
+    def load_audio(self, audio_path: str) -> Optional[torch.Tensor]:
+        """
+        整段解码为 16kHz 单声道波形：优先 torchaudio，失败时用 ffmpeg 兜底
+        
+        不依赖识别结果，调用方可以在 ASR 推理的同时提前解码，再传给 extract_speaker_segments
+        
+        Args:
+            audio_path: 原始音频路径
+        
+        Returns:
+            波形张量 (T,)，失败返回None
+        """
+        wav = self._load_waveform(audio_path)
+        if wav is None:
+            wav = self._decode_with_ffmpeg(audio_path)
+        return wav
+    
     def extract_speaker_segments(self,
                                   audio_path: str,
                                   transcript: List[Dict],
-                                  duration: int = 10) -> Dict[str, str]:
+                                  duration: int = 10,
+                                  wav: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
         """
         为每个说话人提取音频片段
         
+        整段音频只解码一次，各说话人的片段按采样点直接切片，留在内存中交给 match_speakers，
+        不再为每个说话人启动一次 ffmpeg、重复解码原文件、写临时 wav
+        
         Args:
             audio_path: 原始音频文件路径
             transcript: ASR识别结果，包含speaker_id和时间戳
             duration: 提取音频时长（秒）
+            wav: 已解码的整段波形（load_audio 的结果），为 None 时从 audio_path 解码
         
         Returns:
-            {speaker_id: audio_segment_path}
+            {speaker_id: 16kHz 单声道波形 (T,)}
         """
         if not self.enabled:
             return {}
         
         speaker_segments = {}
-        speaker_times = {}  # {speaker_id: [(start, end), ...]}
+        longest = {}  # {speaker_id: (start, end, 时长)}
         
-        # 1. 收集每个说话人的所有时间段
+        # 1. 一次遍历，只记录每个说话人最长的片段
         for item in transcript:
             speaker_id = item.get("speaker_id", "unknown")
+            if speaker_id == "unknown":
+                continue
+            
             start_time = item.get("start_time", 0)
             end_time = item.get("end_time", 0)
+            seg_duration = end_time - start_time
             
-            if speaker_id not in speaker_times:
-                speaker_times[speaker_id] = []
-            
-            speaker_times[speaker_id].append((start_time, end_time))
+            current = longest.get(speaker_id)
+            if current is None or seg_duration > current[2]:
+                longest[speaker_id] = (start_time, end_time, seg_duration)
         
-        # 2. 为每个说话人提取音频片段
-        for speaker_id, times in speaker_times.items():
-            if speaker_id == "unknown":
-                continue
-            
+        if not longest:
+            return {}
+        
+        # 2. 整段音频解码一次（调用方已提前解码时直接使用）
+        if wav is None:
+            wav = self.load_audio(audio_path)
+        if wav is None:
+            return {}
+        
+        sr = self.SAMPLE_RATE
+        total_samples = wav.numel()
+        
+        # 3. 为每个说话人切出音频片段
+        for speaker_id, (start, end, seg_duration) in longest.items():
             try:
-                # 找出该说话人最长的连续片段
-                sorted_times = sorted(times, key=lambda x: x[1] - x[0], reverse=True)
-                
-                # 取前几段，累计达到指定时长
-                accumulated_duration = 0
-                selected_segments = []
-                
-                for start, end in sorted_times:
-                    segment_duration = end - start
-                    if segment_duration >= 2:  # 至少2秒的片段才考虑
-                        selected_segments.append((start, end))
-                        accumulated_duration += segment_duration
-                        
-                        if accumulated_duration >= duration:
-                            break
-                
-                if not selected_segments:
+                # 最长的片段至少2秒才考虑
+                if seg_duration < 2:
                     logger.warning(f"⚠️ 说话人 {speaker_id} 没有足够长的音频片段")
                     continue
                 
-                # 提取第一段（最长的）
-                start, end = selected_segments[0]
-                segment_path = self._extract_audio_segment(
-                    audio_path, 
-                    start, 
-                    min(end, start + duration),
-                    speaker_id
-                )
+                # 取最长的一段，截到指定时长
+                segment_end = min(end, start + duration)
+                start_idx = min(int(start * sr), total_samples)
+                end_idx = min(int(segment_end * sr), total_samples)
                 
-                if segment_path:
-                    speaker_segments[speaker_id] = segment_path
-                    logger.info(f"✅ 提取说话人 {speaker_id} 音频: {start:.1f}s - {end:.1f}s")
+                if end_idx <= start_idx:
+                    logger.warning(f"⚠️ 说话人 {speaker_id} 的时间段超出音频长度")
+                    continue
+                
+                # clone 出独立的小片段，不再持有整段波形的引用，返回后整段音频即可释放
+                speaker_segments[speaker_id] = wav[start_idx:end_idx].clone()
+                logger.info(f"✅ 提取说话人 {speaker_id} 音频: {start:.1f}s - {end:.1f}s")
                 
             except Exception as e:
                 logger.error(f"❌ 提取说话人 {speaker_id} 音频失败: {e}")
         
         return speaker_segments
     
-    def _extract_audio_segment(self,
-                                audio_path: str,
-                                start_time: float,
-                                end_time: float,
-                                speaker_id: str) -> Optional[str]:
+    def _decode_with_ffmpeg(self, audio_path: str) -> Optional[torch.Tensor]:
         """
-        使用ffmpeg提取音频片段
+        torchaudio 无法解码时的兜底：用一次 ffmpeg 把整段音频解码成 16kHz 单声道 PCM
         
         Args:
             audio_path: 原始音频路径
-            start_time: 开始时间（秒）
-            end_time: 结束时间（秒）
-            speaker_id: 说话人ID
         
         Returns:
-            提取的音频片段路径，失败返回None
+            波形张量 (T,)，失败返回None
         """
         try:
-            # 创建临时文件
-            temp_dir = Path(tempfile.gettempdir())
-            output_path = temp_dir / f"speaker_{speaker_id}_{int(start_time)}.wav"
-            
-            # 使用ffmpeg提取片段
             cmd = [
                 "ffmpeg",
                 "-i", audio_path,
-                "-ss", str(start_time),
-                "-t", str(end_time - start_time),
                 "-ac", "1",              # 单声道
-                "-ar", "16000",          # 16kHz采样率
-                "-y",
+                "-ar", str(self.SAMPLE_RATE),  # 16kHz采样率
+                "-f", "s16le",           # 原始 PCM 输出到 stdout
                 "-loglevel", "error",
-                str(output_path)
+                "pipe:1"
             ]
             
-            subprocess.run(cmd, check=True, capture_output=True, timeout=30)
-            return str(output_path)
+            # 1MB 管道缓冲，整段 PCM 读取时减少 read() 次数
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20) as proc:
+                stdout, stderr = proc.communicate()
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+            # int16 -> float32 只分配一次，原地乘倒数
+            wav = np.frombuffer(stdout, dtype=np.int16).astype(np.float32)
+            wav *= 1.0 / 32768.0
+            return torch.from_numpy(wav)
             
         except FileNotFoundError:
-            logger.error("❌ ffmpeg 未安装，无法提取音频片段")
+            logger.error("❌ ffmpeg 未安装，无法解码音频")
             return None
         except subprocess.CalledProcessError as e:
-            logger.error(f"❌ ffmpeg 提取失败: {e.stderr.decode() if e.stderr else str(e)}")
+            logger.error(f"❌ ffmpeg 解码失败: {e.stderr.decode() if e.stderr else str(e)}")
             return None
         except Exception as e:
-            logger.error(f"❌ 提取音频片段异常: {e}")
+            logger.error(f"❌ 解码音频异常: {e}")
             return None
     
     def match_speakers(self, 
-                      speaker_segments: Dict[str, str],
-                      threshold: float = 0.75) -> Dict[str, Tuple[str, str, float]]:
+                      speaker_segments: Dict[str, Union[str, torch.Tensor]],
+                      threshold: float = 0.5) -> Dict[str, Tuple[str, str, float]]:
         """
         匹配说话人身份
         
+        所有说话人的声纹一次批量提取，再用一次 collection.query 批量检索
+        
         Args:
-            speaker_segments: {speaker_id: audio_path}
-            threshold: 相似度阈值（0-1）
+            speaker_segments: {speaker_id: 波形 (T,) 或 audio_path}（文件由调用方负责清理）
+            threshold: 余弦相似度阈值（-1~1）
         
         Returns:
             {speaker_id: (employee_id, name, similarity)}
         """
-        if not self.enabled:
+        if not self.enabled or not speaker_segments:
             return {}
         
         matched = {}
+        speaker_ids = list(speaker_segments.keys())
+        audios = [speaker_segments[sid] for sid in speaker_ids]
         
-        for speaker_id, audio_path in speaker_segments.items():
-            try:
-                # 1. 提取声纹向量
-                vector = self._extract_vector(audio_path)
-                
+        try:
+            # 1. 批量提取声纹向量
+            vectors = self._extract_vectors_batch(audios)
+            
+            query_speakers = []
+            query_vectors = []
+            for speaker_id, vector in zip(speaker_ids, vectors):
                 if vector is None:
                     logger.warning(f"⚠️ 说话人 {speaker_id} 声纹提取失败")
                     continue
-                
-                # 2. 在声纹库中搜索
-                results = self.collection.query(
-                    query_embeddings=[vector],
-                    n_results=1
-                )
-                
-                if not results['ids'] or len(results['ids'][0]) == 0:
+                query_speakers.append(speaker_id)
+                query_vectors.append(vector)
+            
+            if not query_vectors:
+                return {}
+            
+            # 2. 在声纹库中批量搜索，结果按查询顺序返回
+            best_matches = self._search_enrolled(query_vectors)
+            
+            # 3. 获取匹配结果
+            for speaker_id, best in zip(query_speakers, best_matches):
+                if best is None:
                     logger.warning(f"⚠️ 说话人 {speaker_id} 未在声纹库中找到匹配")
                     continue
                 
-                # 3. 获取匹配结果
-                employee_id = results['ids'][0][0]
-                metadata = results['metadatas'][0][0]
-                distance = results['distances'][0][0] if 'distances' in results else 0.5
-                
-                # 距离转相似度（cosine距离: 0=完全相同, 2=完全相反）
-                similarity = 1 - (distance / 2.0)
-                
-                name = metadata.get('name', '未知')
+                employee_id, name, similarity = best
                 
                 if similarity >= threshold:
                     matched[speaker_id] = (employee_id, name, similarity)
                     logger.info(f"✅ 说话人 {speaker_id} 匹配成功: {name} (相似度: {similarity:.2%})")
                 else:
                     logger.warning(f"⚠️ 说话人 {speaker_id} 相似度过低: {similarity:.2%} < {threshold:.2%}")
-                
-                # 清理临时文件
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
-                
-            except Exception as e:
-                logger.error(f"❌ 匹配说话人 {speaker_id} 失败: {e}")
+            
+        except Exception as e:
+            logger.error(f"❌ 匹配说话人失败: {e}")
         
         return matched
     
-    def _extract_vector(self, audio_path: str) -> Optional[List[float]]:
+    def _load_enrolled_matrix(self) -> Optional[Tuple[np.ndarray, List[str], List[str], float, str]]:
         """
-        提取声纹向量
+        把声纹库整体拉到内存并 L2 归一化，之后匹配只做一次矩阵乘法，不再请求 Chroma
+        声纹数超过 MATRIX_MAX_ROWS 时不加载，继续走 Chroma 查询
+        
+        调用方需持有 self._enrolled_lock；新快照在局部变量中构建完成后一次性发布
+        
+        Returns:
+            新的声纹库快照，未加载时为None
+        """
+        try:
+            count = self.collection.count()
+            if count == 0 or count > self.MATRIX_MAX_ROWS:
+                self._enrolled = None
+                return None
+            
+            data = self.collection.get(include=["embeddings", "metadatas"])
+            matrix = np.asarray(data["embeddings"], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            
+            ids = list(data["ids"])
+            names = [(meta or {}).get("name", "未知") for meta in data["metadatas"]]
+            # 内容版本：工号 + 姓名 + 向量的哈希，声纹库有注册/覆盖/删除时随之变化
+            digest = hashlib.sha256("\x00".join(ids + names).encode("utf-8"))
+            digest.update(matrix.tobytes())
+            snapshot = (matrix / norms, ids, names, time.monotonic(), digest.hexdigest())
+            
+        except Exception as e:
+            logger.warning(f"⚠️ 声纹库载入内存失败，使用 Chroma 查询: {e}")
+            self._enrolled = None
+            return None
+        
+        self._enrolled = snapshot
+        logger.info(f"✅ 声纹库已载入内存: {len(ids)} 个声纹")
+        return snapshot
+    
+    def _get_enrolled_snapshot(self) -> Optional[Tuple[np.ndarray, List[str], List[str], float, str]]:
+        """获取当前声纹库快照；未载入或超过 MATRIX_TTL_SECONDS 时重新载入"""
+        snapshot = self._enrolled
+        if snapshot is not None and time.monotonic() - snapshot[3] <= self.MATRIX_TTL_SECONDS:
+            return snapshot
+        
+        with self._enrolled_lock:
+            # 等锁期间其他线程可能已经刷新过
+            snapshot = self._enrolled
+            if snapshot is not None and time.monotonic() - snapshot[3] <= self.MATRIX_TTL_SECONDS:
+                return snapshot
+            return self._load_enrolled_matrix()
+    
+    def reload_enrolled(self) -> int:
+        """
+        声纹库有注册/删除后调用：立即重新载入内存声纹库，不必等 MATRIX_TTL_SECONDS 过期
+        
+        Returns:
+            当前声纹库中的声纹数
+        """
+        if not hasattr(self, "collection"):
+            return 0
+        
+        with self._enrolled_lock:
+            self._load_enrolled_matrix()
+        
+        # 启动时声纹库为空会禁用匹配，有新注册后重新启用
+        count = self.collection.count()
+        self.enabled = count > 0
+        return count
+    
+    def library_version(self) -> str:
+        """
+        声纹库版本（供上游识别结果缓存作为指纹）：内存快照的内容哈希；
+        声纹库过大未载入内存时退化为声纹数，匹配未启用时为 "disabled"
+        """
+        if not self.enabled:
+            return "disabled"
+        snapshot = self._get_enrolled_snapshot()
+        if snapshot is not None:
+            return snapshot[4]
+        return f"count={self.collection.count()}"
+    
+    def _search_enrolled(self, query_vectors: List[np.ndarray]) -> List[Optional[Tuple[str, str, float]]]:
+        """
+        为每个查询向量找到最相似的已注册声纹
+        
+        Returns:
+            与 query_vectors 一一对应的 (employee_id, name, similarity)，无结果为None
+        """
+        snapshot = self._get_enrolled_snapshot()
+        
+        # 查询向量归一化为单位向量：点积即余弦相似度
+        q = np.stack(query_vectors)
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        
+        if snapshot is not None:
+            matrix, ids, names, _, _ = snapshot
+            sims = q @ matrix.T  # (K, N) 余弦相似度
+            best = sims.argmax(axis=1)
+            return [
+                (ids[j], names[j], float(sims[i, j]))
+                for i, j in enumerate(best)
+            ]
+        
+        # 声纹库过大或载入失败：一次批量请求 Chroma
+        results = self.collection.query(
+            query_embeddings=q.tolist(),
+            n_results=1
+        )
+        
+        best_matches = []
+        for i in range(len(query_vectors)):
+            if not results['ids'][i]:
+                best_matches.append(None)
+                continue
+            
+            metadata = results['metadatas'][i][0] or {}
+            distance = results['distances'][i][0] if 'distances' in results else 1.0
+            
+            # cosine 距离 = 1 - 余弦相似度
+            similarity = 1.0 - distance
+            best_matches.append((results['ids'][i][0], metadata.get('name', '未知'), similarity))
+        
+        return best_matches
+    
+    def _load_waveform(self, audio_path: str) -> Optional[torch.Tensor]:
+        """
+        读取音频为 16kHz 单声道一维波形
         
         Args:
             audio_path: 音频文件路径
         
+        Returns:
+            波形张量 (T,)，失败返回None
+        """
+        try:
+            wav, sr = torchaudio.load(audio_path)
+            if wav.shape[0] > 1:
+                wav = wav.mean(dim=0, keepdim=True)
+            if sr != self.SAMPLE_RATE:
+                wav = torchaudio.functional.resample(wav, sr, self.SAMPLE_RATE)
+            return wav[0]
+        except Exception as e:
+            logger.error(f"❌ 读取音频失败 {audio_path}: {e}")
+            return None
+    
+    def _extract_vectors_batch(self, audios: List[Union[str, torch.Tensor]]) -> List[Optional[np.ndarray]]:
+        """
+        批量提取声纹向量
+        
+        绕过 pipeline 的逐条调用，直接把多条波形拼成一个 batch 交给 Cam++ 模型前向一次。
+        Cam++ 没有 padding mask（统计池化会把补零算进去），所以按采样点数分组，
+        同样长度的片段才放进同一个 batch；说话人片段大多被截成固定时长，通常只有一两组。
+        
+        Args:
+            audios: 16kHz 波形 (T,) 或音频文件路径列表
+        
+        Returns:
+            与 audios 一一对应的声纹向量，失败的位置为None
+        """
+        vectors: List[Optional[np.ndarray]] = [None] * len(audios)
+        model = getattr(self.embedding_model, "model", None)
+        
+        if model is None and self.ort_session is None:
+            # 拿不到底层模型时退回逐条推理
+            return self._extract_vectors_each(audios)
+        
+        # 1. 读取波形，命中缓存的直接返回，其余按长度分组
+        groups: Dict[int, List[Tuple[int, torch.Tensor]]] = {}
+        keys: Dict[int, str] = {}
+        for i, audio in enumerate(audios):
+            wav = audio if isinstance(audio, torch.Tensor) else self._load_waveform(audio)
+            if wav is None or wav.numel() == 0:
+                continue
+            
+            key = self._embedding_cache_key(wav)
+            cached = self._get_cached_embedding(key)
+            if cached is not None:
+                vectors[i] = cached
+                continue
+            
+            keys[i] = key
+            groups.setdefault(wav.numel(), []).append((i, wav))
+        
+        # 2. 每组一次前向
+        for items in groups.values():
+            indices = [i for i, _ in items]
+            try:
+                batch = torch.stack([wav for _, wav in items])  # (B, T)
+                embeddings = self._embed_batch(model, batch)  # (B, 192)
+                for i, row in zip(indices, embeddings):
+                    vectors[i] = np.asarray(row, dtype=np.float32)
+            except Exception as e:
+                logger.warning(f"⚠️ 批量提取声纹失败，改为逐条提取: {e}")
+                for i, vector in zip(indices, self._extract_vectors_each([wav for _, wav in items])):
+                    vectors[i] = vector
+            
+            for i in indices:
+                if vectors[i] is not None:
+                    self._put_cached_embedding(keys[i], vectors[i])
+        
+        logger.info(f"📐 批量提取声纹: {len(audios)} 段，{len(groups)} 个批次，缓存命中 {len(audios) - len(keys)} 段")
+        return vectors
+    
+    def _extract_vectors_each(self, audios: List[Union[str, torch.Tensor]]) -> List[Optional[np.ndarray]]:
+        """
+        逐条提取声纹（无法批量前向时的兜底）
+        CPU 上用线程池并行：解码、fbank 与 ATen 算子都会释放 GIL，多线程即可重叠；GPU 上顺序执行
+        """
+        if self.device != "cpu" or len(audios) <= 1 or EXTRACT_MAX_WORKERS <= 1:
+            return [self._extract_vector(audio) for audio in audios]
+        
+        return list(_get_extract_executor().map(self._extract_vector, audios))
+    
+    @staticmethod
+    def _embedding_cache_key(wav: torch.Tensor) -> str:
+        """按波形内容（16kHz float32 PCM）计算缓存键"""
+        return hashlib.sha256(wav.contiguous().numpy().tobytes()).hexdigest()
+    
+    def _get_cached_embedding(self, key: str) -> Optional[np.ndarray]:
+        """读取声纹缓存，命中时移到队尾（LRU）"""
+        with self._emb_cache_lock:
+            vector = self._emb_cache.get(key)
+            if vector is None:
+                self.cache_misses += 1
+                return None
+            self._emb_cache.move_to_end(key)
+            self.cache_hits += 1
+            return vector
+    
+    def _put_cached_embedding(self, key: str, vector: np.ndarray) -> None:
+        """写入声纹缓存，超出容量淘汰最久未用的条目"""
+        with self._emb_cache_lock:
+            self._emb_cache[key] = vector
+            self._emb_cache.move_to_end(key)
+            while len(self._emb_cache) > self.EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+    
+    @property
+    def cache_stats(self) -> Dict[str, int]:
+        """声纹缓存统计（用于观察命中率）"""
+        return {
+            "size": len(self._emb_cache),
+            "hits": self.cache_hits,
+            "misses": self.cache_misses
+        }
+    
+    def _extract_vector(self, audio: Union[str, torch.Tensor]) -> Optional[np.ndarray]:
+        """
+        提取声纹向量
+        
+        Args:
+            audio: 音频文件路径或 16kHz 波形 (T,)
+        
         Returns:
             声纹向量（192维），失败返回None
         """
         try:
-            res = self.embedding_model(audio_path)
+            if isinstance(audio, torch.Tensor):
+                audio = audio.numpy()
+            with torch.inference_mode():
+                res = self.embedding_model(audio)
             
             if res and 'spk_embedding' in res:
-                vector = res['spk_embedding']
-                
-                # 转换为Python list
-                if hasattr(vector, 'tolist'):
-                    vector = vector.tolist()
-                
-                return vector
+                # 保持 float32 数组，只在交给 Chroma 时才转 list
+                return np.asarray(res['spk_embedding'], dtype=np.float32).reshape(-1)
             else:
                 logger.error(f"❌ 模型未返回 spk_embedding: {res}")
                 return None
@@ -323,7 +778,7 @@ class VoiceMatcher:
                 item["speaker_name"] = name
                 item["employee_id"] = employee_id
                 item["voice_similarity"] = round(similarity, 3)
-                logger.debug(f"替换: speaker_{speaker_id} → {name}")
+                logger.debug("替换: speaker_%s → %s", speaker_id, name)
         
         return transcript
 
@@ -337,7 +792,10 @@ def get_voice_matcher() -> Optional[VoiceMatcher]:
     global _voice_matcher
     if _voice_matcher is None:
         try:
-            _voice_matcher = VoiceMatcher()
+            _voice_matcher = VoiceMatcher(
+                quantize=os.getenv("VOICE_QUANTIZE", "false").lower() == "true",
+                onnx_path=os.getenv("CAMPPLUS_ONNX_PATH", str(DEFAULT_ONNX_PATH))
+            )
         except Exception as e:
             logger.error(f"❌ 初始化声纹匹配器失败: {e}")
             return None
@@ -9,6 +9,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.core.logger import logger
 from app.api.endpoints import router
+from app.services.archive_queue import archive_queue
 
 # ✅ 确保标准输出使用UTF-8编码（Windows兼容）
 if sys.platform == "win32":
@@ -38,6 +39,18 @@ app.add_middleware(
 app.include_router(router, prefix="/api/v1", tags=["会议处理"])
 
 
+@app.on_event("startup")
+async def start_archive_queue():
+    """启动知识归档后台队列"""
+    archive_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_archive_queue():
+    """关闭前写完队列中剩余的归档"""
+    await archive_queue.stop()
+
+
 @app.get("/")
 async def root():
     """根路径，健康检查"""